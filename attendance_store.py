@@ -0,0 +1,350 @@
+# description: SQLite store for attendance check-ins. Check-ins are buffered and written in groups instead of opening a file for
+#              every row, and the table is indexed by user and by date so the viewer and reports only read the rows they need.
+#              Daily and weekly aggregates per user are updated in the same transaction as the check-ins, so reports never scan
+#              the raw check-ins. Repeat check-ins of the same user within a cooldown window are collapsed before they reach the
+#              buffer. The old attendance.csv is imported once.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import atexit                             # for flushing buffered check-ins when the program exits
+import csv                                # for importing the old attendance.csv
+import sqlite3                            # for the indexed attendance database
+import threading                          # for guarding the buffer and the background flush
+import time                               # for the age of the buffer
+from datetime import date, datetime, timedelta      # for check-in timestamps, date ranges and weeks
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from ttl_cache import TTLCache            # for the check-in cooldown
+
+
+# Define the path to the attendance database
+attendance_db_path: Path = Path("attendance.db")
+
+# Define the path to the CSV file attendance used to be kept in
+csv_attendance_path: Path = Path("attendance.csv")
+
+# Buffered check-ins are written once this many are waiting
+BATCH_SIZE: int = 100
+
+# ... or once the oldest one has waited this many seconds
+FLUSH_INTERVAL: float = 1.0
+
+# Seconds after a check-in during which further check-ins of the same user are dropped, 0 keeps every check-in
+COOLDOWN_SECONDS: float = 300.0
+
+# Most users remembered by the cooldown, the least recently seen one is forgotten beyond this
+COOLDOWN_ENTRIES: int = 10000
+
+# Date format of the old attendance.csv and of the viewer
+DISPLAY_DATE_FORMAT: str = "%m-%d-%Y"
+
+# A first check-in after this time of day counts as a late arrival, call rebuild_aggregates() after changing it
+LATE_AFTER: str = "09:00:00"
+
+# Updates one day of one user with a check-in, keeping the earliest and latest time
+DAILY_UPSERT: str = (
+    "INSERT INTO daily (email, date, week, first_in, last_out, check_ins) VALUES (?, ?, ?, ?, ?, 1) "
+    "ON CONFLICT (email, date) DO UPDATE SET "
+    "first_in = MIN(first_in, excluded.first_in), last_out = MAX(last_out, excluded.last_out), check_ins = check_ins + 1"
+)
+
+# Recomputes the weekly totals from the days of the week, hours present are from the first check-in to the last one of each day
+WEEKLY_TOTALS: str = (
+    "SELECT email, week, COUNT(*), SUM(strftime('%s', last_out) - strftime('%s', first_in)), SUM(first_in > ?) FROM daily"
+)
+
+# Shared connection, buffer and lock of this process
+_connection: sqlite3.Connection | None = None
+_pending: list[tuple[str, str, str]] = []
+_pending_since: float = 0.0
+_lock = threading.RLock()
+_flusher: threading.Thread | None = None
+_cooldown = TTLCache(COOLDOWN_SECONDS, COOLDOWN_ENTRIES)
+
+
+#=========================================================================================================================================
+# function that opens the attendance database once per process
+def connect() -> sqlite3.Connection:
+    """
+        Opens the shared connection to the attendance database, creating the table and importing attendance.csv if needed
+
+        Returns:
+            connection (sqlite3.Connection): The shared connection
+    """
+    global _connection
+    with _lock:
+        if _connection is None:
+            connection = sqlite3.connect(attendance_db_path, timeout=30, check_same_thread=False)
+            # Readers, like a long export, do not block the check-ins being written
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.create_function("week_of", 1, week_of, deterministic=True)
+            with connection:
+                # Dates are stored as YYYY-MM-DD so they sort and compare as text
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS attendance ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "email TEXT NOT NULL, "
+                    "date TEXT NOT NULL, "
+                    "time TEXT NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS attendance_by_user ON attendance (email, date)")
+                connection.execute("CREATE INDEX IF NOT EXISTS attendance_by_date ON attendance (date)")
+                connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                # One row per user and day they checked in, and per user and week (weeks start on Monday)
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS daily ("
+                    "email TEXT NOT NULL, "
+                    "date TEXT NOT NULL, "
+                    "week TEXT NOT NULL, "
+                    "first_in TEXT NOT NULL, "
+                    "last_out TEXT NOT NULL, "
+                    "check_ins INTEGER NOT NULL, "
+                    "PRIMARY KEY (email, date))"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS daily_by_date ON daily (date)")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS weekly ("
+                    "email TEXT NOT NULL, "
+                    "week TEXT NOT NULL, "
+                    "days_present INTEGER NOT NULL, "
+                    "seconds_present INTEGER NOT NULL, "
+                    "late_arrivals INTEGER NOT NULL, "
+                    "PRIMARY KEY (email, week))"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS weekly_by_week ON weekly (week)")
+            migrate_from_csv(connection)
+            # Databases from before the aggregates existed get them built once
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'aggregates_built'").fetchone() is None:
+                rebuild_aggregates(connection)
+            _connection = connection
+        return _connection
+
+#=========================================================================================================================================
+# function that imports attendance.csv into the database once
+def migrate_from_csv(connection: sqlite3.Connection) -> int:
+    """
+        Imports the rows of attendance.csv, only the first time the database is opened
+
+        Args:
+            connection (sqlite3.Connection): Open connection to the attendance database
+
+        Returns:
+            imported (int): Number of check-ins imported
+    """
+    # Already migrated, or nothing to migrate
+    if connection.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone() is not None:
+        return 0
+    imported: int = 0
+    with connection:
+        if csv_attendance_path.is_file():
+            with open(csv_attendance_path, "r") as file:
+                reader: csv.DictReader = csv.DictReader(file)  # Read rows as dictionaries
+                rows = ((row["email"], to_iso(row["date"]), row["time"]) for row in reader)
+                cursor = connection.executemany("INSERT INTO attendance (email, date, time) VALUES (?, ?, ?)", rows)
+                imported = cursor.rowcount
+            print(f"Imported {imported} check-ins from {csv_attendance_path}")
+        connection.execute("INSERT INTO meta (key, value) VALUES ('csv_migrated', ?)", (str(imported),))
+    return imported
+
+#=========================================================================================================================================
+# functions that convert between the display date format and the stored one
+def to_iso(display_date: str) -> str:
+    return datetime.strptime(display_date, DISPLAY_DATE_FORMAT).date().isoformat()
+
+def to_display(iso_date: str) -> str:
+    return date.fromisoformat(iso_date).strftime(DISPLAY_DATE_FORMAT)
+
+def week_of(iso_date: str) -> str:
+    day = date.fromisoformat(iso_date)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+#=========================================================================================================================================
+# function that opens a separate read-only connection
+def open_reader() -> sqlite3.Connection:
+    """
+        Opens a read-only connection of its own, for long reads like exports that should not hold the shared lock
+
+        Returns:
+            connection (sqlite3.Connection): Read-only connection to the attendance database
+    """
+    connect()
+    flush()
+    return sqlite3.connect(f"file:{attendance_db_path}?mode=ro", uri=True, timeout=30)
+
+#=========================================================================================================================================
+# function that runs a read query on the shared connection
+def query(sql: str, parameters: tuple | list = ()) -> list[tuple]:
+    """
+        Writes the buffered check-ins, then runs a short read query on the shared connection and returns every row.
+        Reports use it so they see every check-in recorded so far without touching the connection or its lock.
+
+        Args:
+            sql (str): The SELECT statement
+            parameters (tuple | list): Values for its placeholders
+
+        Returns:
+            rows (list[tuple]): Every row of the result
+    """
+    flush()
+    with _lock:
+        return connect().execute(sql, parameters).fetchall()
+
+#=========================================================================================================================================
+# function that brings the aggregates up to date with a group of check-ins
+def update_aggregates(connection: sqlite3.Connection, rows: list[tuple[str, str, str]]) -> None:
+    """
+        Folds check-ins into the daily aggregates and recomputes the weekly totals of the weeks they touch.
+        Only the days and weeks of the given check-ins are read, however large the table is.
+
+        Args:
+            connection (sqlite3.Connection): Open connection, the caller holds the transaction
+            rows (list[tuple[str, str, str]]): (email, date, time) of the check-ins, dates as YYYY-MM-DD
+    """
+    connection.executemany(DAILY_UPSERT, ((email, day, week_of(day), at, at) for email, day, at in rows))
+    weeks = {(email, week_of(day)) for email, day, _ in rows}
+    connection.executemany(f"INSERT OR REPLACE INTO weekly {WEEKLY_TOTALS} WHERE email = ? AND week = ? GROUP BY email, week",
+                           ((LATE_AFTER, email, week) for email, week in weeks))
+
+#=========================================================================================================================================
+# function that rebuilds the aggregates from every check-in
+def rebuild_aggregates(connection: sqlite3.Connection | None = None) -> None:
+    """
+        Rebuilds the daily and weekly aggregates from the raw check-ins in one pass each, needed once for
+        databases created before the aggregates existed and after changing LATE_AFTER
+
+        Args:
+            connection (sqlite3.Connection | None): Open connection, None uses the shared one
+    """
+    with _lock:
+        connection = connection or connect()
+        with connection:
+            connection.execute("DELETE FROM daily")
+            connection.execute("DELETE FROM weekly")
+            connection.execute(
+                "INSERT INTO daily (email, date, week, first_in, last_out, check_ins) "
+                "SELECT email, date, week_of(date), MIN(time), MAX(time), COUNT(*) FROM attendance GROUP BY email, date"
+            )
+            connection.execute(f"INSERT INTO weekly {WEEKLY_TOTALS} GROUP BY email, week", (LATE_AFTER,))
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aggregates_built', ?)", (datetime.now().isoformat(),))
+
+#=========================================================================================================================================
+# function that buffers a check-in
+def record(email: str, when: datetime | None = None) -> bool:
+    """
+        Adds a check-in to the write buffer, the buffer is written in one transaction when it is full or old enough.
+        A user recognized again within COOLDOWN_SECONDS of their last recorded check-in is not recorded again.
+
+        Args:
+            email (str): The email of the signed in user
+            when (datetime | None): Time of the check-in, defaults to now
+
+        Returns:
+            recorded (bool): False if the check-in was dropped by the cooldown
+    """
+    global _pending_since, _flusher
+    when = when or datetime.now()
+    # A person standing in front of a camera is recognized over and over, only the first time in the window counts
+    if COOLDOWN_SECONDS > 0 and not _cooldown.add_if_absent(email, True, when.timestamp()):
+        return False
+    with _lock:
+        if not _pending:
+            _pending_since = time.monotonic()
+        _pending.append((email, when.date().isoformat(), when.strftime("%H:%M:%S")))
+        if len(_pending) >= BATCH_SIZE:
+            flush()
+        # Start the background flush the first time something is buffered, and flush whatever is left at exit
+        elif _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+    return True
+
+#=========================================================================================================================================
+# function that writes every buffered check-in
+def flush() -> int:
+    """
+        Writes every buffered check-in in a single transaction
+
+        Returns:
+            written (int): Number of check-ins written
+    """
+    with _lock:
+        if not _pending:
+            return 0
+        connection = connect()
+        with connection:
+            connection.executemany("INSERT INTO attendance (email, date, time) VALUES (?, ?, ?)", _pending)
+            # The aggregates change in the same transaction, so reports always agree with the check-ins
+            update_aggregates(connection, _pending)
+        written = len(_pending)
+        _pending.clear()
+        return written
+
+#=========================================================================================================================================
+# function run by the background thread that flushes buffered check-ins in time
+def _flush_periodically() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL / 2)
+        with _lock:
+            if _pending and time.monotonic() - _pending_since >= FLUSH_INTERVAL:
+                flush()
+
+#=========================================================================================================================================
+# function that lists the check-ins of one user
+def user_between(email: str, start: date | None = None, end: date | None = None) -> list[tuple[str, str]]:
+    """
+        Lists the check-ins of a user, optionally limited to a date range, using the per-user index
+
+        Args:
+            email (str): Email of the user
+            start (date | None): First day to include, None for no lower limit
+            end (date | None): Last day to include, None for no upper limit
+
+        Returns:
+            rows (list[tuple[str, str]]): (date, time) of every check-in in chronological order, dates as YYYY-MM-DD
+    """
+    flush()
+    low = start.isoformat() if start else "0000-00-00"
+    high = end.isoformat() if end else "9999-99-99"
+    with _lock:
+        return connect().execute(
+            "SELECT date, time FROM attendance WHERE email = ? AND date BETWEEN ? AND ? ORDER BY date, time",
+            (email, low, high),
+        ).fetchall()
+
+#=========================================================================================================================================
+# function that lists everyone present on a day
+def present_on(day: date) -> list[str]:
+    """
+        Lists every user that checked in on a day, using the date index
+
+        Args:
+            day (date): The day to look at
+
+        Returns:
+            emails (list[str]): Email of every user present that day
+    """
+    flush()
+    with _lock:
+        rows = connect().execute("SELECT DISTINCT email FROM attendance WHERE date = ? ORDER BY email", (day.isoformat(),))
+        return [row[0] for row in rows]
+
+#=========================================================================================================================================
+# function that counts the users present on every day of a range
+def daily_counts(start: date, end: date) -> list[tuple[str, int]]:
+    """
+        Counts the distinct users present on every day of a range
+
+        Args:
+            start (date): First day to include
+            end (date): Last day to include
+
+        Returns:
+            counts (list[tuple[str, int]]): (date, users present) for every day with at least one check-in, dates as YYYY-MM-DD
+    """
+    flush()
+    with _lock:
+        return connect().execute(
+            "SELECT date, COUNT(DISTINCT email) FROM attendance WHERE date BETWEEN ? AND ? GROUP BY date ORDER BY date",
+            (start.isoformat(), end.isoformat()),
+        ).fetchall()
@@ -0,0 +1,146 @@
+# description: Quality-gated automatic enrollment. Instead of saving whatever is on screen when SPACE is pressed, every frame is
+#              scored as it arrives (exactly one face, big enough, sharp enough, and a pose different from the frames already
+#              kept) and the ten most useful frames are kept without any key presses.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import cv2                                # for the camera, sharpness and drawing
+import numpy as np                        # for numerical operations
+import time                               # for the capture time limit
+from detectors import Detector, DlibDetector      # for the configurable face detector
+import batch_encoder                      # for encoding the candidate faces
+
+
+# Number of frames to keep
+TARGET_FRAMES: int = 10
+
+# Lowest variance of the Laplacian of the face, below this the face is too blurry
+MIN_SHARPNESS: float = 60.0
+
+# Smallest face height in pixels
+MIN_FACE_SIZE: int = 80
+
+# Smallest encoding distance to every kept frame, so each kept frame adds a new pose or expression
+MIN_DIVERSITY: float = 0.12
+
+# Seconds to keep improving the kept frames once enough are kept
+MIN_SECONDS: float = 8.0
+
+# Seconds to wait before giving up with fewer frames
+MAX_SECONDS: float = 45.0
+
+# Prompts cycled on screen so the user moves through different poses
+PROMPTS: list[str] = ["Look straight", "Turn slowly left", "Turn slowly right", "Look up", "Look down", "Tilt your head", "Smile"]
+
+
+#=========================================================================================================================================
+# function that measures how sharp a face is
+def sharpness(frame: np.ndarray, box: tuple[int, int, int, int]) -> float:
+    """
+        Measures the sharpness of the face as the variance of the Laplacian, blurry faces have few edges and score low
+
+        Args:
+            frame (np.ndarray): Frame in OpenCV BGR order
+            box (tuple[int, int, int, int]): Face location as (top, right, bottom, left)
+
+        Returns:
+            score (float): Variance of the Laplacian of the face
+    """
+    top, right, bottom, left = box
+    gray_face = cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray_face, cv2.CV_64F).var())
+
+#=========================================================================================================================================
+# function that checks a frame and encodes its face if it passes
+def score_frame(frame: np.ndarray, detector: Detector) -> tuple[np.ndarray | None, float, str]:
+    """
+        Checks a frame for a single, big enough and sharp face and encodes it
+
+        Args:
+            frame (np.ndarray): Frame in OpenCV BGR order
+            detector (Detector): Face detector
+
+        Returns:
+            result (tuple[np.ndarray | None, float, str]): The encoding (None if rejected), the sharpness and the reason for a rejection
+    """
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    boxes = detector(rgb_frame)
+    # The cheap checks come first so only promising frames are encoded
+    if not boxes:
+        return None, 0.0, "No face found"
+    if len(boxes) > 1:
+        return None, 0.0, "Only one person please"
+    top, right, bottom, left = boxes[0]
+    if bottom - top < MIN_FACE_SIZE:
+        return None, 0.0, "Come closer"
+    face_sharpness = sharpness(frame, boxes[0])
+    if face_sharpness < MIN_SHARPNESS:
+        return None, face_sharpness, "Hold still"
+    return batch_encoder.encode_faces([rgb_frame], [boxes])[0][0], face_sharpness, ""
+
+#=========================================================================================================================================
+# function that captures the most useful frames without key presses
+def capture_best_frames(video: cv2.VideoCapture, detector: Detector | None = None, target: int = TARGET_FRAMES,
+                        show: bool = True) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+        Scores frames as they arrive and keeps the ones that add a new pose, until enough are kept or time runs out.
+        A frame is kept if its encoding is far enough from every kept frame. Once enough frames are kept,
+        a new frame still replaces a kept one if that makes the kept set more varied.
+
+        Args:
+            video (cv2.VideoCapture): Opened camera
+            detector (Detector | None): Face detector, None uses the HOG detector
+            target (int): Number of frames to keep
+            show (bool): Show the camera feed with guidance
+
+        Returns:
+            kept (list[tuple[np.ndarray, np.ndarray]]): (frame, encoding) of every kept frame
+    """
+    detector = detector or DlibDetector()
+    kept: list[tuple[np.ndarray, np.ndarray]] = []
+    start_time = time.perf_counter()
+    print("Move your head slowly, photos are taken automatically. Press Q to quit.")
+
+    while time.perf_counter() - start_time < MAX_SECONDS:
+        ret, frame = video.read()
+        if not ret:
+            print("Failed to capture frame from camera.")
+            break
+
+        encoding, _, reason = score_frame(frame, detector)
+        if encoding is not None:
+            if not kept:
+                kept.append((frame, encoding))
+            else:
+                # How far the new face is from the closest kept face
+                kept_matrix = np.asarray([kept_encoding for _, kept_encoding in kept])
+                diversity = float(np.linalg.norm(kept_matrix - encoding, axis=1).min())
+                if diversity < MIN_DIVERSITY:
+                    reason = "Try a different pose"
+                elif len(kept) < target:
+                    kept.append((frame, encoding))
+                else:
+                    # Replace the kept frame that is closest to the others if the new one is more distinct
+                    pairwise = np.linalg.norm(kept_matrix[:, None, :] - kept_matrix[None, :, :], axis=2)
+                    np.fill_diagonal(pairwise, np.inf)
+                    closest = int(np.argmin(pairwise.min(axis=1)))
+                    if diversity > float(pairwise[closest].min()):
+                        kept[closest] = (frame, encoding)
+
+        # Once enough frames are kept, keep looking for a moment so more varied frames can replace similar ones
+        if len(kept) >= target and time.perf_counter() - start_time >= MIN_SECONDS:
+            break
+
+        if show:
+            # Guidance on top, progress at the bottom
+            frame_copy = frame.copy()
+            prompt = reason or PROMPTS[len(kept) % len(PROMPTS)]
+            cv2.putText(frame_copy, prompt, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0) if not reason else (0, 165, 255), 2)
+            cv2.putText(frame_copy, f"{len(kept)}/{target} photos. Press Q to quit.", (10, 470), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+            cv2.imshow("Capture Your Face", frame_copy)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                print("Exiting photo capture early...")
+                break
+
+    return kept
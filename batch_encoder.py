@@ -0,0 +1,110 @@
+# description: Batched face encoding. face_recognition.face_encodings runs the landmark model, the alignment and the encoder network
+#              once per face, so encoding a gallery photo by photo pays the per-call overhead thousands of times. Here the
+#              landmarks of every face are found first, every face is cut out as an aligned 150x150 chip, and all chips go through
+#              dlib's encoder as one stacked batch. The result is the same 128-d encoding face_recognition computes.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import dlib                               # for aligned face chips and the batched encoder
+import face_recognition                   # for the landmark and encoder models it ships with
+import cv2                                # for color conversion before encoding
+import numpy as np                        # for numerical operations
+from detectors import Box, Detector       # for the configurable face detector
+
+
+# Most face chips handed to the encoder at once, bounds the memory of a batch
+BATCH_SIZE: int = 64
+
+# Size and padding of the aligned face chips, the values face_recognition uses
+CHIP_SIZE: int = 150
+CHIP_PADDING: float = 0.25
+
+
+#=========================================================================================================================================
+# function that cuts every face out of an image as an aligned chip
+def face_chips(rgb_img: np.ndarray, boxes: list[Box]) -> list[np.ndarray]:
+    """
+        Finds the landmarks of every face and cuts each face out, rotated and scaled so the eyes and nose line up
+
+        Args:
+            rgb_img (np.ndarray): Image in RGB order
+            boxes (list[Box]): Face locations as (top, right, bottom, left)
+
+        Returns:
+            chips (list[np.ndarray]): One CHIP_SIZE x CHIP_SIZE RGB chip per face
+    """
+    if not boxes:
+        return []
+    landmarks = dlib.full_object_detections()
+    for top, right, bottom, left in boxes:
+        # The 5 point model, the default of face_recognition.face_encodings
+        landmarks.append(face_recognition.api.pose_predictor_5_point(rgb_img, dlib.rectangle(left, top, right, bottom)))
+    return dlib.get_face_chips(rgb_img, landmarks, size=CHIP_SIZE, padding=CHIP_PADDING)
+
+#=========================================================================================================================================
+# function that encodes many aligned chips with one call to the encoder
+def encode_chips(chips: list[np.ndarray], num_jitters: int = 1) -> np.ndarray:
+    """
+        Runs the encoder network on stacked batches of aligned face chips
+
+        Args:
+            chips (list[np.ndarray]): Aligned face chips from face_chips()
+            num_jitters (int): How many randomly distorted copies of each chip are averaged, 1 means none
+
+        Returns:
+            encodings (np.ndarray): One 128-d encoding per chip, shape (len(chips), 128)
+    """
+    encodings: list[np.ndarray] = []
+    for start in range(0, len(chips), BATCH_SIZE):
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(chips[start:start + BATCH_SIZE], num_jitters)
+        encodings.extend(np.array(descriptor) for descriptor in descriptors)
+    return np.asarray(encodings).reshape(len(encodings), 128)
+
+#=========================================================================================================================================
+# function that encodes the faces of many images in one batch
+def encode_faces(rgb_images: list[np.ndarray], boxes_per_image: list[list[Box]], num_jitters: int = 1) -> list[list[np.ndarray]]:
+    """
+        Encodes every given face of every image, the faces of all images share the encoder batches
+
+        Args:
+            rgb_images (list[np.ndarray]): Images in RGB order
+            boxes_per_image (list[list[Box]]): Face locations of each image as (top, right, bottom, left)
+            num_jitters (int): How many randomly distorted copies of each face are averaged, 1 means none
+
+        Returns:
+            encodings (list[list[np.ndarray]]): The encodings of each image, in the order of its boxes
+    """
+    chips: list[np.ndarray] = []
+    for rgb_img, boxes in zip(rgb_images, boxes_per_image):
+        chips.extend(face_chips(rgb_img, boxes))
+    encodings = encode_chips(chips, num_jitters) if chips else []
+
+    # Hand the flat list of encodings back out per image
+    result: list[list[np.ndarray]] = []
+    position: int = 0
+    for boxes in boxes_per_image:
+        result.append(list(encodings[position:position + len(boxes)]))
+        position += len(boxes)
+    return result
+
+#=========================================================================================================================================
+# function that encodes the first face of many photos in one batch
+def encode_images(images: list[np.ndarray], detector: Detector | None = None) -> list[np.ndarray | None]:
+    """
+        Detects the faces of every BGR image and encodes the first face of each, all in one encoder batch
+
+        Args:
+            images (list[np.ndarray]): Images in OpenCV BGR order
+            detector (Detector | None): Face detector to use, None uses the HOG detector of face_recognition
+
+        Returns:
+            encodings (list[np.ndarray | None]): The 128-d encoding of each image, None where no face was found
+    """
+    # face_recognition expects RGB while OpenCV works in BGR
+    rgb_images = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images]
+    boxes_per_image: list[list[Box]] = []
+    for rgb_img in rgb_images:
+        boxes = detector(rgb_img) if detector is not None else face_recognition.face_locations(rgb_img)
+        boxes_per_image.append(boxes[:1])
+    return [encodings[0] if encodings else None for encodings in encode_faces(rgb_images, boxes_per_image)]
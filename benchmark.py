@@ -0,0 +1,430 @@
+# description: Reproducible benchmark of the enrollment and check-in hot paths. The real new_user() and existing_user() are driven
+#              with a fake camera that plays back photos from a local fixture folder, so no webcam is needed. Every stage
+#              (decrypt, decode, detect, encode, match, attendance write) is timed, batched encoding is compared with encoding
+#              photo by photo, the 1:N matcher is measured as the gallery grows and with float16/int8 storage against float64,
+#              cold start is measured in fresh processes, and the results are printed as JSON so they can be compared between versions.
+#
+#              usage: python benchmark.py --fixtures faces/ [--logins 5] [--gallery-sizes 10,100,1000,10000,100000] [--storage-users 10000]
+#                                         [--cold-starts 3] [--output results.json]
+#              The fixture folder holds one sub folder of photos per person, named after their email (the bulk_enroll.py layout).
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line
+import builtins                           # for answering input() prompts
+import json                               # for the results
+import os                                 # file directory and handling, for interacting with the OS
+import platform                           # for describing the machine in the results
+import subprocess                         # for measuring cold start in fresh processes
+import sys                                # for the interpreter the cold start runs with
+import tempfile                           # for an isolated working folder
+import time                               # for measuring latency
+from collections import defaultdict       # for collecting timings per stage
+from datetime import datetime             # for timestamping the results
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from typing import Callable               # for the wrapped function types
+import cv2                                # for reading the fixtures and faking the camera
+import numpy as np                        # for numerical operations
+import face_recognition                   # for timing the encoder and matcher
+import attendance_store                   # for timing attendance writes
+import batch_encoder                      # for timing the encoder
+import embedding_store                    # for the encoding dimension
+import gallery                            # for the gallery growth benchmark
+import templates                          # for condensing the synthetic users like the gallery does
+import key_manager                        # for timing decryption
+import user_registry                      # for registering the fixture users
+import facial_recognition                 # the code under test
+
+
+# Latency samples per stage in milliseconds
+timings: dict[str, list[float]] = defaultdict(list)
+
+# Modules facial_recognition imports lazily, imported up front to measure the eager start it used to have
+EAGER_IMPORTS: list[str] = ["face_recognition", "cv2", "numpy", "embedding_store", "gallery", "kiosk", "pipeline", "detectors",
+                            "secure_images", "key_manager", "auto_enroll", "batch_encoder", "templates", "liveness"]
+
+
+#=========================================================================================================================================
+# class that stands in for cv2.VideoCapture
+class FakeVideoCapture:
+    """
+        Plays back a list of frames in a loop, in place of the webcam
+
+        Args:
+            frames (list[np.ndarray]): Frames in OpenCV BGR order
+    """
+
+    def __init__(self, frames: list[np.ndarray]) -> None:
+        self.frames: list[np.ndarray] = frames
+        self.position: int = 0
+
+    def isOpened(self) -> bool:
+        return bool(self.frames)
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        frame = self.frames[self.position % len(self.frames)]
+        self.position += 1
+        return True, frame.copy()
+
+    def release(self) -> None:
+        pass
+
+#=========================================================================================================================================
+# function that wraps a function so every call is timed under a stage name
+def timed(stage: str, function: Callable) -> Callable:
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage].append((time.perf_counter() - start) * 1000)
+    return wrapper
+
+#=========================================================================================================================================
+# class that times the decryption of the real cipher
+class TimedCipher:
+    def __init__(self, cipher) -> None:
+        self.cipher = cipher
+
+    def encrypt(self, data: bytes) -> bytes:
+        return self.cipher.encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        return timed("decrypt", self.cipher.decrypt)(token)
+
+#=========================================================================================================================================
+# function that puts timing wrappers around every stage of the hot paths
+def instrument() -> None:
+    """
+        Replaces the stage functions used by facial_recognition with timed versions
+    """
+    real_get_cipher = key_manager.get_cipher
+    key_manager.get_cipher = lambda: TimedCipher(real_get_cipher())
+    cv2.imdecode = timed("decode", cv2.imdecode)
+    batch_encoder.encode_faces = timed("encode", batch_encoder.encode_faces)
+    face_recognition.face_distance = timed("match", face_recognition.face_distance)
+    facial_recognition._detector = timed("detect", facial_recognition.get_detector())
+    attendance_store.record = timed("attendance_write", attendance_store.record)
+    # Every login of a fixture person is timed as a real write, not dropped by the check-in cooldown
+    attendance_store.COOLDOWN_SECONDS = 0
+    attendance_store.flush = timed("attendance_flush", attendance_store.flush)
+    embedding_store.load_embeddings = timed("load_embeddings", embedding_store.load_embeddings)
+
+    # The camera window and key presses are not needed, every waitKey() acts like SPACE was pressed
+    cv2.imshow = lambda *args: None
+    cv2.destroyAllWindows = lambda: None
+    cv2.waitKey = lambda delay=0: ord(' ')
+    # The windows are faked, so the SPACE capture path runs even on a machine without a display
+    facial_recognition.headless = False
+
+#=========================================================================================================================================
+# function that loads the fixture photos
+def load_fixtures(fixture_folder: Path) -> dict[str, list[np.ndarray]]:
+    people: dict[str, list[np.ndarray]] = {}
+    for person_folder in sorted(path for path in fixture_folder.iterdir() if path.is_dir()):
+        frames = [cv2.imread(str(path)) for path in sorted(person_folder.iterdir())]
+        frames = [frame for frame in frames if frame is not None]
+        if frames:
+            people[person_folder.name] = frames
+    return people
+
+#=========================================================================================================================================
+# function that summarizes latency samples
+def summarize(samples: list[float]) -> dict[str, float]:
+    values = np.asarray(samples)
+    return {
+        "count": int(len(values)),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+#=========================================================================================================================================
+# function that benchmarks enrollment and check-in with the fixture photos
+def benchmark_hot_paths(people: dict[str, list[np.ndarray]], logins: int) -> dict[str, dict[str, float]]:
+    """
+        Enrolls every fixture person with new_user(), rebuilds their encodings from the encrypted photos once and logs each
+        of them in with existing_user() several times. Logins read the stored encodings, so the rebuild is the path that
+        decrypts and decodes photos.
+
+        Args:
+            people (dict[str, list[np.ndarray]]): Photos of every person keyed by email
+            logins (int): Number of logins per person
+
+        Returns:
+            stages (dict[str, dict[str, float]]): Latency percentiles per stage
+    """
+    instrument()
+    real_video_capture = cv2.VideoCapture
+    real_input = builtins.input
+    try:
+        user_nums: list[str] = []
+        for email, frames in people.items():
+            record = {"first_name": email, "last_name": "", "email": email, "phone_number": "", "home_address": ""}
+            user_num = user_registry.register_user(record)
+            user_nums.append(str(user_num))
+            cv2.VideoCapture = lambda camera=0: FakeVideoCapture(frames)
+            start = time.perf_counter()
+            facial_recognition.new_user(user_num, record)
+            timings["enroll_total"].append((time.perf_counter() - start) * 1000)
+
+        for user_num in user_nums:
+            start = time.perf_counter()
+            embedding_store.rebuild_embeddings(user_num, key_manager.get_cipher(), facial_recognition.certified_folder)
+            timings["rebuild_total"].append((time.perf_counter() - start) * 1000)
+
+        for _ in range(logins):
+            for email, frames in people.items():
+                # The live frame is one of the persons own photos
+                cv2.VideoCapture = lambda camera=0: FakeVideoCapture(frames[-1:])
+                builtins.input = lambda prompt="": email
+                start = time.perf_counter()
+                facial_recognition.existing_user()
+                timings["login_total"].append((time.perf_counter() - start) * 1000)
+        attendance_store.flush()
+    finally:
+        cv2.VideoCapture = real_video_capture
+        builtins.input = real_input
+
+    return {stage: summarize(samples) for stage, samples in sorted(timings.items()) if samples}
+
+#=========================================================================================================================================
+# function that compares batched encoding with encoding photo by photo
+def benchmark_encoding(people: dict[str, list[np.ndarray]]) -> dict[str, float]:
+    """
+        Encodes every fixture photo once with face_recognition.face_encodings per photo and once as one batch,
+        the way a gallery rebuild re-indexes every enrollment photo
+
+        Args:
+            people (dict[str, list[np.ndarray]]): Photos of every person keyed by email
+
+        Returns:
+            result (dict[str, float]): Time of both ways, the speedup and the largest difference between their encodings
+    """
+    images = [frame for frames in people.values() for frame in frames]
+    rgb_images = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images]
+    # Detection is the same for both ways, so it is done once up front and only the encoding is timed
+    boxes_per_image = [face_recognition.face_locations(rgb_img)[:1] for rgb_img in rgb_images]
+
+    start = time.perf_counter()
+    looped = [face_recognition.face_encodings(rgb_img, boxes) for rgb_img, boxes in zip(rgb_images, boxes_per_image)]
+    loop_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    batched = batch_encoder.encode_faces(rgb_images, boxes_per_image)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    differences = [float(np.abs(a - b).max()) for loop_faces, batch_faces in zip(looped, batched) for a, b in zip(loop_faces, batch_faces)]
+    return {
+        "images": len(images),
+        "faces": len(differences),
+        "loop_ms": round(loop_ms, 1),
+        "batch_ms": round(batch_ms, 1),
+        "speedup": round(loop_ms / batch_ms, 2) if batch_ms else 0.0,
+        "max_difference": round(max(differences, default=0.0), 6),
+    }
+
+#=========================================================================================================================================
+# function that benchmarks the 1:N matcher as the gallery grows
+def benchmark_gallery(sizes: list[int], queries: int = 200, shots: int = 10, seed: int = 0) -> list[dict[str, float]]:
+    """
+        Identifies random queries against synthetic galleries of increasing size. Every user is condensed into their
+        template first, like load_gallery does, so the gallery has the rows production matches against.
+
+        Args:
+            sizes (list[int]): Numbers of enrolled users to try
+            queries (int): Number of queries per size
+            shots (int): Encodings per user, before they are condensed
+            seed (int): Seed for the synthetic encodings
+
+        Returns:
+            results (list[dict[str, float]]): Build time (templates included), latency percentiles and throughput per size
+    """
+    rng = np.random.default_rng(seed)
+    results: list[dict[str, float]] = []
+    for users in sizes:
+        # Every user gets a random center with a few noisy shots around it, roughly like real encodings
+        centers = rng.normal(0, 0.1, (users, embedding_store.ENCODING_DIM)).astype(np.float32)
+        matrix = np.repeat(centers, shots, axis=0) + rng.normal(0, 0.02, (users * shots, embedding_store.ENCODING_DIM)).astype(np.float32)
+
+        start = time.perf_counter()
+        rows = [templates.build_template(samples) for samples in matrix.reshape(users, shots, embedding_store.ENCODING_DIM)]
+        labels = np.repeat(np.arange(users).astype(str), [len(template) for template in rows])
+        user_gallery = gallery.Gallery(np.vstack(rows), labels)
+        if len(user_gallery) > gallery.INDEX_THRESHOLD:
+            user_gallery.build_index()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        targets = rng.integers(0, users, queries)
+        samples: list[float] = []
+        correct: int = 0
+        for target in targets:
+            query = centers[target] + rng.normal(0, 0.02, embedding_store.ENCODING_DIM).astype(np.float32)
+            start = time.perf_counter()
+            matched_id, _ = user_gallery.identify(query)
+            samples.append((time.perf_counter() - start) * 1000)
+            correct += matched_id == str(target)
+
+        result: dict[str, float] = {"users": users, "encodings": users * shots, "template_rows": len(user_gallery), "indexed": user_gallery.index is not None,
+                                    "build_ms": round(build_ms, 1), "accuracy": round(correct / queries, 4)}
+        result.update(summarize(samples))
+        result["queries_per_second"] = round(1000 * len(samples) / sum(samples), 1)
+        results.append(result)
+    return results
+
+#=========================================================================================================================================
+# function that compares the compact storage types with float64
+def benchmark_storage(users: int, queries: int = 200, shots: int = 10, seed: int = 0) -> list[dict[str, float]]:
+    """
+        Identifies the same random queries with a float64 matrix (what face_recognition computes with) and with galleries
+        stored as float32, float16 and int8
+
+        Args:
+            users (int): Number of enrolled users
+            queries (int): Number of queries
+            shots (int): Encodings per user
+            seed (int): Seed for the synthetic encodings
+
+        Returns:
+            results (list[dict[str, float]]): Memory per user, accuracy, agreement with float64 and latency per storage type
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.1, (users, embedding_store.ENCODING_DIM))
+    matrix = np.repeat(centers, shots, axis=0) + rng.normal(0, 0.02, (users * shots, embedding_store.ENCODING_DIM))
+    labels = np.repeat(np.arange(users).astype(str), shots)
+    targets = rng.integers(0, users, queries)
+    query_matrix = centers[targets] + rng.normal(0, 0.02, (queries, embedding_store.ENCODING_DIM))
+
+    # Reference answers: the closest encoding in float64, like face_recognition.face_distance
+    reference: list[tuple[str, float]] = []
+    samples: list[float] = []
+    for query in query_matrix:
+        start = time.perf_counter()
+        distances = np.linalg.norm(matrix - query, axis=1)
+        best = int(np.argmin(distances))
+        samples.append((time.perf_counter() - start) * 1000)
+        reference.append((labels[best], float(distances[best])))
+    result: dict[str, float] = {"storage": "float64", "bytes_per_user": matrix.nbytes // users,
+                                "accuracy": round(float(np.mean([matched == str(target) for (matched, _), target in zip(reference, targets)])), 4)}
+    result.update(summarize(samples))
+    results: list[dict[str, float]] = [result]
+
+    for storage in ["float32", "float16", "int8"]:
+        user_gallery = gallery.Gallery(matrix, labels)
+        user_gallery.set_storage(storage)
+        samples, correct, agree, distance_error = [], 0, 0, 0.0
+        for query, target, (reference_id, reference_distance) in zip(query_matrix, targets, reference):
+            start = time.perf_counter()
+            matched_id, distance = user_gallery.identify(query)
+            samples.append((time.perf_counter() - start) * 1000)
+            correct += matched_id == str(target)
+            agree += matched_id == reference_id
+            distance_error = max(distance_error, abs(distance - reference_distance))
+        result = {"storage": storage, "bytes_per_user": user_gallery.matrix.nbytes // users, "accuracy": round(correct / queries, 4),
+                  "agreement_with_float64": round(agree / queries, 4), "max_distance_error": round(distance_error, 5)}
+        result.update(summarize(samples))
+        results.append(result)
+    return results
+
+#=========================================================================================================================================
+# function that measures how long a fresh process takes to show the menu and to get the models ready
+def benchmark_cold_start(repeats: int) -> dict[str, float]:
+    """
+        Starts fresh processes that import facial_recognition, then the vision stack, then warm the models up, timing each step.
+        The eager time is measured in separate fresh processes that import the vision stack before facial_recognition,
+        which is what showing the menu cost while the vision stack was imported with the program.
+
+        Args:
+            repeats (int): Number of fresh processes, the median of each step is reported
+
+        Returns:
+            results (dict[str, float]): Median seconds until the menu (lazy and eager), for the vision stack, for the warm-up and for a whole process
+    """
+    folder = str(Path(__file__).resolve().parent)
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"sys.path.insert(0, {folder!r})\n"
+        "import facial_recognition\n"
+        "menu_ready = time.perf_counter()\n"
+        "facial_recognition.prefetch()\n"
+        "imported = time.perf_counter()\n"
+        "facial_recognition.warm_up()\n"
+        "print(json.dumps([menu_ready - start, imported - menu_ready, time.perf_counter() - imported]))\n"
+    )
+    # The lazy imports hand out modules that are already imported, so importing them first is the eager program
+    eager_script = (
+        "import importlib, json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"sys.path.insert(0, {folder!r})\n"
+        f"for name in {EAGER_IMPORTS!r}:\n"
+        "    importlib.import_module(name)\n"
+        "import facial_recognition\n"
+        "print(json.dumps(time.perf_counter() - start))\n"
+    )
+    steps: list[list[float]] = []
+    eager_seconds: list[float] = []
+    process_seconds: list[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+        process_seconds.append(time.perf_counter() - start)
+        steps.append(json.loads(output.strip().splitlines()[-1]))
+        output = subprocess.run([sys.executable, "-c", eager_script], capture_output=True, text=True, check=True).stdout
+        eager_seconds.append(json.loads(output.strip().splitlines()[-1]))
+    menu_ready, vision_stack, warm_up = (float(np.median(column)) for column in zip(*steps))
+    return {"menu_ready_seconds": round(menu_ready, 3), "eager_menu_ready_seconds": round(float(np.median(eager_seconds)), 3),
+            "vision_stack_seconds": round(vision_stack, 3), "warm_up_seconds": round(warm_up, 3),
+            "process_seconds": round(float(np.median(process_seconds)), 3)}
+
+#=========================================================================================================================================
+
+def main() -> None:
+    """
+        Parses the command line, runs the benchmarks in a temporary folder and prints the JSON results
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the enrollment and check-in hot paths.")
+    parser.add_argument("--fixtures", type=Path, default=None, help="folder with one sub folder of photos per person")
+    parser.add_argument("--logins", type=int, default=5, help="logins per fixture person")
+    parser.add_argument("--gallery-sizes", default="10,100,1000,10000,100000", help="comma separated numbers of users for the gallery benchmark")
+    parser.add_argument("--storage-users", type=int, default=10000, help="users for the float16/int8 storage comparison (0 to skip)")
+    parser.add_argument("--cold-starts", type=int, default=3, help="fresh processes for the cold start measurement (0 to skip)")
+    parser.add_argument("--output", type=Path, default=None, help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results: dict[str, object] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+    fixtures = args.fixtures.resolve() if args.fixtures else None
+    output = args.output.resolve() if args.output else None
+    # Run in an empty folder so the real user, attendance and key files are never touched
+    with tempfile.TemporaryDirectory() as work_folder:
+        previous_folder = os.getcwd()
+        os.chdir(work_folder)
+        try:
+            if fixtures is not None:
+                people = load_fixtures(fixtures)
+                results["encoding"] = benchmark_encoding(people)
+                results["stages"] = benchmark_hot_paths(people, args.logins)
+            results["gallery"] = benchmark_gallery([int(size) for size in args.gallery_sizes.split(",")])
+            if args.storage_users > 0:
+                results["storage"] = benchmark_storage(args.storage_users)
+            if args.cold_starts > 0:
+                results["cold_start"] = benchmark_cold_start(args.cold_starts)
+        finally:
+            os.chdir(previous_folder)
+
+    text = json.dumps(results, indent=4)
+    print(text)
+    if output is not None:
+        output.write_text(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# description: Command line importer that enrolls many users at once from existing photos instead of the interactive webcam flow.
+#              Faces are detected and encoded on every core with a process pool, the photos of each person in one encoder
+#              batch, the encrypted images are written to
+#              certified/<id>/, the users are registered and their encodings stored, and throughput and failures are reported.
+#
+#              usage: python bulk_enroll.py --manifest people.csv
+#                     python bulk_enroll.py --directory photos/
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line options
+import csv                                # for reading the manifest
+import cv2                                # for decoding the photos
+import numpy as np                        # for numerical operations
+import os                                 # file directory and handling, for interacting with the OS
+import time                               # for measuring throughput
+from collections import deque             # for the people submitted but not written yet
+from concurrent.futures import Future, ProcessPoolExecutor   # for encoding on every core
+from datetime import datetime             # for naming the stored images
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from cryptography.fernet import Fernet, MultiFernet     # for symmetric encryption and decryption
+import batch_encoder                      # for encoding the photos of a person in one batch
+import embedding_store                    # for storing the encodings
+import user_registry                      # for registering the users
+import secure_images                      # for writing the encrypted images
+import key_manager                        # for the encryption keys
+from facial_recognition import certified_folder
+
+
+# File extensions picked up from image folders
+IMAGE_EXTENSIONS: set[str] = {".jpg", ".jpeg", ".png", ".bmp"}
+
+# People submitted to the pool ahead of the writer, per worker, so finished photos never pile up in memory
+PENDING_PER_WORKER: int = 4
+
+# Cipher of each worker process, created once by the pool initializer
+_worker_cipher: MultiFernet | None = None
+
+
+#=========================================================================================================================================
+# function that lists the images of a folder
+def list_images(folder: Path) -> list[Path]:
+    return sorted(path for path in folder.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+
+#=========================================================================================================================================
+# function that reads the users and their photos from a CSV manifest
+def read_manifest(manifest: Path) -> list[tuple[dict[str, str], list[Path]]]:
+    """
+        Reads a manifest with the columns first_name, last_name, email, phone_number, home_address and images.
+        images is a folder of photos or several photo paths separated by ';', relative to the manifest.
+
+        Args:
+            manifest (Path): Path of the CSV manifest
+
+        Returns:
+            people (list[tuple[dict[str, str], list[Path]]]): The user record and photo paths of every person
+    """
+    people: list[tuple[dict[str, str], list[Path]]] = []
+    with open(manifest, "r") as file:
+        reader: csv.DictReader = csv.DictReader(file)  # Read rows as dictionaries
+        for row in reader:
+            record: dict[str, str] = {field: row.get(field) or "" for field in user_registry.USER_FIELDS}
+            images: list[Path] = []
+            for entry in (row.get("images") or "").split(";"):
+                if not entry.strip():
+                    continue
+                path = manifest.parent / entry.strip()
+                images.extend(list_images(path) if path.is_dir() else [path])
+            people.append((record, images))
+    return people
+
+#=========================================================================================================================================
+# function that reads the users and their photos from a folder of folders
+def read_directory(directory: Path) -> list[tuple[dict[str, str], list[Path]]]:
+    """
+        Reads a folder with one sub folder of photos per person, the sub folder is named after the persons email
+
+        Args:
+            directory (Path): Folder containing one folder per person
+
+        Returns:
+            people (list[tuple[dict[str, str], list[Path]]]): The user record and photo paths of every person
+    """
+    people: list[tuple[dict[str, str], list[Path]]] = []
+    for person_folder in sorted(path for path in directory.iterdir() if path.is_dir()):
+        record: dict[str, str] = {field: "" for field in user_registry.USER_FIELDS}
+        record["email"] = person_folder.name
+        people.append((record, list_images(person_folder)))
+    return people
+
+#=========================================================================================================================================
+# function that sets up every worker process
+def _init_worker(keys: list[bytes]) -> None:
+    global _worker_cipher
+    _worker_cipher = MultiFernet([Fernet(key) for key in keys])
+
+#=========================================================================================================================================
+# function that processes the photos of one person inside a worker process
+def process_person(paths: list[Path]) -> list[tuple[bytes | None, np.ndarray | None, str]]:
+    """
+        Decodes the photos of one person, encodes all their faces in one encoder batch and encrypts the photos.
+        Any error is returned as the failure of that photo, so one corrupt photo cannot abort the whole import.
+
+        Args:
+            paths (list[Path]): Paths of the photos
+
+        Returns:
+            results (list[tuple[bytes | None, np.ndarray | None, str]]): The encrypted JPEG, the face encoding and an error message ("" if it worked) of every photo
+    """
+    results: list[tuple[bytes | None, np.ndarray | None, str]] = [(None, None, "")] * len(paths)
+    decoded: list[tuple[int, np.ndarray]] = []
+    for i, path in enumerate(paths):
+        try:
+            img, error = _read_image(path)
+        except Exception as e:
+            img, error = None, f"failed: {type(e).__name__}: {e}"
+        if img is None:
+            results[i] = (None, None, error)
+        else:
+            decoded.append((i, img))
+
+    encodings: list[np.ndarray | None | Exception]
+    try:
+        encodings = batch_encoder.encode_images([img for _, img in decoded])
+    except Exception:
+        # One bad photo fails the whole batch, encode them one at a time to find out which
+        encodings = []
+        for _, img in decoded:
+            try:
+                encodings.append(batch_encoder.encode_images([img])[0])
+            except Exception as e:
+                encodings.append(e)
+
+    for (i, img), encoding in zip(decoded, encodings):
+        if isinstance(encoding, Exception):
+            results[i] = (None, None, f"failed: {type(encoding).__name__}: {encoding}")
+        elif encoding is None:
+            results[i] = (None, None, "no face found")
+        else:
+            # Store every photo as JPEG, like the webcam enrollment does
+            ok, jpeg = cv2.imencode(".jpg", img)
+            results[i] = (_worker_cipher.encrypt(jpeg.tobytes()), encoding, "") if ok else (None, None, "could not encode JPEG")
+    return results
+
+def _read_image(path: Path) -> tuple[np.ndarray | None, str]:
+    try:
+        with open(path, "rb") as image_file:
+            data: bytes = image_file.read()
+    except OSError as e:
+        return None, f"could not read: {e}"
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, "could not decode image"
+    return img, ""
+
+#=========================================================================================================================================
+# function that enrolls every person
+def bulk_enroll(people: list[tuple[dict[str, str], list[Path]]], workers: int | None = None) -> dict[str, object]:
+    """
+        Enrolls every person, running face detection and encoding on a process pool
+
+        Args:
+            people (list[tuple[dict[str, str], list[Path]]]): The user record and photo paths of every person
+            workers (int | None): Number of worker processes, defaults to the number of cores
+
+        Returns:
+            report (dict[str, object]): Counts, throughput and the list of failures
+    """
+    keys = key_manager.load_or_create_keys()
+    cipher = key_manager.get_cipher()
+    failures: list[tuple[str, str]] = []
+    enrolled: int = 0
+
+    all_images: list[Path] = [path for _, images in people for path in images]
+    start_time = time.perf_counter()
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(keys,)) as pool:
+        # Every person is one task, so their photos share one encoder batch. Only a few people per worker are submitted
+        # ahead of the writer, so memory stays flat however large the import is
+        pending: deque[Future] = deque()
+        submitted: int = 0
+        for record, images in people:
+            while submitted < len(people) and len(pending) < PENDING_PER_WORKER * workers:
+                pending.append(pool.submit(process_person, people[submitted][1]))
+                submitted += 1
+            # Results are written in the same order the people were submitted
+            person_results = [(path, *result) for path, result in zip(images, pending.popleft().result())]
+            for path, _, _, error in person_results:
+                if error:
+                    failures.append((str(path), error))
+            usable = [(token, encoding) for _, token, encoding, error in person_results if not error]
+            if not usable:
+                failures.append((record["email"], "no usable photos, user not enrolled"))
+                continue
+
+            # Register the user, the database hands out the ID
+            try:
+                user_num = str(user_registry.register_user(record))
+            except ValueError as e:
+                failures.append((record["email"], str(e)))
+                continue
+
+            # Write the encrypted photos into the users folder
+            personalized_folder = os.path.join(certified_folder, user_num)
+            os.makedirs(personalized_folder, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            for photo_num, (token, _) in enumerate(usable, start=1):
+                secure_images.atomic_write(os.path.join(personalized_folder, f"{user_num}_{photo_num}_{timestamp}.jpg"), token)
+
+            embedding_store.save_embeddings(user_num, [encoding for _, encoding in usable], cipher)
+            enrolled += 1
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "people": len(people),
+        "enrolled": enrolled,
+        "images": len(all_images),
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(len(all_images) / elapsed, 2) if elapsed > 0 else 0.0,
+        "failures": failures,
+    }
+
+#=========================================================================================================================================
+
+def main() -> None:
+    """
+        Parses the command line and runs the bulk enrollment
+    """
+    parser = argparse.ArgumentParser(description="Enroll many users at once from existing photos.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", type=Path, help="CSV with first_name, last_name, email, phone_number, home_address, images")
+    source.add_argument("--directory", type=Path, help="folder with one sub folder of photos per person, named after their email")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    args = parser.parse_args()
+
+    people = read_manifest(args.manifest) if args.manifest else read_directory(args.directory)
+    report = bulk_enroll(people, args.workers)
+
+    print(f"Enrolled {report['enrolled']} of {report['people']} people from {report['images']} photos "
+          f"in {report['seconds']} s ({report['images_per_second']} photos/s)")
+    for item, error in report["failures"]:
+        print(f"\tFAILED {item}: {error}")
+
+if __name__ == "__main__":
+    main()
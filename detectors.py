@@ -0,0 +1,269 @@
+# description: Pluggable face detectors. Every detector takes an RGB image and returns face locations as (top, right, bottom, left)
+#              like face_recognition.face_locations, so the check-in and enrollment code can switch between the HOG detector,
+#              OpenCV Haar/LBP cascades and OpenCV's YuNet DNN model, downscale frames before detection, or run a cheap
+#              detector first and only confirm its faces with an expensive one.
+#
+#              benchmark: python detectors.py --images faces/ [--backends hog,haar,cascade] [--model face_detection_yunet.onnx]
+
+################################################################################################################################################################
+
+# Import needed libraries
+import face_recognition                   # for the HOG and CNN detectors
+import cv2                                # for the cascade and DNN detectors
+import numpy as np                        # for numerical operations
+import argparse                           # for the benchmark command line
+import json                               # for printing the benchmark results
+import time                               # for measuring latency
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from typing import Callable               # for the detector type
+
+
+# A face location as (top, right, bottom, left) in pixels
+Box = tuple[int, int, int, int]
+
+# Every detector is a callable from an RGB image to face locations
+Detector = Callable[[np.ndarray], list[Box]]
+
+# Names accepted by make_detector
+BACKENDS: list[str] = ["hog", "cnn", "haar", "lbp", "yunet", "cascade"]
+
+
+#=========================================================================================================================================
+# class for the dlib HOG / CNN detectors used by face_recognition
+class DlibDetector:
+    """
+        The detectors that ship with face_recognition
+
+        Args:
+            model (str): "hog" (default of face_recognition) or "cnn" (much slower on a CPU)
+            upsample (int): How many times the image is upsampled to find smaller faces
+    """
+
+    def __init__(self, model: str = "hog", upsample: int = 1) -> None:
+        self.model: str = model
+        self.upsample: int = upsample
+
+    def __call__(self, rgb_img: np.ndarray) -> list[Box]:
+        return face_recognition.face_locations(rgb_img, self.upsample, self.model)
+
+#=========================================================================================================================================
+# class for the OpenCV Haar / LBP cascade detectors
+class CascadeDetector:
+    """
+        OpenCV cascade classifier, the cheapest detector but with more false positives and missed profiles
+
+        Args:
+            model_path (str | None): Cascade XML file, defaults to the frontal face Haar cascade bundled with OpenCV
+            scale_factor (float): How much the image shrinks between cascade scales
+            min_neighbors (int): Neighbouring hits needed to keep a face, higher means fewer false positives
+            min_size (int): Smallest face in pixels
+    """
+
+    def __init__(self, model_path: str | None = None, scale_factor: float = 1.1, min_neighbors: int = 5, min_size: int = 40) -> None:
+        if model_path is None:
+            model_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        self.model_path: str = str(model_path)
+        self.scale_factor: float = scale_factor
+        self.min_neighbors: int = min_neighbors
+        self.min_size: int = min_size
+        self._load()
+
+    def _load(self) -> None:
+        self.classifier = cv2.CascadeClassifier(self.model_path)
+        if self.classifier.empty():
+            raise ValueError(f"Could not load cascade model {self.model_path}")
+
+    # OpenCV models cannot be pickled, worker processes reload them from the file instead
+    def __getstate__(self) -> dict:
+        return {key: value for key, value in self.__dict__.items() if key != "classifier"}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._load()
+
+    def __call__(self, rgb_img: np.ndarray) -> list[Box]:
+        gray = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2GRAY)
+        faces = self.classifier.detectMultiScale(gray, self.scale_factor, self.min_neighbors, minSize=(self.min_size, self.min_size))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+#=========================================================================================================================================
+# class for OpenCV's YuNet DNN detector
+class YuNetDetector:
+    """
+        OpenCV's YuNet face detector, loaded from a local ONNX file (face_detection_yunet_*.onnx from the OpenCV model zoo)
+
+        Args:
+            model_path (str): Path of the ONNX model
+            score_threshold (float): Lowest confidence of a kept face
+    """
+
+    def __init__(self, model_path: str, score_threshold: float = 0.8) -> None:
+        if not Path(model_path).is_file():
+            raise ValueError(f"YuNet model not found: {model_path}")
+        self.model_path: str = str(model_path)
+        self.score_threshold: float = score_threshold
+        self._load()
+
+    def _load(self) -> None:
+        self.model = cv2.FaceDetectorYN.create(self.model_path, "", (320, 320), self.score_threshold)
+
+    # OpenCV models cannot be pickled, worker processes reload them from the file instead
+    def __getstate__(self) -> dict:
+        return {key: value for key, value in self.__dict__.items() if key != "model"}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._load()
+
+    def __call__(self, rgb_img: np.ndarray) -> list[Box]:
+        height, width = rgb_img.shape[:2]
+        self.model.setInputSize((width, height))
+        _, faces = self.model.detect(cv2.cvtColor(rgb_img, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+        boxes: list[Box] = []
+        for x, y, w, h in faces[:, :4]:
+            boxes.append((max(0, int(y)), min(width, int(x + w)), min(height, int(y + h)), max(0, int(x))))
+        return boxes
+
+#=========================================================================================================================================
+# class that runs another detector on a downscaled image
+class ScaledDetector:
+    """
+        Shrinks the image before detection and maps the faces back to full resolution
+
+        Args:
+            detector (Detector): The detector to run on the shrunk image
+            scale (float): Factor the image is shrunk by, 1.0 runs on the full image
+    """
+
+    def __init__(self, detector: Detector, scale: float) -> None:
+        self.detector: Detector = detector
+        self.scale: float = scale
+
+    def __call__(self, rgb_img: np.ndarray) -> list[Box]:
+        if self.scale == 1.0:
+            return self.detector(rgb_img)
+        small_img = cv2.resize(rgb_img, (0, 0), fx=self.scale, fy=self.scale)
+        height, width = rgb_img.shape[:2]
+        return [(max(0, int(top / self.scale)), min(width, int(right / self.scale)), min(height, int(bottom / self.scale)), max(0, int(left / self.scale)))
+                for top, right, bottom, left in self.detector(small_img)]
+
+#=========================================================================================================================================
+# class that confirms the faces of a cheap detector with an expensive one
+class CoarseToFineDetector:
+    """
+        Runs a cheap detector on the whole image and the expensive one only on a padded crop around each face it found
+
+        Args:
+            coarse (Detector): Cheap detector run on the whole image
+            fine (Detector): Expensive detector run on the crops
+            padding (float): How much each crop is grown around the coarse face, as a fraction of its size
+    """
+
+    def __init__(self, coarse: Detector, fine: Detector, padding: float = 0.25) -> None:
+        self.coarse: Detector = coarse
+        self.fine: Detector = fine
+        self.padding: float = padding
+
+    def __call__(self, rgb_img: np.ndarray) -> list[Box]:
+        height, width = rgb_img.shape[:2]
+        confirmed: list[Box] = []
+        for top, right, bottom, left in self.coarse(rgb_img):
+            pad_y, pad_x = int((bottom - top) * self.padding), int((right - left) * self.padding)
+            crop_top, crop_left = max(0, top - pad_y), max(0, left - pad_x)
+            crop = rgb_img[crop_top:min(height, bottom + pad_y), crop_left:min(width, right + pad_x)]
+            # Keep the faces the expensive detector agrees with, in full image coordinates
+            for f_top, f_right, f_bottom, f_left in self.fine(np.ascontiguousarray(crop)):
+                confirmed.append((f_top + crop_top, f_right + crop_left, f_bottom + crop_top, f_left + crop_left))
+        return confirmed
+
+#=========================================================================================================================================
+# function that builds a detector by name
+def make_detector(backend: str = "hog", scale: float = 1.0, upsample: int = 1, model_path: str | None = None) -> Detector:
+    """
+        Builds one of the detector backends
+
+        Args:
+            backend (str): "hog", "cnn", "haar", "lbp", "yunet" or "cascade" (Haar first, confirmed by HOG)
+            scale (float): Factor the image is shrunk by before detection
+            upsample (int): Upsampling of the dlib detectors
+            model_path (str | None): Model file, required for "lbp" and "yunet", optional for "haar"
+
+        Returns:
+            detector (Detector): The detector
+    """
+    if backend in ("hog", "cnn"):
+        detector: Detector = DlibDetector(backend, upsample)
+    elif backend == "haar":
+        detector = CascadeDetector(model_path)
+    elif backend == "lbp":
+        # OpenCV's pip packages only bundle the Haar cascades, the LBP one has to be given
+        if model_path is None:
+            raise ValueError("The lbp backend needs the path of an LBP cascade such as lbpcascade_frontalface_improved.xml")
+        detector = CascadeDetector(model_path)
+    elif backend == "yunet":
+        if model_path is None:
+            raise ValueError("The yunet backend needs the path of a face_detection_yunet ONNX model")
+        detector = YuNetDetector(model_path)
+    elif backend == "cascade":
+        detector = CoarseToFineDetector(CascadeDetector(min_neighbors=3), DlibDetector("hog", upsample))
+    else:
+        raise ValueError(f"Unknown detector backend {backend}, expected one of {', '.join(BACKENDS)}")
+    return ScaledDetector(detector, scale) if scale != 1.0 else detector
+
+#=========================================================================================================================================
+# function that benchmarks detectors on a folder of face images
+def benchmark(image_folder: Path, backends: list[str], scale: float = 1.0, model_path: str | None = None, upsample: int = 1) -> dict[str, dict[str, float]]:
+    """
+        Measures the latency of every backend and how many of the images it finds a face in.
+        Every image in the folder is expected to contain at least one face, so the hit rate is the recall.
+
+        Args:
+            image_folder (Path): Folder of face images
+            backends (list[str]): Backends to compare
+            scale (float): Factor images are shrunk by before detection
+            model_path (str | None): Model file for the "lbp" or "yunet" backend
+            upsample (int): Upsampling of the dlib detectors
+
+        Returns:
+            results (dict[str, dict[str, float]]): Mean and p95 latency in ms and recall per backend
+    """
+    images: list[np.ndarray] = []
+    for path in sorted(image_folder.iterdir()):
+        img = cv2.imread(str(path))
+        if img is not None:
+            images.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if not images:
+        raise ValueError(f"No images found in {image_folder}")
+
+    results: dict[str, dict[str, float]] = {}
+    for backend in backends:
+        detector = make_detector(backend, scale, upsample, model_path=model_path if backend in ("haar", "lbp", "yunet") else None)
+        detector(images[0])     # warm up so model loading is not counted
+        latencies: list[float] = []
+        hits: int = 0
+        for img in images:
+            start = time.perf_counter()
+            boxes = detector(img)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += bool(boxes)
+        results[backend] = {
+            "images": len(images),
+            "mean_ms": round(float(np.mean(latencies)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "recall": round(hits / len(images), 3),
+        }
+    return results
+
+#=========================================================================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latency and recall of the face detector backends.")
+    parser.add_argument("--images", type=Path, required=True, help="folder of images that each contain a face")
+    parser.add_argument("--backends", default="hog,haar,cascade", help=f"comma separated list out of {', '.join(BACKENDS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="factor images are shrunk by before detection")
+    parser.add_argument("--upsample", type=int, default=1, help="times the hog, cnn and cascade backends upsample images to find smaller faces")
+    parser.add_argument("--model", default=None, help="model file for the lbp or yunet backend")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.images, args.backends.split(","), args.scale, args.model, args.upsample), indent=4))
@@ -0,0 +1,413 @@
+# description: Persistent, encrypted store for the 128-d face encodings of every enrolled user. Encodings are computed once at
+#              enrollment and kept as one float32 matrix per user so a login only has to decrypt a few kilobytes instead of
+#              re-processing all ten enrollment pictures. Every change is also appended to an encrypted log, so running
+#              recognizers can pick up new enrollments by reading only the records added since they last looked.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import numpy as np                        # for numerical operations
+import os                                 # file directory and handling, for interacting with the OS
+import time                               # for stamping log records
+import json                               # for the metadata header stored in front of every matrix
+import hashlib                            # for fingerprinting a user's image folder
+from datetime import datetime             # for timestamping when a matrix was written
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from cryptography.fernet import MultiFernet     # for symmetric encryption and decryption
+from detectors import Detector            # for the configurable face detector
+import secure_images                      # for decrypting the enrollment images when the store has to be rebuilt
+import batch_encoder                      # for encoding all enrollment images in one batch
+import metrics                            # for counting decrypt failures and rebuilds
+
+
+# Define the path to the folder holding one encrypted embedding file per user
+embeddings_folder: Path = Path("embeddings")
+
+# Append-only log of every change to the stored encodings, one encrypted record per line
+log_path: Path = embeddings_folder / "gallery.log"
+
+# Lock file taken by every append and by anything that replaces the log, so no append lands in a log that is being replaced
+log_lock_path: Path = embeddings_folder / "gallery.log.lock"
+
+# Bump this whenever the file layout or the way encodings are computed changes, older files are then rebuilt from the images
+STORE_VERSION: int = 1
+
+# Dimension of the encodings produced by face_recognition
+ENCODING_DIM: int = 128
+
+
+#=========================================================================================================================================
+# function that builds the path of a user's embedding file
+def embedding_path(user_num: str) -> Path:
+    """
+        Builds the path of the encrypted embedding file for a user
+
+        Args:
+            user_num (str): The users ID number
+
+        Returns:
+            path (Path): Path of the users embedding file
+    """
+    return embeddings_folder / f"{user_num}.emb"
+
+#=========================================================================================================================================
+# function that encrypts and writes the encodings of a user
+def save_embeddings(user_num: str, encodings: list, cipher: MultiFernet, source: str = "enrollment", enrolled: int | None = None,
+                    updated: str | None = None, images: str | None = None) -> Path:
+    """
+        Stores the face encodings of a user as an encrypted float32 matrix with a small metadata header
+
+        Args:
+            user_num (str): The users ID number
+            encodings (list): The 128-d face encodings of the user, enrollment photos first
+            cipher (MultiFernet): Cipher used to encrypt the file
+            source (str): Where the encodings came from ("enrollment", "rebuild" or "check-in")
+            enrolled (int | None): How many of the encodings come from enrollment photos, None means all of them
+            updated (str | None): ISO time of the last check-in update, None if the encodings were never refined
+            images (str | None): Fingerprint of the image folder the encodings were rebuilt from, see image_stamp()
+
+        Returns:
+            path (Path): Path of the written embedding file
+    """
+    # Stack every encoding into one contiguous float32 matrix
+    matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+    # Metadata needed to read the matrix back and to detect stale files
+    header: dict[str, object] = {
+        "version": STORE_VERSION,
+        "user_id": str(user_num),
+        "count": int(matrix.shape[0]),
+        "enrolled": int(matrix.shape[0]) if enrolled is None else enrolled,
+        "dim": ENCODING_DIM,
+        "dtype": "float32",
+        "source": source,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "updated": updated,
+        "images": images,
+    }
+    payload: bytes = json.dumps(header).encode("utf-8") + b"\n" + matrix.tobytes()
+
+    # Create the folder if it does not exist yet
+    os.makedirs(embeddings_folder, exist_ok=True)
+
+    # Write to a temporary file first and rename it so a reader never sees a half written file
+    path = embedding_path(user_num)
+    secure_images.atomic_write(path, cipher.encrypt(payload))
+    # Tell running recognizers about the new encodings, a file without any only marks a user with no usable face
+    if len(matrix):
+        append_log([(str(user_num), matrix)], cipher)
+    return path
+
+#=========================================================================================================================================
+# function that removes the encodings of a user
+def delete_embeddings(user_num: str, cipher: MultiFernet) -> None:
+    """
+        Deletes the embedding file of a user and appends a tombstone to the log so running recognizers forget the user
+
+        Args:
+            user_num (str): The users ID number
+            cipher (MultiFernet): Cipher used to encrypt the log record
+    """
+    path = embedding_path(user_num)
+    if path.is_file():
+        os.remove(path)
+    append_log([(str(user_num), None)], cipher)
+
+#=========================================================================================================================================
+# function that appends changes to the embedding log
+def append_log(entries: list[tuple[str, np.ndarray | None]], cipher: MultiFernet) -> None:
+    """
+        Appends one encrypted record per change to the embedding log
+
+        Args:
+            entries (list[tuple[str, np.ndarray | None]]): User ID and new encodings of every change, None encodings delete the user
+            cipher (MultiFernet): Cipher used to encrypt the records
+    """
+    lines: list[bytes] = []
+    for user_num, matrix in entries:
+        header: dict[str, object] = {
+            "version": STORE_VERSION,
+            "user_id": str(user_num),
+            "op": "set" if matrix is not None else "delete",
+            "count": int(len(matrix)) if matrix is not None else 0,
+            "dim": ENCODING_DIM,
+            "stamp": time.time_ns(),
+        }
+        matrix_bytes: bytes = np.asarray(matrix, dtype=np.float32).tobytes() if matrix is not None else b""
+        # Fernet tokens are base64, so a newline can only ever mean the end of a record
+        lines.append(cipher.encrypt(json.dumps(header).encode("utf-8") + b"\n" + matrix_bytes) + b"\n")
+
+    os.makedirs(embeddings_folder, exist_ok=True)
+    # A single write in append mode, under the log lock so compaction or key rotation cannot replace the log underneath it
+    with secure_images.file_lock(log_lock_path), open(log_path, "ab") as log_file:
+        log_file.write(b"".join(lines))
+
+#=========================================================================================================================================
+# function that decodes one record of the embedding log
+def _decode_log_record(line: bytes, cipher: MultiFernet) -> tuple[str, np.ndarray | None, int] | None:
+    try:
+        payload: bytes = cipher.decrypt(line)
+    except Exception:
+        metrics.increment("decrypt_failures")
+        return None
+    header_bytes, _, matrix_bytes = payload.partition(b"\n")
+    header: dict = json.loads(header_bytes)
+    if header.get("version") != STORE_VERSION or header.get("dim") != ENCODING_DIM:
+        return None
+    if header["op"] == "delete":
+        return header["user_id"], None, header["stamp"]
+    matrix = np.frombuffer(matrix_bytes, dtype=np.float32).reshape(header["count"], ENCODING_DIM)
+    return header["user_id"], matrix, header["stamp"]
+
+#=========================================================================================================================================
+# function that reads the records added to the embedding log since an offset
+def read_log(cipher: MultiFernet, offset: int = 0) -> tuple[list[tuple[str, np.ndarray | None, int]], int]:
+    """
+        Reads every complete record after a byte offset of the embedding log
+
+        Args:
+            cipher (MultiFernet): Cipher used to decrypt the records
+            offset (int): Byte offset the previous read stopped at, 0 reads the whole log
+
+        Returns:
+            records (list[tuple[str, np.ndarray | None, int]]): User ID, encodings (None for a deletion) and stamp of every record
+            offset (int): Byte offset to continue from next time
+    """
+    if not log_path.is_file():
+        return [], 0
+    with open(log_path, "rb") as log_file:
+        log_file.seek(offset)
+        data: bytes = log_file.read()
+
+    # A record that is still being written has no newline yet, it is read next time
+    end: int = data.rfind(b"\n") + 1
+    records: list[tuple[str, np.ndarray | None, int]] = []
+    for line in data[:end].splitlines():
+        record = _decode_log_record(line, cipher)
+        if record is not None:
+            records.append(record)
+    return records, offset + end
+
+#=========================================================================================================================================
+# function that drops superseded and deleted records from the embedding log
+def compact_log(cipher: MultiFernet) -> int:
+    """
+        Rewrites the embedding log with only the newest record of every user. For deleted users that is a small tombstone,
+        which keeps their old files from being loaded again. Records appended while the log is rewritten are copied over
+        before the new log replaces the old one. The last catch-up and the replace happen under the log lock, so no
+        append can land in between.
+
+        Args:
+            cipher (MultiFernet): Cipher used to decrypt the records
+
+        Returns:
+            dropped (int): Number of records removed
+    """
+    if not log_path.is_file():
+        return 0
+    with open(log_path, "rb") as log_file:
+        data: bytes = log_file.read()
+    end: int = data.rfind(b"\n") + 1
+    lines: list[bytes] = data[:end].splitlines()
+
+    # The newest record of every user wins, unreadable records are dropped
+    latest: dict[str, bytes] = {}
+    for line in lines:
+        record = _decode_log_record(line, cipher)
+        if record is not None:
+            latest[record[0]] = line
+    kept: list[bytes] = list(latest.values())
+
+    tmp_path = Path(f"{log_path}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(b"".join(line + b"\n" for line in kept))
+        # Copy whatever was appended meanwhile, without the lock first so appends are not held up for long
+        end = _copy_tail(tmp_file, end)
+    with secure_images.file_lock(log_lock_path):
+        # Appends wait now, so this last copy sees everything and nothing can land before the replace
+        with open(tmp_path, "ab") as tmp_file:
+            _copy_tail(tmp_file, end)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, log_path)
+    return len(lines) - len(kept)
+
+def _copy_tail(tmp_file, end: int) -> int:
+    # Copies the complete records after a byte offset of the log until the log stops growing, returns the new offset
+    while True:
+        with open(log_path, "rb") as log_file:
+            log_file.seek(end)
+            tail: bytes = log_file.read()
+        tail = tail[:tail.rfind(b"\n") + 1]
+        if not tail:
+            return end
+        tmp_file.write(tail)
+        end += len(tail)
+
+#=========================================================================================================================================
+# function that reads and decrypts the encodings of a user
+def load_embeddings(user_num: str, cipher: MultiFernet) -> np.ndarray | None:
+    """
+        Loads the encrypted encodings of a user
+
+        Args:
+            user_num (str): The users ID number
+            cipher (MultiFernet): Cipher used to decrypt the file
+
+        Returns:
+            matrix (np.ndarray | None): A (count, 128) float32 matrix, or None if the file is missing, unreadable or outdated
+    """
+    stored = load_embeddings_with_header(user_num, cipher)
+    return stored[0] if stored is not None else None
+
+#=========================================================================================================================================
+# function that reads the encodings of a user together with their metadata
+def load_embeddings_with_header(user_num: str, cipher: MultiFernet) -> tuple[np.ndarray, dict] | None:
+    """
+        Loads the encrypted encodings of a user and the metadata header stored in front of them
+
+        Args:
+            user_num (str): The users ID number
+            cipher (MultiFernet): Cipher used to decrypt the file
+
+        Returns:
+            stored (tuple[np.ndarray, dict] | None): The (count, 128) float32 matrix and the header, None if the file is missing, unreadable or outdated
+    """
+    path = embedding_path(user_num)
+    # Nothing stored yet for this user
+    if not path.is_file():
+        return None
+
+    # Decrypt the whole file into memory
+    with open(path, "rb") as emb_file:
+        try:
+            payload: bytes = cipher.decrypt(emb_file.read())
+        except Exception as e:
+            metrics.increment("decrypt_failures")
+            print(f"Failed to decrypt {path}: {e}")
+            return None
+
+    # Split the metadata header from the raw matrix bytes
+    header_bytes, _, matrix_bytes = payload.partition(b"\n")
+    try:
+        header: dict = json.loads(header_bytes)
+    except ValueError:
+        print(f"Corrupt embedding header: {path}")
+        return None
+
+    # Files written by an older version are treated as missing so they get rebuilt
+    if header.get("version") != STORE_VERSION or header.get("dim") != ENCODING_DIM:
+        return None
+
+    matrix = np.frombuffer(matrix_bytes, dtype=np.float32)
+    if matrix.size != header["count"] * ENCODING_DIM:
+        print(f"Corrupt embedding matrix: {path}")
+        return None
+    return matrix.reshape(header["count"], ENCODING_DIM), header
+
+#=========================================================================================================================================
+# function that encodes the first face found in an image
+def encode_image(img: np.ndarray, detector: Detector | None = None) -> np.ndarray | None:
+    """
+        Computes the encoding of the first face in a BGR image
+
+        Args:
+            img (np.ndarray): Image in OpenCV BGR order
+            detector (Detector | None): Face detector to use, None uses the HOG detector of face_recognition
+
+        Returns:
+            encoding (np.ndarray | None): The 128-d encoding, or None if no face was found
+    """
+    return batch_encoder.encode_images([img], detector)[0]
+
+#=========================================================================================================================================
+# function that fingerprints the images of a user
+def image_stamp(folder_for_user: str) -> str:
+    """
+        Fingerprints a user's image folder from the name, size and modification time of every picture in it
+
+        Args:
+            folder_for_user (str): Folder holding the users encrypted pictures
+
+        Returns:
+            stamp (str): Hex digest that changes whenever a picture is added, removed or rewritten
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(folder_for_user):
+        for pic_name in sorted(os.listdir(folder_for_user)):
+            # Temporary files are skipped by the rebuild as well
+            if pic_name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(folder_for_user, pic_name))
+            digest.update(f"{pic_name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+#=========================================================================================================================================
+# function that recomputes a user's encodings from the encrypted enrollment images
+def rebuild_embeddings(user_num: str, cipher: MultiFernet, certified_folder: Path) -> np.ndarray | None:
+    """
+        Rebuilds the embedding file of a user from the encrypted images in certified/<id>/
+
+        Args:
+            user_num (str): The users ID number
+            cipher (MultiFernet): Cipher used to decrypt the images and encrypt the embedding file
+            certified_folder (Path): Folder that contains one image folder per user
+
+        Returns:
+            matrix (np.ndarray | None): The rebuilt encodings, or None if no face could be encoded
+    """
+    folder_for_user: str = os.path.join(certified_folder, str(user_num))
+    # No pictures were ever taken for this user
+    if not os.path.isdir(folder_for_user):
+        return None
+
+    images: list[np.ndarray] = []
+    # Looping through every picture within the folder
+    for pic_name in sorted(os.listdir(folder_for_user)):
+        # Skip temporary files left behind by an interrupted write
+        if pic_name.endswith(".tmp"):
+            continue
+        pic_path: str = os.path.join(folder_for_user, pic_name)
+
+        # Decrypt and decode the image in memory
+        img = secure_images.read_encrypted_image(pic_path, cipher)
+        if img is not None:
+            images.append(img)
+
+    # Encode the faces of every picture in one batch, dropping pictures without a face
+    encodings: list = [encoding for encoding in batch_encoder.encode_images(images) if encoding is not None]
+
+    # If no face could be encoded, store an empty file stamped with the images so they are not retried until they change
+    if not encodings:
+        save_embeddings(user_num, [], cipher, source="rebuild", images=image_stamp(folder_for_user))
+        return None
+
+    save_embeddings(user_num, encodings, cipher, source="rebuild")
+    return np.asarray(encodings, dtype=np.float32)
+
+#=========================================================================================================================================
+# function that returns the stored encodings, rebuilding them only when needed
+def load_or_rebuild_embeddings(user_num: str, cipher: MultiFernet, certified_folder: Path) -> np.ndarray | None:
+    """
+        Loads a user's encodings from the store, falling back to a rebuild from the images if the file is missing or outdated.
+        Users whose images held no usable face are only rebuilt again once their images change.
+
+        Args:
+            user_num (str): The users ID number
+            cipher (MultiFernet): Cipher used to decrypt and encrypt
+            certified_folder (Path): Folder that contains one image folder per user
+
+        Returns:
+            matrix (np.ndarray | None): The users encodings, or None if none are available
+    """
+    stored = load_embeddings_with_header(user_num, cipher)
+    if stored is not None and len(stored[0]):
+        return stored[0]
+
+    # A user with no usable face is only tried again once their images change
+    if stored is not None and stored[1].get("images") == image_stamp(os.path.join(certified_folder, str(user_num))):
+        return None
+
+    print("Building face data from enrollment images..")
+    metrics.increment("embedding_rebuilds")
+    return rebuild_embeddings(user_num, cipher, certified_folder)
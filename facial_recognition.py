@@ -5,51 +5,140 @@
 
 ################################################################################################################################################################
 
+# Annotations name types of lazily imported modules, keep them from being evaluated at import time
+from __future__ import annotations
+
 # Import needed libraries
-import face_recognition                   # for facial recognition like encoding and comparing
-import cv2                                # for capturing video and image processing using OpenCV
-import numpy as np                        # for numerical operations
 import os                                 # file directory and handling, for interacting with the OS 
-from datetime import datetime             # for timestamp events like attendance and login
-import csv                                # for writing and reading CSV files
+import sys                                # for telling whether there is a display
+import threading                          # for loading the vision stack while the user types
+from datetime import datetime, timedelta  # for timestamp events like attendance and login
 from pathlib import Path                  # for handling file paths in an OS-independent way
 import time                               # for timestamp & delayed pictures
-from cryptography.fernet import Fernet    # for symmetric encryption and decryption
+import user_registry                      # for the indexed user database
+import attendance_store                   # for the indexed attendance database
+import metrics                            # for timing every stage and counting matches and rejects
+import reports                            # for the weekly attendance summary
+from lazy_import import LazyModule, lazy_import      # for importing the vision stack only when a scan starts
+
+# The vision stack and the encryption take seconds to import, they are only imported when a scan starts
+face_recognition = lazy_import("face_recognition")     # for facial recognition like encoding and comparing
+cv2 = lazy_import("cv2")                  # for capturing video and image processing using OpenCV
+np = lazy_import("numpy")                 # for numerical operations
+embedding_store = lazy_import("embedding_store")       # for the encrypted per-user face encodings
+gallery = lazy_import("gallery")          # for identifying a face against every enrolled user
+kiosk = lazy_import("kiosk")              # for the continuous multi-face kiosk loop
+pipeline = lazy_import("pipeline")        # for the multi-core staged kiosk pipeline
+detectors = lazy_import("detectors")      # for the configurable face detector
+secure_images = lazy_import("secure_images")           # for writing and reading the encrypted images
+key_manager = lazy_import("key_manager")  # for the cached, rotatable encryption keys
+auto_enroll = lazy_import("auto_enroll")  # for automatic, quality-gated photo capture
+batch_encoder = lazy_import("batch_encoder")           # for encoding many faces in one batch
+templates = lazy_import("templates")      # for the compact, self-refining user templates
+liveness = lazy_import("liveness")        # for rejecting printed photos and phone screens
 
 # implement thermal scan
 # object detection, add admin account
 # get all objects and match all of them
 
 
-# Define the path to the CSV file for user records
-csv_file_path: Path = Path("records.csv")
-
 # Define the path to the picture file
 certified_folder: Path = Path("certified")
 
-# Define the path to the CSV file for attendance
-csv_attendance_path: Path = Path("attendance.csv")
+# Face detector used for check-in and enrollment: "hog", "cnn", "haar", "lbp", "yunet" or "cascade" (Haar confirmed by HOG)
+detector_backend: str = "hog"
+# Factor frames are shrunk by before detection, 1.0 detects on the full frame
+detector_scale: float = 1.0
+# Times the "hog", "cnn" and "cascade" backends upsample the frame to find smaller faces, 0 is fastest, each step costs about 4x
+detector_upsample: int = 1
+# Model file for the "lbp" and "yunet" backends
+detector_model: str | None = None
+
+# Detector built from the settings above, created on first use
+_detector: detectors.Detector | None = None
+
+# Gallery of every enrolled user for walk-up check-ins, loaded by the first one and then kept up to date from the embedding log
+_walk_up_gallery: gallery.Gallery | None = None
+
+# Number of detection/encoding workers in kiosk mode, 0 runs the tracking loop on the main thread instead of the staged pipeline
+kiosk_workers: int = 0
+# Run the kiosk workers as processes, dlib holds the GIL while it detects and encodes so threads only help with one worker.
+# None picks processes whenever there is more than one worker
+kiosk_use_processes: bool | None = None
+
+# Require a blink or a small head movement from matched faces, so a printed photo cannot check in
+liveness_check: bool = False
+# Milliseconds the liveness check may add to a check-in before the face is rejected
+liveness_budget_ms: float = 1000.0
+
+# Storage type of the shared gallery matrix: "float32", "float16" (half the memory, slowest) or "int8" (a quarter of the memory)
+gallery_storage: str = "float32"
+# Share the gallery matrix between recognizers through a snapshot in /dev/shm. The snapshot holds the encodings unencrypted
+gallery_snapshot: bool = False
+
+# Run without camera windows, for servers without a display. On by default on Linux when no display is set
+headless: bool = sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+# Load the face models and run them once before kiosk mode opens the camera, so the first person is not kept waiting
+kiosk_warm_up: bool = True
 
-key_path: Path = Path("secret.key")
+# Local port serving the stage timings and counters in the Prometheus text format, None turns the endpoint off
+metrics_port: int | None = None
+# File the stage timings and counters are written to as JSON every few seconds, None turns the dump off
+metrics_json_path: Path | None = None
 
 
 #=========================================================================================================================================
-# function to generate or load an existing Fernet encryption key
-def load_or_create_key() -> bytes:
+# function that returns the configured face detector
+def get_detector() -> detectors.Detector:
     """
-        Generates or loads an existing Fernet encryption key
+        Builds the face detector from the settings at the top of the file, only once
 
         Returns:
-        key (bytes): The encryption key
+            detector (detectors.Detector): The configured face detector
     """
-    if not key_path.exists():                       # if the key file does not exist
-        key = Fernet.generate_key()                 # generate new encryption key
-        with open(key_path, "wb") as key_file:      # write a new key to a file
-            key_file.write(key)
-    else:
-        with open(key_path, "rb") as key_file:      # it reads the key from the file if it exists
-            key = key_file.read()
-    return key                                      # return the encryption key
+    global _detector
+    if _detector is None:
+        _detector = detectors.make_detector(detector_backend, detector_scale, detector_upsample, model_path=detector_model)
+    return _detector
+
+#=========================================================================================================================================
+# function that imports the vision stack
+def prefetch() -> None:
+    """
+        Imports every lazily imported module, importing face_recognition is what loads the dlib models
+    """
+    for module in (face_recognition, cv2, np, embedding_store, gallery, kiosk, pipeline, detectors, secure_images, key_manager,
+                   auto_enroll, batch_encoder, templates, liveness):
+        if isinstance(module, LazyModule):
+            module.load()
+
+#=========================================================================================================================================
+# function that imports the vision stack in the background
+def start_prefetch() -> None:
+    """
+        Imports the vision stack on a background thread, so it is loaded by the time the user has typed their email
+    """
+    threading.Thread(target=prefetch, daemon=True).start()
+
+#=========================================================================================================================================
+# function that gets the models ready before the first face
+def warm_up() -> float:
+    """
+        Imports the vision stack, builds the detector and runs the detector and the encoder once on a blank frame,
+        so their first real call does not pay for loading and allocating
+
+        Returns:
+            seconds (float): Time the warm-up took
+    """
+    start = time.perf_counter()
+    with metrics.span("warm_up"):
+        prefetch()
+        blank = np.zeros((480, 640, 3), dtype=np.uint8)
+        get_detector()(blank)
+        batch_encoder.encode_faces([blank], [[(140, 420, 340, 220)]])
+        key_manager.get_cipher()
+    return time.perf_counter() - start
 
 #=========================================================================================================================================
 # function to create the image directory if it does not exist
@@ -75,14 +164,16 @@ def menu() -> str:
             selection(str): The users selection from the menu
     """
     # Options for user to select from
-    options: list[str] = ["1", "2", "3"]
+    options: list[str] = ["1", "2", "3", "4", "5"]
 
     # loop until a valid option is chosen
     while True:
         print("Please select an options below:")
         print(f"\t1. Existing User")
         print(f"\t2. New User")
-        print(f"\t3. Exit")
+        print(f"\t3. Walk-up Check-in")
+        print(f"\t4. Kiosk Mode")
+        print(f"\t5. Exit")
 
         # Prompt user to enter a value
         selection: str = input("Enter an option: ")
@@ -94,31 +185,6 @@ def menu() -> str:
             # Error message for incorrect inputs
             print("Error: Please enter a value from the menu above")
 
-#=========================================================================================================================================
-# function that generate a new user ID
-def user_id() -> int:
-    """
-        Function to calculate a number that will be assigned to each user
-
-        Returns:
-            user_num (int): The user ID number 
-    """
-
-    # Check if the file exists
-    if not csv_file_path.is_file():
-        print("File does not exist ...")
-        # Assign first user as 1 if none exist
-        return 1
-    
-    # Open the file in read mode
-    with open(csv_file_path, "r") as file:
-        reader: csv.DictReader = csv.DictReader(file)  # Read rows as dictionaries
-        # Set user counter to 0
-        user_num: int = 0
-        for row in reader:
-            user_num += 1      # count rows (users)
-    return user_num + 1        # new ID is total users + 1
-
 #=========================================================================================================================================
 # function that collect new user's info and store in a dictionary
 def user_info() -> dict[str, str]:
@@ -144,51 +210,23 @@ def user_info() -> dict[str, str]:
 
     return user_record      # return user input as dictionary
 
-#=========================================================================================================================================
-# function that write a user record to the CSV file   
-def write_csv(records: dict[str, str]) -> None:
-    """
-        Writes user_record data into the csv file. If the file already exists then a record is appended
-
-        Arg:
-            user_record (dict[str, str]): Basic user information passed in
-    """
-
-    # Check if the file is being written to for the first time
-    first_write: bool = not csv_file_path.is_file()
-    # If the file hasn't been written in yet
-    if first_write:
-    # Open the file in write mode
-        with open(csv_file_path, "w") as file:
-            field_names: list[str] = list(records.keys())                          # Extract field names from the dictionary
-            writer: csv.DictWriter = csv.DictWriter(file, fieldnames=field_names)  # Initialize DictWriter
-            writer.writeheader()                                                   # Write header row 
-            writer.writerow(records)                                               # Write the record 
-    else:
-        # Open the file in append mode
-        with open(csv_file_path, "a") as file:
-            field_names: list[str] = list(records.keys())                          # Extract field names from the dictionary
-            writer: csv.DictWriter = csv.DictWriter(file, fieldnames=field_names)  # Initialize DictWriter
-            writer.writerow(records)                                               # Write the record
-
 #=========================================================================================================================================
 # function that capture and encrypt 10 face images for a new user
-def new_user(user_num: int, records: dict[str, str]) -> None:
+def new_user(user_num: int, records: dict[str, str], auto: bool = False) -> None:
     """
         Captures and encrypts 10 user images using spacebar. Shows webcam feed with guidance.
 
         Arg:
             user_num (int): Users ID number
             records (dict[str, str]): A users record
+            auto (bool): Pick the 10 best frames automatically instead of waiting for SPACE
     """
-    key = load_or_create_key()      # call the function to load the existing encryption key, 
-                                    # create a new one if it doesn't exist, then store the returned key (bytes) in the variable (key)
-    cipher = Fernet(key)            # initialize Fernet object for encryption
+    cipher = key_manager.get_cipher()   # cipher for the current encryption key, the key file is only read once per process
+    file_creation()                     # the certified folder is only needed once someone enrolls
 
     video = cv2.VideoCapture(0)         # opens the default webcam
     user_id_check: str = str(user_num)  # convert user number to string
     records["id"] = user_id_check       # add user ID to their records
-    write_csv(records)                  # write the record to the CSV file
 
     personalized_folder = os.path.join(certified_folder, user_id_check)     # folder path for this user's images
     if not os.path.exists(personalized_folder):                             # create the folder if it doesn'e exists
@@ -199,6 +237,11 @@ def new_user(user_num: int, records: dict[str, str]) -> None:
         print("Error: Couldn't open camera")    # prints the error message
         return
 
+    # Without a display there is no window to press SPACE in, so the photos are picked automatically
+    if auto or headless:
+        new_user_auto(video, user_id_check, personalized_folder, cipher)
+        return
+
     # instructions to guide the user for each of photo
     instructions:list = [
         "Look straight",
@@ -214,10 +257,12 @@ def new_user(user_num: int, records: dict[str, str]) -> None:
     ]
 
     photo_count: int = 0        # counter for number of photos taken
+    captured_frames: list = []  # frames kept in memory so their encodings can be stored once capture is done
     print("Press SPACE to take a photo. Press Q to quit.")
 
     while photo_count < 10:             # loops until 10 photos are captured
-        ret, frame = video.read()       # capture a frame from the webcam; 'ret' is True if successful, 'frame' is the image
+        with metrics.span("new_user.capture"):
+            ret, frame = video.read()   # capture a frame from the webcam; 'ret' is True if successful, 'frame' is the image
         if not ret:                     # if the webcam failed to capture a frame
             print("Failed to capture frame from camera.")       # prints the error message
             break                                               # exit the loop
@@ -261,16 +306,11 @@ def new_user(user_num: int, records: dict[str, str]) -> None:
             file_name = f"{user_id_check}_{photo_count+1}_{timestamp}.jpg"      # create a unique file name based on user ID, photo number, and timestamp
             raw_path = os.path.join(personalized_folder, file_name)             # build the full file path for saving the image
 
-            # save the captured frame as an unencrypted JPEG fil
-            cv2.imwrite(raw_path, frame)
-
-            # encrypt the saved images
-            with open(raw_path, "rb") as original_file:                 # open the just-saved image in binary read mode
-                encrypted_data = cipher.encrypt(original_file.read())   # encrypt the image data
-
-            with open(raw_path, "wb") as encrypted_file:                # open the same file in binrary write mode
-                encrypted_file.write(encrypted_data)                    # save the encrypt image
+            # encode the frame as JPEG in memory and encrypt it straight into its file, the unencrypted image never touches the disk
+            with metrics.span("new_user.encrypt_write"):
+                secure_images.write_encrypted_image(raw_path, frame, cipher)
 
+            captured_frames.append(frame)                                           # keep the frame to encode it after capture
             print(f"[{photo_count+1}/10] Encrypted image saved as {raw_path}")      # inform user that the photo was saved and encrypted
             photo_count += 1                                                        # move to the next photo
 
@@ -281,6 +321,19 @@ def new_user(user_num: int, records: dict[str, str]) -> None:
     video.release()             # release the webcam
     cv2.destroyAllWindows()     # close the image window
 
+    # compute the encodings once now so logins never have to re-process the pictures
+    # all pictures go through the encoder as one batch, None marks a picture without a face
+    with metrics.span("new_user.encode"):
+        frame_encodings = batch_encoder.encode_images(captured_frames, get_detector())
+    encodings: list = [encoding for encoding in frame_encodings if encoding is not None]
+    metrics.increment("enrollment_no_face", len(frame_encodings) - len(encodings))
+    if encodings:
+        with metrics.span("new_user.save_embeddings"):
+            embedding_store.save_embeddings(user_id_check, encodings, cipher)     # store them encrypted in the embedding store
+        print(f"Stored face data from {len(encodings)} photos.")
+    elif captured_frames:
+        print("Warning: No face was found in the captured photos.")
+
     # after photo capture is done, inform the user whether all 10 photos were successfully captured
     if photo_count == 10:
         print("All photos captured. You're ready to check in!")
@@ -288,6 +341,40 @@ def new_user(user_num: int, records: dict[str, str]) -> None:
         print(f"Only captured {photo_count} out of 10 photos.")
 
 
+#=========================================================================================================================================
+# function that captures the best 10 photos of a new user without key presses
+def new_user_auto(video: cv2.VideoCapture, user_id_check: str, personalized_folder: str, cipher: key_manager.MultiFernet) -> None:
+    """
+        Lets the camera pick the 10 most useful frames (one sharp face, varied poses), then encrypts and stores them
+
+        Arg:
+            video (cv2.VideoCapture): Opened webcam
+            user_id_check (str): Users ID number
+            personalized_folder (str): Folder for this users images
+            cipher (MultiFernet): Cipher used to encrypt the images and encodings
+    """
+    # every kept frame comes with its encoding, so nothing has to be encoded again
+    best_frames = auto_enroll.capture_best_frames(video, get_detector(), show=not headless)
+    video.release()             # release the webcam
+    if not headless:
+        cv2.destroyAllWindows()     # close the image window
+
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")                # get current date and time as a string for file naming
+    for photo_num, (frame, _) in enumerate(best_frames, start=1):
+        raw_path = os.path.join(personalized_folder, f"{user_id_check}_{photo_num}_{timestamp}.jpg")
+        with metrics.span("new_user.encrypt_write"):
+            secure_images.write_encrypted_image(raw_path, frame, cipher)
+        print(f"[{photo_num}/10] Encrypted image saved as {raw_path}")
+
+    if best_frames:
+        with metrics.span("new_user.save_embeddings"):
+            embedding_store.save_embeddings(user_id_check, [encoding for _, encoding in best_frames], cipher)
+
+    if len(best_frames) == auto_enroll.TARGET_FRAMES:
+        print("All photos captured. You're ready to check in!")
+    else:
+        print(f"Only captured {len(best_frames)} out of {auto_enroll.TARGET_FRAMES} photos.")
+
 #=========================================================================================================================================
 
 def existing_user() -> list[object]:
@@ -297,86 +384,40 @@ def existing_user() -> list[object]:
         Returns:
             identifiers(list[object]): A list that contains a boolean value to permit users and the permitted users email
     """
+    # Load the vision stack while the user types
+    start_prefetch()
     # Prompt user to enter their email
     user_email: str = input("Please enter your email: ")
     
-    # Default camera
-    video = cv2.VideoCapture(0)
-    # List to hold user IDs
-    stored_ids: list[str] = []
-    # List to hold encodings
-    stored_encodings = []
-
-    # Checks if the user records CSV file exists
-    if not csv_file_path.is_file():
-        print("ERROR: No user records found")
+    # Look the email up in the user database
+    with metrics.span("existing_user.lookup"):
+        row = user_registry.find_by_email(user_email)
+    # If the email was not found then print error message
+    if row is None:
+        print("Access denied: Email not found.")
         return [False, ""]
-    
-    # Open the file in read mode
-    with open(csv_file_path, "r") as file:
-        reader: csv.DictReader = csv.DictReader(file)  # Read rows as dictionaries
-        # Flag to identify if an email was found
-        email_identified: bool = False
-        for row in reader:
-            # Compare the entered email with the email within each row.
-            if row["email"] == user_email:
-                print(f"Email found..scanning now...")
-                # Store that users id
-                id_match = row["id"]
-                # Store that users first name
-                first_name = row["first_name"]
-                # Store that users last name
-                last_name = row["last_name"]
-                # Set email flag true
-                email_identified = True
-                # If the email was found then exit
-                break
-        # If the email was not found then print error message
-        if not email_identified:
-            print("Access denied: Email not found.")
-            return [False, ""]
+    print(f"Email found..scanning now...")
+    # Store that users id
+    id_match = row["id"]
+    # Store that users first name
+    first_name = row["first_name"]
+    # Store that users last name
+    last_name = row["last_name"]
 
-    # Folder path for folder containing encrypted pictures
-    folder_for_user: str = os.path.join(certified_folder, id_match)
-
-    # Load or create key to decrypt
-    key = load_or_create_key()
-    cipher = Fernet(key)
-
-    # Check to see if the user folder exists
-    if os.path.isdir(folder_for_user):
-        # Looping through every picture within the folder
-        for pic_name in os.listdir(folder_for_user):
-            pic_path: str = os.path.join(folder_for_user, pic_name)
-
-            # Decrypt image into memory
-            with open(pic_path, "rb") as encrypted_file:
-                encrypted_data = encrypted_file.read()
-                try:
-                    decrypted_data = cipher.decrypt(encrypted_data)
-                except Exception as e:
-                    print(f"Failed to decrypt {pic_name}: {e}")
-                    continue
-
-            # Convert decrypted bytes back to image
-            nparr = np.frombuffer(decrypted_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-            if img is None:
-                print(f"Error decoding image: {pic_path}")
-                continue
-
-            # Encode the face in the picture
-            encodings = face_recognition.face_encodings(img)
-            if encodings:
-                stored_encodings.append(encodings[0])
-                stored_ids.append(id_match)
+    # Cipher that can decrypt with the current and any older key
+    cipher = key_manager.get_cipher()
+
+    # Load the encodings computed at enrollment, they are only rebuilt from the pictures if missing or outdated
+    with metrics.span("existing_user.load_embeddings"):
+        stored_encodings = embedding_store.load_or_rebuild_embeddings(id_match, cipher, certified_folder)
 
     # If no encodings found then user is denied entry
-    if not stored_encodings:
+    if stored_encodings is None or len(stored_encodings) == 0:
         print("No data available for user")
         return [False, ""]
-    
+
+    # Default camera
+    video = cv2.VideoCapture(0)
 
     # If your camera cannot open then error will print
     if not video.isOpened():
@@ -384,35 +425,47 @@ def existing_user() -> list[object]:
         return [False, ""]
     
     # Take a picture
-    ret, frame = video.read()
-    # Release the camera once picture taken
-    video.release()
-    # Close OpenCV windows
-    cv2.destroyAllWindows()
+    with metrics.span("existing_user.camera"):
+        ret, frame = video.read()
+    # Release the camera once picture taken, the liveness check keeps reading from it
+    if not liveness_check:
+        video.release()
+        # Close OpenCV windows
+        if not headless:
+            cv2.destroyAllWindows()
 
     # Checks if the webcam worked as intended
     if not ret:
+        video.release()
         print("Error: Couldn't take picture")
         return [False, ""]
     
     # Convert picture from BGR to RGB
     rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     # Locating faces within the corrected picture
-    face_locations = face_recognition.face_locations(rgb_frame)
+    with metrics.span("existing_user.detect"):
+        face_locations = get_detector()(rgb_frame)
     # Create encodings for the picture
-    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+    with metrics.span("existing_user.encode"):
+        face_encodings = batch_encoder.encode_faces([rgb_frame], [face_locations])[0]
 
     # If no faces detected then print error
     if not face_encodings:
+        video.release()
+        metrics.increment("no_face")
         print("No faces detected. Please try again.")
         return [False, ""]
     
-    # Compare this encoding with all stored face encodings
-    for encoding in face_encodings:
-        matches = face_recognition.compare_faces(stored_encodings, encoding)
-
-        # If a match is made
-        if any(matches):
+    # Compare this encoding with the users template instead of every stored encoding
+    for box, encoding in zip(face_locations, face_encodings):
+        with metrics.span("existing_user.match"):
+            distance = float(face_recognition.face_distance(templates.cached_template(id_match, stored_encodings), encoding).min())
+
+        # If a match is made, the face still has to prove it is not a photo
+        if distance <= gallery.DEFAULT_TOLERANCE and confirm_liveness(video, rgb_frame, box):
+            metrics.increment("matches")
+            # A confident match keeps the template up to date
+            templates.refine(id_match, encoding, distance, cipher)
             # Welcome the user
             print(f"Welcome, {first_name} {last_name}")
             # Mark the user as present
@@ -421,9 +474,179 @@ def existing_user() -> list[object]:
             return [True, user_email]
         else:
             # If there aren't any matches then deny user
+            video.release()
+            metrics.increment("rejects")
             print("Access denied")
             return [False, ""]
    
+#=========================================================================================================================================
+# function that returns the gallery used for walk-up check-ins
+def get_walk_up_gallery(cipher: key_manager.MultiFernet) -> gallery.Gallery:
+    """
+        Loads the gallery of every enrolled user on the first walk-up, later walk-ups only apply the embedding log
+        records added since, so users enrolled in the meantime are found without rebuilding everyone
+
+        Args:
+            cipher (MultiFernet): Cipher used to decrypt the embedding files
+
+        Returns:
+            user_gallery (gallery.Gallery): The resident gallery
+    """
+    global _walk_up_gallery
+    if _walk_up_gallery is None:
+        _walk_up_gallery = gallery.load_gallery(cipher, certified_folder, storage=gallery_storage, snapshot=gallery_snapshot)
+    else:
+        _walk_up_gallery.refresh(force=True)
+    return _walk_up_gallery
+
+#=========================================================================================================================================
+# function that identifies whoever is in front of the camera without asking for an email
+def walk_up_check_in() -> list[object]:
+    """
+        Scans the users face and matches it against every enrolled user at once, no email needed
+
+        Returns:
+            identifiers(list[object]): A list that contains a boolean value to permit users and the permitted users email
+    """
+    # Cipher that can decrypt with the current and any older key
+    cipher = key_manager.get_cipher()
+
+    # The encodings of every user in one matrix, only loaded in full for the first walk-up
+    with metrics.span("walk_up.load_gallery"):
+        user_gallery = get_walk_up_gallery(cipher)
+    if len(user_gallery) == 0:
+        print("ERROR: No enrolled users found")
+        return [False, ""]
+
+    # Default camera
+    video = cv2.VideoCapture(0)
+    # If your camera cannot open then error will print
+    if not video.isOpened():
+        print("Error: Could not open the camera")
+        return [False, ""]
+
+    # Take a picture
+    with metrics.span("walk_up.camera"):
+        ret, frame = video.read()
+    # Release the camera once picture taken, the liveness check keeps reading from it
+    if not liveness_check:
+        video.release()
+
+    # Checks if the webcam worked as intended
+    if not ret:
+        video.release()
+        print("Error: Couldn't take picture")
+        return [False, ""]
+
+    # Convert picture from BGR to RGB
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # Locating faces within the corrected picture
+    with metrics.span("walk_up.detect"):
+        face_locations = get_detector()(rgb_frame)
+    # Create encodings for the picture
+    with metrics.span("walk_up.encode"):
+        face_encodings = batch_encoder.encode_faces([rgb_frame], [face_locations])[0]
+
+    # If no faces detected then print error
+    if not face_encodings:
+        video.release()
+        metrics.increment("no_face")
+        print("No faces detected. Please try again.")
+        return [False, ""]
+
+    # Identify the first face against the whole gallery
+    with metrics.span("walk_up.match"):
+        matched_id, distance = user_gallery.identify(face_encodings[0])
+    record = user_registry.find_by_id(matched_id) if matched_id is not None else None
+    # A matched face still has to prove it is not a photo
+    if record is not None and not confirm_liveness(video, rgb_frame, face_locations[0]):
+        record = None
+    video.release()
+    if record is None:
+        metrics.increment("rejects")
+        print("Access denied")
+        return [False, ""]
+    metrics.increment("matches")
+    # A confident match keeps the template up to date
+    templates.refine(matched_id, face_encodings[0], distance, cipher)
+
+    # Welcome the user and mark them as present
+    print(f"Welcome, {record['first_name']} {record['last_name']}")
+    take_attendance(record["email"])
+    return [True, record["email"]]
+
+#=========================================================================================================================================
+# function that runs the lobby kiosk until it is stopped
+def kiosk_mode() -> None:
+    """
+        Keeps the camera open and checks in every enrolled user that walks past
+    """
+    # Load the models and run them once, so the first person is not kept waiting
+    if kiosk_warm_up:
+        print(f"Models ready in {warm_up():.2f} seconds")
+
+    # Cipher that can decrypt with the current and any older key
+    cipher = key_manager.get_cipher()
+
+    # Load the encodings of every user into one matrix
+    user_gallery = gallery.load_gallery(cipher, certified_folder, storage=gallery_storage, snapshot=gallery_snapshot)
+    if len(user_gallery) == 0:
+        print("ERROR: No enrolled users found")
+        return
+
+    # The gallery follows the embedding log, keep the log small while the kiosk runs
+    gallery.start_background_compaction(user_gallery)
+
+    user_records = user_registry.all_users()
+    names: dict[str, str] = {user_num: f"{row['first_name']} {row['last_name']}" for user_num, row in user_records.items()}
+
+    # Called once for every newly recognized face
+    def check_in(matched_id: str) -> None:
+        record = user_records.get(matched_id)
+        # Users enrolled after the kiosk started are looked up once and remembered
+        if record is None:
+            record = user_registry.find_by_id(matched_id)
+            if record is None:
+                return
+            user_records[matched_id] = record
+            names[matched_id] = f"{record['first_name']} {record['last_name']}"
+        print(f"Welcome, {record['first_name']} {record['last_name']}")
+        take_attendance(record["email"])
+
+    # Spread detection and encoding across cores if workers are configured,
+    # the liveness check needs faces followed across frames so it always runs in the tracking loop
+    if kiosk_workers > 0 and not liveness_check:
+        use_processes = kiosk_workers > 1 if kiosk_use_processes is None else kiosk_use_processes
+        pipeline.run_pipeline(user_gallery, check_in, kiosk_workers, use_processes, show=not headless, detector=get_detector())
+    else:
+        kiosk.run_kiosk(user_gallery, check_in, names, show=not headless, detector=get_detector(),
+                        liveness_budget_ms=liveness_budget_ms if liveness_check else None)
+
+#=========================================================================================================================================
+# function that checks a matched face for liveness if it is turned on
+def confirm_liveness(video: cv2.VideoCapture, rgb_frame: np.ndarray, box: tuple[int, int, int, int]) -> bool:
+    """
+        Runs the liveness check on the matched face and the next frames of the still open camera, then releases the camera
+
+        Args:
+            video (cv2.VideoCapture): The camera the frame was taken with
+            rgb_frame (np.ndarray): The frame the face matched on, in RGB order
+            box (tuple[int, int, int, int]): Face location as (top, right, bottom, left)
+
+        Returns:
+            live (bool): True if the face is live or the check is turned off
+    """
+    if not liveness_check:
+        return True
+    print("Please blink or turn your head slightly...")
+    with metrics.span("liveness"):
+        live, added_ms = liveness.verify(video, rgb_frame, box, liveness_budget_ms)
+    video.release()
+    if not headless:
+        cv2.destroyAllWindows()
+    print(f"Liveness {'confirmed' if live else 'not confirmed'} (+{added_ms:.0f} ms)")
+    return live
+
 #=========================================================================================================================================
 # function to record attendance by saving current time and date to a CSV
 def take_attendance(email: str) -> None:
@@ -433,31 +656,11 @@ def take_attendance(email: str) -> None:
         Args:
             email (str): The email of the signed in user
     """
-    # Empty dictionary to store attendance records
-    user_attendance_record: dict[str, str] = {}
-    # Store users email
-    user_attendance_record["email"] = email
-    # Store the current date
-    user_attendance_record["date"] = datetime.now().strftime("%m-%d-%Y")
-    # Store the current time
-    user_attendance_record["time"] = datetime.now().strftime("%H:%M:%S")
-
-    # Check if the file is being written to for the first time
-    first_write: bool = not csv_attendance_path.is_file()
-    # If the file hasn't been written in yet
-    if first_write:
-    # Open the file in write mode
-        with open(csv_attendance_path, "w") as file:
-            field_names: list[str] = list(user_attendance_record.keys())  # Extract field names from the dictionary
-            writer: csv.DictWriter = csv.DictWriter(file, fieldnames=field_names)  # Initialize DictWriter
-            writer.writeheader()  # Write header row 
-            writer.writerow(user_attendance_record)  # Write the record 
-    else:
-        # Open the file in append mode
-        with open(csv_attendance_path, "a") as file:
-            field_names: list[str] = list(user_attendance_record.keys())  # Extract field names from the dictionary
-            writer: csv.DictWriter = csv.DictWriter(file, fieldnames=field_names)  # Initialize DictWriter
-            writer.writerow(user_attendance_record)  # Write the record
+    # Buffer the check-in, the store writes buffered check-ins together in one transaction
+    with metrics.span("take_attendance"):
+        recorded = attendance_store.record(email, datetime.now())
+    # Repeat check-ins within the cooldown are dropped before they reach the database
+    metrics.increment("check_ins" if recorded else "check_ins_debounced")
 
 #=========================================================================================================================================
 # function to show all attendance records for a given email
@@ -468,19 +671,36 @@ def show_attendance(email: str) -> None:
         Args: 
             email (str): Email of the current logged in user
     """
-    # Check if the file exists
-    if not csv_attendance_path.is_file():
-        print("File does not exist...")
+    # Only the rows of this user are read, through the per-user index
+    with metrics.span("show_attendance"):
+        rows = attendance_store.user_between(email)
+    if not rows:
+        print("No attendance records found...")
         return
-    
-    # Open the file in read mode
-    with open(csv_attendance_path, "r") as file:
-        reader: csv.DictReader = csv.DictReader(file)   # Read rows as dictionaries
 
-        for row in reader:
-            #Display the attendance records for the entered email
-            if row["email"] == email:
-                print(f"\t{row['date']}, {row['time']}")
+    for row_date, row_time in rows:
+        #Display the attendance records for the entered email
+        print(f"\t{attendance_store.to_display(row_date)}, {row_time}")
+
+#=========================================================================================================================================
+# function to show the weekly totals for a given email
+def show_weekly_summary(email: str, weeks: int = 8) -> None:
+    """
+        Prints the days present, hours present and late arrivals of the last few weeks, read from the weekly aggregates
+
+        Args:
+            email (str): Email of the current logged in user
+            weeks (int): Number of weeks to show, the current one included
+    """
+    today = datetime.now().date()
+    with metrics.span("show_weekly_summary"):
+        rows = reports.weekly_summary(email, today - timedelta(weeks=weeks - 1), today)
+    if not rows:
+        print("No attendance records found...")
+        return
+
+    for week, days_present, hours_present, late_arrivals in rows:
+        print(f"\tWeek of {attendance_store.to_display(week)}: {days_present} days, {hours_present} hours, {late_arrivals} late")
 
 
 
@@ -494,12 +714,13 @@ def attendance_menu() -> str:
             selection(str): The users selection from the menu
     """
     # Options for user to select from
-    verified_user_options: list[str] = ["1", "2"]
+    verified_user_options: list[str] = ["1", "2", "3"]
     # Flag for continuous looping
     option_flag: bool = False
     print("Please select an options below:")
     print(f"\t1. View Attendance")
-    print(f"\t2. Exit")
+    print(f"\t2. View Weekly Summary")
+    print(f"\t3. Exit")
     # Loop for correct user input
     if option_flag == False:
         # Prompt user to enter a value
@@ -527,43 +748,57 @@ def main() -> None:
         Raise:
             ValueError: If the value entered is not within the range displayed
     """
-    try:
-        file_creation()
-        user_select = menu()
-
-        # First option to login as an existing user
-        if user_select == "1":
-            user_status: list[object] = existing_user()
-            # Store status if a user logged in or not
-            verified_user: bool = user_status[0]
-            # Store email of successful login
-            verified_user_email: str = user_status[1]
-            # If a user successfully logged in
-            if verified_user == True:
-                attendance_options = attendance_menu()
-                # Option one to print all of the user's attendance records
-                if attendance_options == "1":
-                    show_attendance(verified_user_email)
-                # Option two to exit the program
-                elif attendance_options == "2":
-                    print("Good bye.. ")
-                    exit()
-
-        # Second option to create a new user
-        elif user_select == "2":
-            user_id_number = user_id()
-            user_records = user_info()
-            new_user(user_id_number, user_records)
-
-        # Third option to exit the program
-        elif user_select == "3":
-            print("goodbye.. for now.. ")
-            exit()
-
-
-
-    except ValueError as e:
-        print("Error: ", e)
+    # Optional metrics endpoint and JSON dump
+    if metrics_port is not None:
+        metrics.start_http_server(metrics_port)
+    if metrics_json_path is not None:
+        metrics.start_json_dump(metrics_json_path)
+
+    # Keep coming back to the menu until the user exits, so the loaded models and the walk-up gallery are reused
+    while True:
+        try:
+            user_select = menu()
+
+            # First option to login as an existing user, third option to be identified without an email
+            if user_select in ("1", "3"):
+                user_status: list[object] = existing_user() if user_select == "1" else walk_up_check_in()
+                # Store status if a user logged in or not
+                verified_user: bool = user_status[0]
+                # Store email of successful login
+                verified_user_email: str = user_status[1]
+                # If a user successfully logged in
+                if verified_user == True:
+                    attendance_options = attendance_menu()
+                    # Option one to print all of the user's attendance records
+                    if attendance_options == "1":
+                        show_attendance(verified_user_email)
+                    # Option two to print the user's weekly totals
+                    elif attendance_options == "2":
+                        show_weekly_summary(verified_user_email)
+                    # Option three to exit the program
+                    elif attendance_options == "3":
+                        print("Good bye.. ")
+                        exit()
+
+            # Second option to create a new user
+            elif user_select == "2":
+                user_records = user_info()
+                # Ask whether the photos should be taken automatically
+                auto_capture: bool = input("Take photos automatically? (y/n): ").strip().lower() == "y"
+                # Store the record, the database hands out the next user ID
+                user_id_number = user_registry.register_user(user_records)
+                new_user(user_id_number, user_records, auto_capture)
+
+            # Fourth option to run the lobby kiosk
+            elif user_select == "4":
+                kiosk_mode()
+
+            # Fifth option to exit the program
+            elif user_select == "5":
+                print("goodbye.. for now.. ")
+                exit()
+        except ValueError as e:
+            print("Error: ", e)
 
 if __name__ == "__main__":
     main()
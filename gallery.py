@@ -0,0 +1,720 @@
+# description: In-memory gallery of every enrolled encoding, used to identify a face against the whole population at once (1:N)
+#              instead of verifying it against the encodings of a single user (1:1). All encodings live in one contiguous float32
+#              matrix so a lookup is a single matrix-vector product, with an optional inverted-file (IVF) index for large galleries.
+#              A loaded gallery follows the embedding log, so users enrolled or removed by another process are picked up without
+#              reloading everyone else. The matrix can be kept as float16 or int8, and on request shared between processes as a
+#              memory-mapped snapshot in RAM-backed storage, so a second recognizer starts without decrypting anything.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import numpy as np                        # for numerical operations
+import os                                 # file directory and handling, for interacting with the OS
+import json                               # for the snapshot metadata
+import threading                          # for the background log compaction
+import time                               # for rate limiting log checks
+from hashlib import sha256                # for naming the snapshot folder after the data folder
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from cryptography.fernet import MultiFernet     # for symmetric encryption and decryption
+import embedding_store                    # for the encrypted per-user face encodings
+import key_manager                        # for the current cipher when following the log
+import metrics                            # for counting hot reloads
+import secure_images                      # for replacing the snapshot metadata atomically
+import templates                          # for condensing every user into a compact template
+
+
+# Same default tolerance as face_recognition.compare_faces
+DEFAULT_TOLERANCE: float = 0.6
+
+# Number of nearest encodings looked at before the per-user vote
+DEFAULT_TOP_K: int = 10
+
+# Galleries with more encodings than this get an IVF index when built with load_gallery(index="auto")
+INDEX_THRESHOLD: int = 100_000
+
+# Seconds between two checks of the embedding log, a new user is recognizable this long after enrolling
+RELOAD_INTERVAL: float = 0.5
+
+# Rows of removed or re-enrolled users, relative to the live rows, before the matrix is compacted
+COMPACT_DEAD_RATIO: float = 0.25
+
+# Superseded log records, relative to the enrolled users, before the log is compacted
+LOG_STALE_RATIO: float = 0.5
+
+# Seconds between two checks whether the log needs compacting
+COMPACT_INTERVAL: float = 60.0
+
+# Storage types of the gallery matrix, the smaller ones trade a little accuracy and scan latency for memory. numpy
+# converts float16 to float32 slowly, so a full float16 scan takes about 8 times as long as float32 and twice as long as int8
+STORAGE_TYPES: dict[str, type] = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Rows converted to float32 at a time when scanning a float16 or int8 matrix, bounds the temporary memory
+DEQUANTIZE_CHUNK: int = 65536
+
+# Folder for the memory-mapped snapshots shared by every recognizer on the machine, only used by load_gallery(snapshot=True).
+# A snapshot holds the encodings (biometric templates) unencrypted, outside the Fernet store, so the folder has to be
+# RAM-backed (not persisted) and only readable by the service account. None turns snapshots off.
+snapshot_root: Path | None = Path("/dev/shm") if os.path.isdir("/dev/shm") else None
+
+# Changed users, relative to all users, before loading writes a fresh snapshot
+SNAPSHOT_STALE_RATIO: float = 0.05
+
+
+#=========================================================================================================================================
+# function that converts encodings to a storage type
+def quantize(matrix: np.ndarray, storage: str, scale: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+        Converts float encodings to a storage type. int8 uses one scale per dimension, so the largest value of every
+        dimension maps to 127 and each value is stored as round(value / scale).
+
+        Args:
+            matrix (np.ndarray): The (rows, 128) encodings
+            storage (str): "float32", "float16" or "int8"
+            scale (np.ndarray | None): int8 scale to reuse, None derives it from the matrix
+
+        Returns:
+            stored (np.ndarray): The encodings in the storage type
+            scale (np.ndarray | None): The per-dimension int8 scale, None for the float types
+    """
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, embedding_store.ENCODING_DIM)
+    if storage != "int8":
+        return matrix.astype(STORAGE_TYPES[storage]), None
+    if scale is None:
+        largest = np.abs(matrix).max(axis=0) if len(matrix) else np.ones(embedding_store.ENCODING_DIM, dtype=np.float32)
+        scale = (np.maximum(largest, 1e-6) / 127).astype(np.float32)
+    return np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8), scale
+
+#=========================================================================================================================================
+# function that converts stored rows back to float32
+def _as_float32(block: np.ndarray, scale: np.ndarray | None) -> np.ndarray:
+    block = block.astype(np.float32, copy=False)
+    return block * scale if scale is not None else block
+
+#=========================================================================================================================================
+# function that computes matrix @ queries.T for any storage type
+def _scan(matrix: np.ndarray, queries: np.ndarray, scale: np.ndarray | None) -> np.ndarray:
+    if matrix.dtype == np.float32:
+        return matrix @ queries.T
+    # int8 rows times the scaled query equals the dequantized rows times the query, so the rows only need a cast
+    if scale is not None:
+        queries = queries * scale
+    products = np.empty((len(matrix), len(queries)), dtype=np.float32)
+    for start in range(0, len(matrix), DEQUANTIZE_CHUNK):
+        products[start:start + DEQUANTIZE_CHUNK] = matrix[start:start + DEQUANTIZE_CHUNK].astype(np.float32) @ queries.T
+    return products
+
+#=========================================================================================================================================
+# function that computes the squared norm of every stored row
+def _row_norms(matrix: np.ndarray, scale: np.ndarray | None) -> np.ndarray:
+    sq_norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), DEQUANTIZE_CHUNK):
+        sq_norms[start:start + DEQUANTIZE_CHUNK] = (_as_float32(matrix[start:start + DEQUANTIZE_CHUNK], scale) ** 2).sum(axis=1)
+    return sq_norms
+
+
+#=========================================================================================================================================
+# class for an inverted-file index over the gallery matrix
+class IVFIndex:
+    """
+        Approximate index that clusters the gallery with k-means and only scans the clusters closest to the query
+
+        Args:
+            n_lists (int): Number of clusters (inverted lists)
+            n_probe (int): Number of clusters scanned per query
+    """
+
+    def __init__(self, n_lists: int, n_probe: int = 8) -> None:
+        self.n_lists: int = n_lists
+        self.n_probe: int = n_probe
+        self.centroids: np.ndarray = np.empty((0, embedding_store.ENCODING_DIM), dtype=np.float32)
+        self.order: np.ndarray = np.empty(0, dtype=np.int64)      # gallery rows sorted by cluster
+        self.offsets: np.ndarray = np.zeros(1, dtype=np.int64)    # start of every cluster within order
+
+    def train(self, matrix: np.ndarray, iterations: int = 10, sample_per_list: int = 64, seed: int = 0,
+              scale: np.ndarray | None = None) -> None:
+        """
+            Clusters the gallery with k-means on a sample and assigns every row to its closest cluster
+
+            Args:
+                matrix (np.ndarray): The (rows, 128) gallery matrix in any storage type
+                iterations (int): Number of k-means iterations
+                sample_per_list (int): Rows sampled per cluster to train the centroids
+                seed (int): Seed for the random sample, so rebuilding gives the same index
+                scale (np.ndarray | None): The per-dimension scale of an int8 matrix
+        """
+        rng = np.random.default_rng(seed)
+        n_lists: int = max(1, min(self.n_lists, len(matrix)))
+
+        # Train on a sample, a full k-means pass over a large gallery is not needed for good clusters
+        sample_size: int = min(len(matrix), n_lists * sample_per_list)
+        sample = _as_float32(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], scale)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = _nearest_centroid(sample, centroids)
+            for list_num in range(n_lists):
+                members = sample[assignment == list_num]
+                # Keep the old centroid for empty clusters
+                if len(members):
+                    centroids[list_num] = members.mean(axis=0)
+
+        # Sort the gallery rows by cluster so every cluster is one slice of order
+        assignment = _nearest_centroid(matrix, centroids, scale)
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(assignment[self.order], np.arange(n_lists + 1))
+        self.n_lists = n_lists
+
+    def candidates(self, encoding: np.ndarray) -> np.ndarray:
+        """
+            Returns the gallery rows in the clusters closest to the encoding
+
+            Args:
+                encoding (np.ndarray): The 128-d query encoding
+
+            Returns:
+                rows (np.ndarray): Row numbers of the candidate encodings
+        """
+        centroid_dist = ((self.centroids - encoding) ** 2).sum(axis=1)
+        n_probe: int = min(self.n_probe, self.n_lists)
+        probed = np.argpartition(centroid_dist, n_probe - 1)[:n_probe]
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in probed])
+
+#=========================================================================================================================================
+# function that finds the closest centroid of every row, in chunks to bound memory
+def _nearest_centroid(rows: np.ndarray, centroids: np.ndarray, scale: np.ndarray | None = None, chunk: int = 8192) -> np.ndarray:
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), chunk):
+        block = _as_float32(rows[start:start + chunk], scale)
+        # |a-b|^2 = |a|^2 + |b|^2 - 2ab, |a|^2 is the same for every centroid so it can be dropped
+        assignment[start:start + chunk] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+    return assignment
+
+#=========================================================================================================================================
+# class for the gallery of all enrolled encodings
+class Gallery:
+    """
+        Contiguous matrix of every enrolled encoding together with the user each row belongs to
+
+        Args:
+            matrix (np.ndarray): The (rows, 128) encodings of every user, float32, float16 or int8 (may be memory-mapped)
+            labels (list[str]): The user ID of every row, or the position in user_ids if user_ids is given
+            user_ids (list[str] | None): User IDs the integer labels point into
+            scale (np.ndarray | None): The per-dimension scale of an int8 matrix
+            sq_norms (np.ndarray | None): Squared norm of every row, computed if not given
+
+        Users can be added, replaced and removed later, each one as their template. The matrix itself is never written to, so a memory-mapped one
+        stays shared: added rows go to a small float32 tail, and rows of removed users get an infinite norm so they can
+        never match. Once enough of either pile up, the matrix is compacted.
+    """
+
+    def __init__(self, matrix: np.ndarray, labels: list[str], user_ids: list[str] | None = None,
+                 scale: np.ndarray | None = None, sq_norms: np.ndarray | None = None) -> None:
+        if not isinstance(matrix, np.ndarray) or matrix.dtype not in (np.float16, np.int8):
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.matrix: np.ndarray = matrix.reshape(-1, embedding_store.ENCODING_DIM)
+        self.scale: np.ndarray | None = scale
+        if user_ids is None:
+            # Store labels as small integers into user_ids so the per-user vote can use numpy
+            unique_ids, labels = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+            user_ids = unique_ids.tolist()
+        self.user_ids: list[str] = user_ids
+        self.labels: np.ndarray = np.asarray(labels, dtype=np.intp)
+        self.sq_norms: np.ndarray = np.array(sq_norms, dtype=np.float32) if sq_norms is not None else _row_norms(self.matrix, scale)
+        self.size: int = len(self.matrix)         # rows of the matrix plus rows of the tail
+        self.index: IVFIndex | None = None
+        self.index_rows: int = 0                  # rows covered by the index, rows appended later are scanned in full
+        self.dead: int = 0                        # rows of removed or re-enrolled users
+        self._label_of: dict[str, int] = {user_num: label for label, user_num in enumerate(self.user_ids)}
+        self._group_rows()
+
+        # Where the embedding log was last read, see refresh()
+        self.follow_log: bool = False
+        self.log_offset: int = 0
+        self.log_records: int = 0
+        self._log_id: tuple[int, int] | None = None
+        self._log_checked: float = 0.0
+        self._stamps: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self.size - self.dead
+
+    @property
+    def user_count(self) -> int:
+        return len(self._user_rows)
+
+    @property
+    def log_users(self) -> int:
+        # Users with a record in the log, including deleted ones
+        return len(self._stamps)
+
+    @property
+    def storage(self) -> str:
+        return self.matrix.dtype.name
+
+    def _group_rows(self) -> None:
+        # Rows of every user, so replacing a user does not have to scan every label
+        order = np.argsort(self.labels, kind="stable")
+        bounds = np.searchsorted(self.labels[order], np.arange(len(self.user_ids) + 1))
+        self._user_rows: dict[int, np.ndarray] = {label: order[bounds[label]:bounds[label + 1]]
+                                                  for label in range(len(self.user_ids)) if bounds[label + 1] > bounds[label]}
+        # The tail and per-row arrays double in size when full so appending a user is cheap, sq_norms and labels are views
+        self._tail: np.ndarray = np.empty((0, embedding_store.ENCODING_DIM), dtype=np.float32)
+        self._norm_buffer: np.ndarray = self.sq_norms
+        self._label_buffer: np.ndarray = self.labels
+
+    def _append(self, matrix: np.ndarray, label: int) -> np.ndarray:
+        rows, new_rows = self.size, len(matrix)
+        tail_rows: int = rows - len(self.matrix)
+        if rows + new_rows > len(self._norm_buffer):
+            capacity: int = max(2 * len(self._norm_buffer), rows + new_rows, 1024)
+            norm_buffer = np.empty(capacity, dtype=np.float32)
+            label_buffer = np.empty(capacity, dtype=np.intp)
+            norm_buffer[:rows], label_buffer[:rows] = self.sq_norms, self.labels
+            self._norm_buffer, self._label_buffer = norm_buffer, label_buffer
+        if tail_rows + new_rows > len(self._tail):
+            tail = np.empty((max(2 * len(self._tail), tail_rows + new_rows, 64), embedding_store.ENCODING_DIM), dtype=np.float32)
+            tail[:tail_rows] = self._tail[:tail_rows]
+            self._tail = tail
+
+        self._tail[tail_rows:tail_rows + new_rows] = matrix
+        self._norm_buffer[rows:rows + new_rows] = (self._tail[tail_rows:tail_rows + new_rows] ** 2).sum(axis=1)
+        self._label_buffer[rows:rows + new_rows] = label
+        self.size = rows + new_rows
+        self.sq_norms = self._norm_buffer[:self.size]
+        self.labels = self._label_buffer[:self.size]
+        return np.arange(rows, self.size)
+
+    def _dot(self, queries: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        # Products of every row (or the given rows) with every query as (rows, queries), over the matrix and the tail
+        matrix_rows: int = len(self.matrix)
+        if rows is None:
+            products = _scan(self.matrix, queries, self.scale)
+            if self.size > matrix_rows:
+                products = np.concatenate([products, self._tail[:self.size - matrix_rows] @ queries.T])
+            return products
+        in_matrix = rows < matrix_rows
+        products = np.empty((len(rows), len(queries)), dtype=np.float32)
+        products[in_matrix] = _scan(self.matrix[rows[in_matrix]], queries, self.scale)
+        products[~in_matrix] = self._tail[rows[~in_matrix] - matrix_rows] @ queries.T
+        return products
+
+    def set_user(self, user_num: str, matrix: np.ndarray) -> None:
+        """
+            Adds a user, or replaces the template of a user that is already in the gallery
+
+            Args:
+                user_num (str): The users ID number
+                matrix (np.ndarray): The (count, 128) encodings of the user, condensed into their template
+        """
+        self.remove_user(user_num)
+        label = self._label_of.get(user_num)
+        if label is None:
+            label = self._label_of[user_num] = len(self.user_ids)
+            self.user_ids.append(user_num)
+        self._user_rows[label] = self._append(templates.build_template(matrix), label)
+        self._maybe_compact()
+
+    def remove_user(self, user_num: str) -> None:
+        """
+            Removes a user, their rows can no longer match
+
+            Args:
+                user_num (str): The users ID number
+        """
+        label = self._label_of.get(user_num)
+        rows = self._user_rows.pop(label, None) if label is not None else None
+        if rows is None:
+            return
+        # An infinite norm puts the rows beyond any tolerance without touching the matrix
+        self.sq_norms[rows] = np.inf
+        self.dead += len(rows)
+
+    def _maybe_compact(self) -> None:
+        live: int = len(self)
+        unindexed: int = self.size - self.index_rows
+        if self.dead > max(1024, COMPACT_DEAD_RATIO * live) or (self.index is not None and unindexed > COMPACT_DEAD_RATIO * self.index_rows):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+            Drops the rows of removed users, moves the tail into the matrix and rebuilds the index, if there is one.
+            A memory-mapped matrix becomes a private copy, so this does nothing if there is nothing to drop or move.
+        """
+        matrix_rows: int = len(self.matrix)
+        if self.dead == 0 and self.size == matrix_rows:
+            return
+        alive = np.isfinite(self.sq_norms)
+        tail, _ = quantize(self._tail[:self.size - matrix_rows][alive[matrix_rows:]], self.storage, self.scale)
+        self.matrix = np.concatenate([self.matrix[alive[:matrix_rows]], tail])
+        # Tail rows were stored as float32, their norms change with the storage type
+        self.sq_norms = np.concatenate([self.sq_norms[:matrix_rows][alive[:matrix_rows]], _row_norms(tail, self.scale)])
+        self.labels = self.labels[alive].copy()
+        self.size = len(self.matrix)
+        self.dead = 0
+        self._group_rows()
+        if self.index is not None:
+            self.build_index(n_probe=self.index.n_probe)
+
+    def set_storage(self, storage: str) -> None:
+        """
+            Converts the matrix to another storage type
+
+            Args:
+                storage (str): "float32", "float16" or "int8"
+        """
+        if storage == self.storage:
+            return
+        self.compact()
+        self.matrix, self.scale = quantize(_as_float32(self.matrix, self.scale), storage)
+        self.sq_norms = _row_norms(self.matrix, self.scale)
+        self._group_rows()
+        if self.index is not None:
+            self.build_index(n_probe=self.index.n_probe)
+
+    def build_index(self, n_lists: int | None = None, n_probe: int = 8) -> None:
+        """
+            Builds the optional IVF index, by default with about sqrt(rows) clusters
+
+            Args:
+                n_lists (int | None): Number of clusters, None picks one from the gallery size
+                n_probe (int): Number of clusters scanned per query
+        """
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(self.matrix))))
+        self.index = IVFIndex(n_lists, n_probe)
+        self.index.train(self.matrix, scale=self.scale)
+        self.index_rows = len(self.matrix)
+
+    def nearest(self, encoding: np.ndarray, top_k: int = DEFAULT_TOP_K) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Finds the gallery rows closest to an encoding
+
+            Args:
+                encoding (np.ndarray): The 128-d query encoding
+                top_k (int): Number of rows to return
+
+            Returns:
+                rows (np.ndarray): Row numbers of the closest encodings, closest first
+                distances (np.ndarray): Euclidean distance of every returned row
+        """
+        query = np.asarray(encoding, dtype=np.float32)
+        # Scan the whole gallery, or only the probed clusters and the rows appended after the index was built
+        rows = None
+        if self.index is not None:
+            rows = np.concatenate([self.index.candidates(query), np.arange(self.index_rows, self.size)])
+        sq_norms = self.sq_norms if rows is None else self.sq_norms[rows]
+
+        # Squared distances from one matrix-vector product, the square root is only taken for the top k
+        sq_dist = sq_norms + float(query @ query) - 2.0 * self._dot(query[None, :], rows)[:, 0]
+        top_k = min(top_k, len(sq_dist))
+        if top_k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        best = np.argpartition(sq_dist, top_k - 1)[:top_k]
+        best = best[np.argsort(sq_dist[best])]
+        distances = np.sqrt(np.maximum(sq_dist[best], 0.0))
+        return (best if rows is None else rows[best]), distances
+
+    def identify(self, encoding: np.ndarray, tolerance: float = DEFAULT_TOLERANCE, top_k: int = DEFAULT_TOP_K,
+                 min_votes: int = 1) -> tuple[str | None, float]:
+        """
+            Identifies an encoding against every enrolled user
+
+            The top k closest encodings vote for the user they belong to, only encodings within the tolerance count.
+            The user with the most votes wins, ties go to the user with the closest single encoding.
+
+            Args:
+                encoding (np.ndarray): The 128-d query encoding
+                tolerance (float): Largest distance that still counts as a match
+                top_k (int): Number of closest encodings taken into account
+                min_votes (int): Votes needed to accept the best user
+
+            Returns:
+                identity (tuple[str | None, float]): The matched user ID (None if rejected) and its closest distance
+        """
+        rows, distances = self.nearest(encoding, top_k)
+        return self._vote(rows, distances, tolerance, min_votes)
+
+    def identify_batch(self, encodings: np.ndarray, tolerance: float = DEFAULT_TOLERANCE, top_k: int = DEFAULT_TOP_K,
+                       min_votes: int = 1) -> list[tuple[str | None, float]]:
+        """
+            Identifies several encodings at once with a single matrix-matrix product, for callers that collect queries
+
+            Args:
+                encodings (np.ndarray): The (queries, 128) query encodings
+                tolerance (float): Largest distance that still counts as a match
+                top_k (int): Number of closest encodings taken into account
+                min_votes (int): Votes needed to accept the best user
+
+            Returns:
+                identities (list[tuple[str | None, float]]): The matched user ID (None if rejected) and closest distance per query
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, embedding_store.ENCODING_DIM)
+        # The index picks different candidate rows per query, so indexed galleries answer one query at a time
+        if self.index is not None or self.size == 0:
+            return [self.identify(query, tolerance, top_k, min_votes) for query in queries]
+
+        sq_dist = self.sq_norms[None, :] + (queries ** 2).sum(axis=1)[:, None] - 2.0 * self._dot(queries).T
+        top_k = min(top_k, self.size)
+        best = np.argpartition(sq_dist, top_k - 1, axis=1)[:, :top_k]
+        identities: list[tuple[str | None, float]] = []
+        for query_num, rows in enumerate(best):
+            rows = rows[np.argsort(sq_dist[query_num, rows])]
+            distances = np.sqrt(np.maximum(sq_dist[query_num, rows], 0.0))
+            identities.append(self._vote(rows, distances, tolerance, min_votes))
+        return identities
+
+    def _vote(self, rows: np.ndarray, distances: np.ndarray, tolerance: float, min_votes: int) -> tuple[str | None, float]:
+        within = distances <= tolerance
+        # Nothing close enough, reject
+        if not within.any():
+            return None, float(distances[0]) if len(distances) else float("inf")
+
+        # Only the few users among the top k take part in the vote
+        candidates, inverse = np.unique(self.labels[rows[within]], return_inverse=True)
+        votes = np.bincount(inverse)
+        best_dist = np.full(len(candidates), np.inf, dtype=np.float32)
+        np.minimum.at(best_dist, inverse, distances[within])
+
+        # Most votes first, then closest encoding
+        tied = np.flatnonzero(votes == votes.max())
+        winner = tied[np.argmin(best_dist[tied])]
+        if votes[winner] < min_votes:
+            return None, float(best_dist[winner])
+        return self.user_ids[candidates[winner]], float(best_dist[winner])
+
+    def in_log(self, user_num: str) -> bool:
+        # Also true for users the log deleted, so they are not brought back from their old files
+        return user_num in self._stamps
+
+    def refresh(self, force: bool = False) -> int:
+        """
+            Applies the records appended to the embedding log since the last refresh. Cheap enough to call before every
+            match, the log is only looked at every RELOAD_INTERVAL seconds.
+
+            Args:
+                force (bool): Look at the log now, even if it was checked moments ago
+
+            Returns:
+                applied (int): Number of users added, replaced or removed
+        """
+        now = time.monotonic()
+        if not self.follow_log or (not force and now - self._log_checked < RELOAD_INTERVAL):
+            return 0
+        self._log_checked = now
+        try:
+            stat = os.stat(embedding_store.log_path)
+        except FileNotFoundError:
+            return 0
+
+        # A compacted or re-encrypted log is a new file, it is read from the start but unchanged users are skipped
+        log_id = (stat.st_dev, stat.st_ino)
+        if log_id != self._log_id or stat.st_size < self.log_offset:
+            self._log_id, self.log_offset, self.log_records = log_id, 0, 0
+        if stat.st_size == self.log_offset:
+            return 0
+
+        records, self.log_offset = embedding_store.read_log(key_manager.get_cipher(), self.log_offset)
+        self.log_records += len(records)
+        applied: int = 0
+        for user_num, matrix, stamp in records:
+            if self._stamps.get(user_num) == stamp:
+                continue
+            self._stamps[user_num] = stamp
+            if matrix is None:
+                self.remove_user(user_num)
+            else:
+                self.set_user(user_num, matrix)
+            applied += 1
+        metrics.increment("gallery_updates", applied)
+        return applied
+
+#=========================================================================================================================================
+# function that picks the snapshot folder of this installation
+def snapshot_folder() -> Path | None:
+    # Named after the embedding log, so two installations on one machine never share a snapshot
+    if snapshot_root is None:
+        return None
+    return snapshot_root / f"fras-{sha256(str(embedding_store.log_path.resolve()).encode('utf-8')).hexdigest()[:16]}"
+
+#=========================================================================================================================================
+# function that writes a gallery as a memory-mappable snapshot
+def save_snapshot(gallery: Gallery, folder: Path) -> Path:
+    """
+        Writes the gallery matrix as a .npy file that other processes can memory-map, with the rows of every user in one
+        slice described by an offset table, and the embedding log position so readers continue from there
+
+        Args:
+            gallery (Gallery): The gallery to write
+            folder (Path): RAM-backed folder for the snapshot
+
+        Returns:
+            path (Path): Path of the snapshot metadata
+    """
+    gallery.compact()
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+
+    # Sort the rows by user, users without rows are left out of the offset table
+    order = np.argsort(gallery.labels, kind="stable")
+    counts = np.bincount(gallery.labels, minlength=len(gallery.user_ids))
+    users: list[list] = []
+    start: int = 0
+    for label in np.flatnonzero(counts):
+        users.append([gallery.user_ids[label], start, int(counts[label])])
+        start += int(counts[label])
+
+    stamp: int = time.time_ns()
+    matrix_name, norms_name = f"gallery-{stamp}.npy", f"gallery-{stamp}-norms.npy"
+    # Only this user may read the unencrypted encodings
+    for name in (matrix_name, norms_name):
+        os.close(os.open(folder / name, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600))
+    matrix = np.lib.format.open_memmap(folder / matrix_name, mode="w+", dtype=gallery.matrix.dtype, shape=gallery.matrix.shape)
+    for chunk_start in range(0, len(order), DEQUANTIZE_CHUNK):
+        matrix[chunk_start:chunk_start + DEQUANTIZE_CHUNK] = gallery.matrix[order[chunk_start:chunk_start + DEQUANTIZE_CHUNK]]
+    matrix.flush()
+    del matrix
+    np.save(folder / norms_name, gallery.sq_norms[order])
+
+    metadata: dict[str, object] = {
+        "version": embedding_store.STORE_VERSION,
+        "storage": gallery.storage,
+        "scale": gallery.scale.tolist() if gallery.scale is not None else None,
+        "matrix": matrix_name,
+        "norms": norms_name,
+        "users": users,
+        "stamps": gallery._stamps,
+        "log_id": list(gallery._log_id) if gallery._log_id is not None else None,
+        "log_offset": gallery.log_offset,
+        "log_records": gallery.log_records,
+    }
+    path = folder / "gallery.json"
+    secure_images.atomic_write(path, json.dumps(metadata).encode("utf-8"))
+
+    # Older snapshots can go, processes that still map them keep reading them until they let go
+    for old_path in folder.glob("gallery-*.npy"):
+        if old_path.name not in (matrix_name, norms_name):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
+
+#=========================================================================================================================================
+# function that opens a snapshot without reading the matrix into memory
+def open_snapshot(folder: Path) -> Gallery | None:
+    """
+        Memory-maps the gallery snapshot, the matrix pages are shared with every other process that maps it
+
+        Args:
+            folder (Path): Folder of the snapshot
+
+        Returns:
+            gallery (Gallery | None): The gallery following the log from where the snapshot was taken, None if there is no usable snapshot
+    """
+    try:
+        metadata: dict = json.loads((folder / "gallery.json").read_bytes())
+        matrix = np.load(folder / metadata["matrix"], mmap_mode="r")
+        sq_norms = np.load(folder / metadata["norms"])
+    except (OSError, ValueError, KeyError):
+        return None
+    if metadata.get("version") != embedding_store.STORE_VERSION:
+        return None
+
+    user_ids: list[str] = [user_num for user_num, _, _ in metadata["users"]]
+    labels = np.repeat(np.arange(len(user_ids)), [count for _, _, count in metadata["users"]])
+    scale = np.asarray(metadata["scale"], dtype=np.float32) if metadata["scale"] is not None else None
+    gallery = Gallery(matrix, labels, user_ids, scale, sq_norms)
+    gallery.follow_log = True
+    gallery._stamps = {user_num: int(stamp) for user_num, stamp in metadata["stamps"].items()}
+    gallery._log_id = tuple(metadata["log_id"]) if metadata["log_id"] is not None else None
+    gallery.log_offset = metadata["log_offset"]
+    gallery.log_records = metadata["log_records"]
+    return gallery
+
+#=========================================================================================================================================
+# function that loads the encodings of every enrolled user into a gallery
+def load_gallery(cipher: MultiFernet, certified_folder: Path, index: str = "auto", storage: str = "float32", snapshot: bool = False) -> Gallery:
+    """
+        Builds a gallery from the embedding log, and the shared snapshot if asked for, rebuilding missing embedding files from the enrollment images
+
+        Args:
+            cipher (MultiFernet): Cipher used to decrypt the embedding files
+            certified_folder (Path): Folder that contains one image folder per user
+            index (str): "auto" builds an IVF index for large galleries, "ivf" always builds one, "none" never does
+            storage (str): "float32", "float16" (half the memory) or "int8" (a quarter of the memory)
+            snapshot (bool): Map and write the unencrypted snapshot in snapshot_root, shared by every recognizer on the machine
+
+        Returns:
+            gallery (Gallery): Gallery holding the encodings of every user
+    """
+    # A snapshot written by another process only needs the log records added since
+    folder = snapshot_folder() if snapshot else None
+    gallery = open_snapshot(folder) if folder is not None else None
+    from_snapshot: bool = gallery is not None and gallery.storage == storage
+    if not from_snapshot:
+        # Without one, the log holds the encodings of every user in one file
+        gallery = Gallery(np.empty((0, embedding_store.ENCODING_DIM), dtype=np.float32), [])
+        gallery.follow_log = True
+    snapshot_log_id = gallery._log_id
+    changed: int = gallery.refresh(force=True)
+
+    # Every enrolled user has a folder of pictures, even if their encodings are not in the log yet
+    user_nums: list[str] = []
+    if os.path.isdir(certified_folder):
+        user_nums = sorted(name for name in os.listdir(certified_folder) if os.path.isdir(os.path.join(certified_folder, name)))
+
+    # Users from before the log existed are added to it once, a rebuild adds itself through save_embeddings
+    missing: list[tuple[str, np.ndarray]] = []
+    for user_num in user_nums:
+        if gallery.in_log(user_num):
+            continue
+        matrix = embedding_store.load_embeddings(user_num, cipher)
+        if matrix is not None and len(matrix):
+            missing.append((user_num, matrix))
+        else:
+            # Users without a usable face have an empty file, they are skipped until their images change
+            embedding_store.load_or_rebuild_embeddings(user_num, cipher, certified_folder)
+    if missing:
+        embedding_store.append_log(missing, cipher)
+    changed += gallery.refresh(force=True)
+
+    # Write a fresh snapshot if there was none, or if the next process would have to replay much of the log
+    if not from_snapshot or changed > SNAPSHOT_STALE_RATIO * gallery.user_count or gallery._log_id != snapshot_log_id:
+        # Users with several records in the log leave dead rows behind, drop them before the gallery is used
+        gallery.compact()
+        gallery.set_storage(storage)
+        if folder is not None and len(gallery):
+            save_snapshot(gallery, folder)
+            # Map the snapshot just written rather than keeping a private copy
+            gallery = open_snapshot(folder) or gallery
+
+    if index == "ivf" or (index == "auto" and len(gallery) > INDEX_THRESHOLD):
+        gallery.build_index()
+    return gallery
+
+#=========================================================================================================================================
+# function that keeps the embedding log small in the background
+def start_background_compaction(user_gallery: Gallery, interval: float = COMPACT_INTERVAL) -> threading.Thread:
+    """
+        Compacts the embedding log on a daemon thread once it holds many superseded or deleted records
+
+        Args:
+            user_gallery (Gallery): A gallery following the log, its record counts tell how stale the log is
+            interval (float): Seconds between two checks
+
+        Returns:
+            thread (threading.Thread): The running thread
+    """
+    def compact_periodically() -> None:
+        while True:
+            time.sleep(interval)
+            # Every record beyond the newest one of each user is superseded
+            stale: int = user_gallery.log_records - user_gallery.log_users
+            if stale > max(100, LOG_STALE_RATIO * user_gallery.log_users):
+                dropped = embedding_store.compact_log(key_manager.get_cipher())
+                print(f"Compacted the embedding log, dropped {dropped} records")
+
+    thread = threading.Thread(target=compact_periodically, daemon=True)
+    thread.start()
+    return thread
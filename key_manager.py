@@ -0,0 +1,302 @@
+# description: Encryption key handling. The keys are loaded once per process and wrapped in a MultiFernet, so data encrypted with
+#              any known key can still be read while new data always uses the newest key. Rotating the key adds a new one, and a
+#              resumable, rate-limited background job re-encrypts the stored images and encodings while logins keep working.
+#              Old keys are only retired after every file was checked to decrypt with the primary key alone.
+#
+#              usage: python key_manager.py rotate [--workers 4] [--rate 50] [--retire]
+#                     python key_manager.py resume [--workers 4] [--rate 50] [--retire]
+#                     python key_manager.py retire
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line
+import os                                 # file directory and handling, for interacting with the OS
+import threading                          # for the cached cipher and the background job
+import time                               # for rate limiting
+from concurrent.futures import ThreadPoolExecutor   # for re-encrypting several files at once
+from contextlib import nullcontext        # for files that need no lock
+from hashlib import sha256                # for fingerprinting the primary key
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet     # for symmetric encryption and decryption
+from secure_images import atomic_write, file_lock     # for replacing files atomically and locking the embedding log and files
+
+
+# Define the path to the key file, one key per line with the newest (primary) key first
+key_path: Path = Path("secret.key")
+
+# Define the path to the progress file of an unfinished re-encryption
+progress_path: Path = Path("rotation.progress")
+
+# Folders whose files are re-encrypted when the key rotates
+ENCRYPTED_FOLDERS: list[Path] = [Path("certified"), Path("embeddings")]
+
+# Seconds between checks whether another process rotated the key
+KEY_RECHECK_SECONDS: float = 5.0
+
+# Cipher of this process, created on first use, with the key file modification time it was built from
+_cipher: MultiFernet | None = None
+_cipher_mtime: int = 0
+_cipher_checked: float = 0.0
+_lock = threading.Lock()
+
+
+#=========================================================================================================================================
+# function to generate or load the Fernet encryption keys
+def load_or_create_keys() -> list[bytes]:
+    """
+        Loads the encryption keys, generating a first key if there is none
+
+        Returns:
+            keys (list[bytes]): Every known key, the primary key first
+    """
+    if not key_path.exists():                       # if the key file does not exist
+        key = Fernet.generate_key()                 # generate new encryption key
+        with open(key_path, "wb") as key_file:      # write a new key to a file
+            key_file.write(key)
+        return [key]
+    with open(key_path, "rb") as key_file:          # a key file with a single key is the layout from before rotation existed
+        return [line.strip() for line in key_file.read().splitlines() if line.strip()]
+
+#=========================================================================================================================================
+# function that writes the keys back to the key file
+def _save_keys(keys: list[bytes]) -> None:
+    global _cipher
+    atomic_write(key_path, b"\n".join(keys))
+    with _lock:
+        _cipher = None                              # the next get_cipher() picks up the new keys
+
+#=========================================================================================================================================
+# function that returns the cached cipher of this process
+def get_cipher() -> MultiFernet:
+    """
+        Returns the cipher for every known key, loading the key file only once per process
+
+        Returns:
+            cipher (MultiFernet): Encrypts with the primary key and decrypts with any known key
+    """
+    global _cipher, _cipher_mtime, _cipher_checked
+    with _lock:
+        now = time.monotonic()
+        # Every few seconds check whether the key file changed, so a rotation done by another process is picked up
+        if _cipher is not None and now - _cipher_checked >= KEY_RECHECK_SECONDS:
+            _cipher_checked = now
+            if key_path.exists() and os.stat(key_path).st_mtime_ns != _cipher_mtime:
+                _cipher = None
+        if _cipher is None:
+            _cipher = MultiFernet([Fernet(key) for key in load_or_create_keys()])
+            _cipher_mtime = os.stat(key_path).st_mtime_ns
+            _cipher_checked = now
+        return _cipher
+
+#=========================================================================================================================================
+# function that makes a new primary key
+def rotate_key() -> None:
+    """
+        Adds a new primary key. New data is encrypted with it at once, old data stays readable until it is re-encrypted
+    """
+    keys = load_or_create_keys()
+    _save_keys([Fernet.generate_key()] + keys)
+    # A new primary key makes any earlier progress meaningless
+    if progress_path.exists():
+        os.remove(progress_path)
+    print(f"New primary key added, {len(keys)} older key(s) kept for decryption")
+
+#=========================================================================================================================================
+# function that drops every key but the primary one
+def retire_old_keys() -> None:
+    """
+        Removes every key but the primary one. Other processes may keep encrypting with the old primary key for up to
+        KEY_RECHECK_SECONDS after a rotation, so this first waits that out, then checks that every file decrypts with the
+        primary key alone, re-encrypts the ones that do not and only then drops the old keys.
+
+        Raise:
+            ValueError: If a re-encryption is still unfinished, or a file still needs an old key
+    """
+    if progress_path.exists():
+        raise ValueError("A re-encryption is still unfinished, run 'python key_manager.py resume' first")
+    keys = load_or_create_keys()
+    if len(keys) == 1:
+        print("No old keys to retire")
+        return
+
+    # Every process re-reads the key file within KEY_RECHECK_SECONDS, wait until all of them use the primary key
+    wait = 2 * KEY_RECHECK_SECONDS - (time.time() - os.stat(key_path).st_mtime)
+    if wait > 0:
+        print(f"Waiting {wait:.1f} seconds for every process to pick up the primary key")
+        time.sleep(wait)
+
+    primary = Fernet(keys[0])
+    cipher = MultiFernet([Fernet(key) for key in keys])
+    stale = [path for path in _encrypted_files() if not _readable_with(path, primary)]
+    for path in stale:
+        _reencrypt_file(path, cipher)
+    still_stale = [path for path in stale if not _readable_with(path, primary)]
+    if still_stale:
+        raise ValueError(f"{len(still_stale)} file(s) still cannot be read with the primary key alone, for example {still_stale[0]}. "
+                         "Run retire again, records no known key can read have to be removed by hand")
+    _save_keys(keys[:1])
+    print(f"Retired {len(keys) - 1} old key(s), {len(stale)} file(s) written with an old key were re-encrypted first")
+
+#=========================================================================================================================================
+# function that lists every encrypted file
+def _encrypted_files() -> list[Path]:
+    # Temporary files and lock files hold no tokens
+    files: list[Path] = []
+    for folder in ENCRYPTED_FOLDERS:
+        if folder.is_dir():
+            files.extend(path for path in sorted(folder.rglob("*")) if path.is_file() and path.suffix not in (".tmp", ".lock"))
+    return files
+
+#=========================================================================================================================================
+# function that checks whether a file decrypts with the primary key alone
+def _readable_with(path: Path, primary: Fernet) -> bool:
+    try:
+        with open(path, "rb") as encrypted_file:
+            token = encrypted_file.read()
+    except FileNotFoundError:
+        return True                                 # deleted meanwhile, nothing left to read
+    try:
+        if path.suffix == ".log":
+            for line in _complete_lines(token):
+                primary.decrypt(line)
+        else:
+            primary.decrypt(token)
+    except InvalidToken:
+        return False
+    return True
+
+def _complete_lines(data: bytes) -> list[bytes]:
+    # A last line without a newline is a record whose write never finished, it is skipped
+    return [line for line in data[:data.rfind(b"\n") + 1].splitlines() if line]
+
+#=========================================================================================================================================
+# function that re-encrypts one file with the primary key
+def _reencrypt_file(path: Path, cipher: MultiFernet) -> bool:
+    if path.suffix == ".log":
+        # Appends to the log take the same lock, so none of them can land between the read and the replace
+        with file_lock(path.with_name(path.name + ".lock")):
+            try:
+                with open(path, "rb") as log_file:
+                    data = log_file.read()
+            except FileNotFoundError:
+                return False
+            rotated: list[bytes] = []
+            unreadable: int = 0
+            for line in _complete_lines(data):
+                try:
+                    rotated.append(cipher.rotate(line) + b"\n")
+                except InvalidToken:
+                    # No known key reads it, keep it as it is rather than lose it, readers skip it already
+                    rotated.append(line + b"\n")
+                    unreadable += 1
+            if unreadable:
+                print(f"Kept {unreadable} record(s) of {path} that no known key can read")
+            atomic_write(path, b"".join(rotated))
+        return True
+
+    # Embedding files are rewritten by template updates, which hold the same lock from reading to saving
+    lock_path = path.with_name(path.name + ".lock") if path.suffix == ".emb" else None
+    with file_lock(lock_path) if lock_path is not None else nullcontext():
+        try:
+            with open(path, "rb") as encrypted_file:
+                token = encrypted_file.read()
+        except FileNotFoundError:
+            return False                                # deleted meanwhile, nothing left to re-encrypt
+        atomic_write(path, cipher.rotate(token))
+    return True
+
+#=========================================================================================================================================
+# function that re-encrypts every stored file with the primary key
+def reencrypt_all(workers: int = 4, max_files_per_second: float = 50.0, retire: bool = False) -> int:
+    """
+        Re-encrypts every image and encoding file with the primary key.
+        Finished files are recorded in a progress file so an interrupted run picks up where it stopped.
+
+        Args:
+            workers (int): Number of files re-encrypted at the same time
+            max_files_per_second (float): Upper limit on the re-encryption rate, so logins are not slowed down
+            retire (bool): Also run retire_old_keys() once every file was re-encrypted
+
+        Returns:
+            rewritten (int): Number of files re-encrypted by this run
+    """
+    cipher = get_cipher()
+    primary_fingerprint: str = sha256(load_or_create_keys()[0]).hexdigest()
+
+    # Files finished by an earlier run with the same primary key
+    done: set[str] = set()
+    if progress_path.exists():
+        with open(progress_path, "r") as progress_file:
+            lines = progress_file.read().splitlines()
+        if lines and lines[0] == primary_fingerprint:
+            done = set(lines[1:])
+    if not done:
+        with open(progress_path, "w") as progress_file:
+            progress_file.write(primary_fingerprint + "\n")
+
+    todo: list[Path] = [path for path in _encrypted_files() if str(path) not in done]
+    print(f"Re-encrypting {len(todo)} files ({len(done)} already done)")
+
+    rewritten: int = 0
+    interval: float = 1.0 / max_files_per_second if max_files_per_second > 0 else 0.0
+    with open(progress_path, "a") as progress_file, ThreadPoolExecutor(max_workers=workers) as pool:
+        next_start = time.monotonic()
+        futures = []
+        for path in todo:
+            # Rate limit by spacing out the submissions
+            wait = next_start - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            next_start = max(next_start, time.monotonic()) + interval
+            futures.append((path, pool.submit(_reencrypt_file, path, cipher)))
+
+            # Record finished files as they complete
+            while futures and futures[0][1].done():
+                finished_path, future = futures.pop(0)
+                rewritten += future.result()
+                progress_file.write(str(finished_path) + "\n")
+                progress_file.flush()
+        for finished_path, future in futures:
+            rewritten += future.result()
+            progress_file.write(str(finished_path) + "\n")
+
+    # Every file uses the primary key now
+    os.remove(progress_path)
+    print(f"Re-encrypted {rewritten} files")
+    if retire:
+        retire_old_keys()
+    else:
+        print("Old keys are kept, run 'python key_manager.py retire' to check every file and drop them")
+    return rewritten
+
+#=========================================================================================================================================
+# function that runs the re-encryption on a background thread
+def start_background_reencryption(workers: int = 4, max_files_per_second: float = 50.0) -> threading.Thread:
+    """
+        Starts reencrypt_all on a daemon thread so the program keeps serving logins
+
+        Returns:
+            thread (threading.Thread): The running job
+    """
+    thread = threading.Thread(target=reencrypt_all, args=(workers, max_files_per_second), daemon=True)
+    thread.start()
+    return thread
+
+#=========================================================================================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate the encryption key and re-encrypt the stored data.")
+    parser.add_argument("command", choices=["rotate", "resume", "retire"], help="rotate: new key and re-encrypt, resume: finish an interrupted re-encryption, retire: drop old keys")
+    parser.add_argument("--workers", type=int, default=4, help="files re-encrypted at the same time")
+    parser.add_argument("--rate", type=float, default=50.0, help="maximum files re-encrypted per second (0 for no limit)")
+    parser.add_argument("--retire", action="store_true", help="check every file and drop the old keys once the re-encryption is done")
+    args = parser.parse_args()
+
+    if args.command == "rotate":
+        rotate_key()
+        reencrypt_all(args.workers, args.rate, args.retire)
+    elif args.command == "resume":
+        reencrypt_all(args.workers, args.rate, args.retire)
+    else:
+        retire_old_keys()
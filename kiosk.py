@@ -0,0 +1,272 @@
+# description: Long-running kiosk mode for a lobby camera. The camera stays open, faces are detected on a downscaled copy of every
+#              Nth frame, followed between detections with a cheap IoU tracker, and only encoded when a track is new or its
+#              identity is still uncertain. Every recognized person in the frame is checked in once per track.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import cv2                                # for capturing video and image processing using OpenCV
+import numpy as np                        # for numerical operations
+import time                               # for measuring the frame rate
+from typing import Callable               # for the check-in callback type
+from gallery import Gallery               # for identifying faces against every enrolled user
+from detectors import Detector, DlibDetector, ScaledDetector     # for the configurable face detector
+import metrics                            # for timing the kiosk stages
+import batch_encoder                      # for encoding every face of a frame in one batch
+from liveness import LivenessCheck        # for rejecting printed photos and phone screens
+
+
+# Run the detector on every Nth frame, tracks are carried over in between
+DETECT_EVERY: int = 5
+
+# Detection runs on a copy of the frame shrunk by this factor
+DETECT_SCALE: float = 0.25
+
+# Matches closer than this are trusted, matches between this and the tolerance are re-checked
+CONFIDENT_DISTANCE: float = 0.45
+
+# Uncertain tracks are re-encoded every this many detection passes
+RECHECK_EVERY: int = 3
+
+# Minimum overlap for a detection to continue an existing track
+IOU_THRESHOLD: float = 0.3
+
+# A track is dropped after this many detection passes without a matching face
+MAX_MISSED: int = 2
+
+
+#=========================================================================================================================================
+# class for a face followed across frames
+class Track:
+    """
+        A face followed across frames together with who it was identified as
+
+        Args:
+            track_id (int): Unique number of the track
+            box (tuple[int, int, int, int]): Face location as (top, right, bottom, left) in full resolution pixels
+    """
+
+    def __init__(self, track_id: int, box: tuple[int, int, int, int]) -> None:
+        self.track_id: int = track_id
+        self.box: tuple[int, int, int, int] = box
+        self.user_id: str | None = None         # who the face was identified as, None while unknown
+        self.distance: float = float("inf")     # distance of the best match so far
+        self.missed: int = 0                    # detection passes in a row without a matching face
+        self.passes_since_encode: int = 0       # detection passes since the face was last encoded
+        self.encoded: bool = False              # True once the face has been encoded at least once
+        self.checked_in: bool = False           # True once attendance was taken for this track
+        self.liveness: LivenessCheck | None = None      # liveness check of the matched face, None while not started
+
+    def needs_encoding(self) -> bool:
+        """
+            Decides whether the face should be encoded on this detection pass
+
+            Returns:
+                needed (bool): True for new tracks and for tracks whose identity is not confident yet
+        """
+        if not self.encoded:
+            return True
+        if self.distance <= CONFIDENT_DISTANCE:
+            return False
+        return self.passes_since_encode >= RECHECK_EVERY
+
+#=========================================================================================================================================
+# function that computes the overlap of two face boxes
+def iou(box_a: tuple[int, int, int, int], box_b: tuple[int, int, int, int]) -> float:
+    """
+        Computes the intersection over union of two (top, right, bottom, left) boxes
+
+        Returns:
+            overlap (float): 0.0 for disjoint boxes up to 1.0 for identical boxes
+    """
+    top, right = max(box_a[0], box_b[0]), min(box_a[1], box_b[1])
+    bottom, left = min(box_a[2], box_b[2]), max(box_a[3], box_b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+#=========================================================================================================================================
+# class for the IoU tracker
+class IoUTracker:
+    """
+        Greedily matches new detections to existing tracks by box overlap
+    """
+
+    def __init__(self) -> None:
+        self.tracks: list[Track] = []
+        self.next_id: int = 1
+
+    def update(self, boxes: list[tuple[int, int, int, int]]) -> list[Track]:
+        """
+            Updates the tracks with the boxes found by the detector
+
+            Args:
+                boxes (list[tuple[int, int, int, int]]): Face locations found on this detection pass
+
+            Returns:
+                tracks (list[Track]): The tracks that are still alive
+        """
+        # Every pair of track and detection that overlaps enough, best overlaps first
+        pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)), reverse=True)
+        used_tracks: set[int] = set()
+        used_boxes: set[int] = set()
+        for overlap, t, b in pairs:
+            if overlap < IOU_THRESHOLD:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].missed = 0
+            used_tracks.add(t)
+            used_boxes.add(b)
+
+        # Tracks without a detection age, and are dropped once they were missed too often
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= MAX_MISSED]
+
+        # Detections without a track start a new one
+        for b, box in enumerate(boxes):
+            if b not in used_boxes:
+                self.tracks.append(Track(self.next_id, box))
+                self.next_id += 1
+        return self.tracks
+
+#=========================================================================================================================================
+# function that detects faces on a downscaled copy of the frame
+def detect_faces(rgb_frame: np.ndarray, scale: float = DETECT_SCALE, detector: Detector | None = None) -> list[tuple[int, int, int, int]]:
+    """
+        Runs the face detector on a shrunk copy of the frame and maps the boxes back to full resolution
+
+        Args:
+            rgb_frame (np.ndarray): Frame in RGB order
+            scale (float): Factor the frame is shrunk by before detection, ignored for a detector that already shrinks it
+            detector (Detector | None): Face detector to use, None uses the HOG detector
+
+        Returns:
+            boxes (list[tuple[int, int, int, int]]): Face locations as (top, right, bottom, left) in full resolution pixels
+    """
+    # A detector from get_detector already shrinks the frame by its configured scale, shrinking it again would miss small faces
+    if isinstance(detector, ScaledDetector):
+        return detector(rgb_frame)
+    return ScaledDetector(detector or DlibDetector(), scale)(rgb_frame)
+
+#=========================================================================================================================================
+# function that runs the kiosk loop
+def run_kiosk(user_gallery: Gallery, on_recognized: Callable[[str], None], names: dict[str, str] | None = None, camera: int = 0,
+              detect_every: int = DETECT_EVERY, scale: float = DETECT_SCALE, tolerance: float = 0.6, show: bool = True,
+              detector: Detector | None = None, liveness_budget_ms: float | None = None) -> None:
+    """
+        Keeps the camera open and checks in every recognized person until Q is pressed or the camera stops
+
+        Args:
+            user_gallery (Gallery): Gallery of every enrolled user
+            on_recognized (Callable[[str], None]): Called with the user ID the first time a track is recognized
+            names (dict[str, str] | None): Display name per user ID for the on-screen boxes
+            camera (int): Index of the camera to open
+            detect_every (int): Run the detector on every Nth frame
+            scale (float): Factor frames are shrunk by before detection
+            tolerance (float): Largest distance that still counts as a match
+            show (bool): Show the camera feed with the tracked faces
+            detector (Detector | None): Face detector to use, None uses the HOG detector
+            liveness_budget_ms (float | None): Milliseconds a matched face has to blink or move before it is rejected, None checks in without a liveness check
+    """
+    names = names or {}
+    video = cv2.VideoCapture(camera)       # the camera stays open for the whole session
+    if not video.isOpened():
+        print("Error: Could not open the camera")
+        return
+
+    tracker = IoUTracker()
+    frame_count: int = 0
+    encode_count: int = 0
+    liveness_checks: list[float] = []      # milliseconds every decided liveness check added
+    start_time = time.perf_counter()
+    print("Kiosk running. Press Q to quit.")
+
+    try:
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                print("Failed to capture frame from camera.")
+                break
+            frame_count += 1
+            rgb_frame: np.ndarray | None = None
+
+            # Only every Nth frame goes through the detector, the tracks keep their last box in between
+            if (frame_count - 1) % detect_every == 0:
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                # Pick up users enrolled or removed since the kiosk started
+                user_gallery.refresh()
+                with metrics.span("kiosk.detect"):
+                    tracks = tracker.update(detect_faces(rgb_frame, scale, detector))
+
+                # Encode only new tracks and tracks whose identity is still uncertain, all in one call
+                to_encode = [track for track in tracks if track.needs_encoding()]
+                for track in tracks:
+                    track.passes_since_encode += 1
+                if to_encode:
+                    with metrics.span("kiosk.encode"):
+                        encodings = batch_encoder.encode_faces([rgb_frame], [[track.box for track in to_encode]])[0]
+                    encode_count += len(encodings)
+                    for track, encoding in zip(to_encode, encodings):
+                        track.encoded = True
+                        track.passes_since_encode = 0
+                        with metrics.span("kiosk.match"):
+                            matched_id, distance = user_gallery.identify(encoding, tolerance)
+                        # Keep the best identity seen so far for the track
+                        if matched_id is not None and (track.user_id is None or distance < track.distance):
+                            track.user_id, track.distance = matched_id, distance
+
+            # Check in every recognized person once per track, after the liveness check if it is turned on.
+            # The check runs on every frame, not only on detection passes, so a short blink is not missed.
+            for track in tracker.tracks:
+                if track.user_id is None or track.checked_in:
+                    continue
+                if liveness_budget_ms is not None:
+                    if track.liveness is None:
+                        track.liveness = LivenessCheck(liveness_budget_ms)
+                    if rgb_frame is None:
+                        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    live = track.liveness.update(rgb_frame, track.box)
+                    if live is None:
+                        continue
+                    liveness_checks.append(track.liveness.elapsed_ms)
+                    if not live:
+                        # A face that failed is not checked in for the rest of its track
+                        track.checked_in = True
+                        metrics.increment("rejects")
+                        continue
+                track.checked_in = True
+                metrics.increment("matches")
+                on_recognized(track.user_id)
+
+            if show:
+                # Draw every tracked face with the name of who it was identified as
+                for track in tracker.tracks:
+                    top, right, bottom, left = track.box
+                    color = (0, 255, 0) if track.user_id is not None else (0, 0, 255)
+                    label = names.get(track.user_id, track.user_id) if track.user_id is not None else "Unknown"
+                    if track.liveness is not None and track.liveness.live is not True:
+                        # Still waiting for a blink or a head movement, or rejected as a photo
+                        color = (0, 165, 255) if track.liveness.live is None else (0, 0, 255)
+                        label = f"{label}: blink please" if track.liveness.live is None else "Not live"
+                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+                    cv2.putText(frame, label, (left, max(0, top - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                cv2.imshow("Kiosk", frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+    finally:
+        # Also reached on Ctrl+C or an error, so the camera is never left open
+        video.release()             # release the webcam
+        if show:
+            cv2.destroyAllWindows()     # close the image window
+
+    elapsed = time.perf_counter() - start_time
+    if elapsed > 0:
+        print(f"Kiosk stopped after {frame_count} frames ({frame_count / elapsed:.1f} FPS, {encode_count} encodings)")
+    if liveness_checks:
+        print(f"Liveness checks: {len(liveness_checks)}, added {np.mean(liveness_checks):.0f} ms on average, {max(liveness_checks):.0f} ms at most")
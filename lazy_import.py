@@ -0,0 +1,65 @@
+# description: Lazy module imports. The face models, OpenCV and the encryption library take seconds to import, mostly loading
+#              the dlib models. A lazy module stands in for the real one and only imports it when one of its attributes is first
+#              used, so the menu comes up at once and the vision stack is loaded when a scan actually starts.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import importlib                          # for importing the real module on first use
+import sys                                # for modules that are already imported
+import types                              # for the module type
+
+
+#=========================================================================================================================================
+# class for a module that is imported on first use
+class LazyModule:
+    """
+        Stands in for a module until one of its attributes is used, then imports it and forwards every
+        attribute to it. Setting an attribute sets it on the real module, so patching it still works.
+
+        Args:
+            name (str): Full name of the module, as for import
+    """
+
+    def __init__(self, name: str) -> None:
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def load(self) -> types.ModuleType:
+        """
+            Imports the real module, only the first time
+
+            Returns:
+                module (types.ModuleType): The real module
+        """
+        if self._module is None:
+            object.__setattr__(self, "_module", importlib.import_module(self._name))
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute: str) -> object:
+        return getattr(self.load(), attribute)
+
+    def __setattr__(self, attribute: str, value: object) -> None:
+        setattr(self.load(), attribute, value)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}{' (loaded)' if self.loaded else ''}>"
+
+#=========================================================================================================================================
+# function that returns a module that is imported on first use
+def lazy_import(name: str) -> types.ModuleType | LazyModule:
+    """
+        Returns the module if it is already imported, otherwise a lazy module that imports it on first use
+
+        Args:
+            name (str): Full name of the module, as for import
+
+        Returns:
+            module (types.ModuleType | LazyModule): The module, or a stand-in for it
+    """
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
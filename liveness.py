@@ -0,0 +1,219 @@
+# description: Liveness check against printed photos and phone screens. It only runs on faces that already matched and reuses the
+#              frames the camera delivers anyway. A live face has to keep the fine skin texture a print or a screen loses, and
+#              either blink or move its head while still keeping that texture, all within a hard time budget so check-in stays
+#              quick. Moving a printed photo alone is not enough.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import cv2                                # for reading further frames and the grayscale face
+import numpy as np                        # for numerical operations
+import time                               # for the time budget
+import face_recognition                   # for the eye and nose landmarks
+import metrics                            # for timing the liveness stage
+
+
+# Milliseconds the check may add to a check-in, a face that is not confirmed live by then is rejected
+BUDGET_MS: float = 1000.0
+
+# Eye aspect ratio below this counts as closed eyes
+EAR_CLOSED: float = 0.20
+
+# Eye aspect ratio above this counts as open eyes, the gap to EAR_CLOSED keeps noise from counting as a blink
+EAR_OPEN: float = 0.25
+
+# Smallest movement of the nose tip, as a share of the face width, that counts as a head movement
+MIN_MOTION: float = 0.06
+
+# Side in pixels of the square the face is shrunk to for the texture check
+TEXTURE_SIZE: int = 64
+
+# Share of the spectrum radius above which the frequencies count as fine texture
+TEXTURE_CUTOFF: float = 0.35
+
+# Lowest share of the face energy in the fine texture, a reprinted or re-filmed face is blurred twice and scores lower
+MIN_TEXTURE: float = 0.02
+
+
+#=========================================================================================================================================
+# function that checks the thresholds of the liveness check
+def check_thresholds() -> None:
+    """
+        Checks that the thresholds make sense, so a mistyped override cannot quietly let every face through
+
+        Raise:
+            ValueError: If a threshold is out of its range
+    """
+    if not 0.0 < MIN_TEXTURE < 1.0:
+        raise ValueError(f"MIN_TEXTURE must be between 0 and 1 (a share of the spectrum energy), got {MIN_TEXTURE}")
+    if not 0.0 < TEXTURE_CUTOFF < 1.0:
+        raise ValueError(f"TEXTURE_CUTOFF must be between 0 and 1 (a share of the spectrum radius), got {TEXTURE_CUTOFF}")
+    if not 0.0 < EAR_CLOSED < EAR_OPEN:
+        raise ValueError(f"EAR_CLOSED must be above 0 and below EAR_OPEN, got {EAR_CLOSED} and {EAR_OPEN}")
+    if MIN_MOTION <= 0.0:
+        raise ValueError(f"MIN_MOTION must be above 0, got {MIN_MOTION}")
+
+
+#=========================================================================================================================================
+# function that measures how open an eye is
+def eye_aspect_ratio(eye: list[tuple[int, int]]) -> float:
+    """
+        Computes the eye aspect ratio of the six eye landmarks, the eye height over its width. It drops
+        close to zero while the eye is closed and barely depends on the size of the face.
+
+        Args:
+            eye (list[tuple[int, int]]): The six landmarks of one eye, starting at the outer corner
+
+        Returns:
+            ratio (float): Eye aspect ratio, around 0.3 for an open eye
+    """
+    points = np.asarray(eye, dtype=np.float32)
+    height = np.linalg.norm(points[1] - points[5]) + np.linalg.norm(points[2] - points[4])
+    width = np.linalg.norm(points[0] - points[3])
+    return float(height / (2.0 * width)) if width > 0 else 0.0
+
+#=========================================================================================================================================
+# function that measures how much fine texture a face keeps
+def texture_score(rgb_frame: np.ndarray, box: tuple[int, int, int, int]) -> float:
+    """
+        Measures the share of the face energy in the high spatial frequencies. Printing a face or showing it
+        on a screen and filming it again blurs it a second time, so little fine texture is left.
+
+        Args:
+            rgb_frame (np.ndarray): Frame in RGB order
+            box (tuple[int, int, int, int]): Face location as (top, right, bottom, left)
+
+        Returns:
+            score (float): Share of the spectrum energy above TEXTURE_CUTOFF
+    """
+    top, right, bottom, left = box
+    face = rgb_frame[max(0, top):bottom, max(0, left):right]
+    if face.size == 0:
+        return 0.0
+    gray = cv2.resize(cv2.cvtColor(face, cv2.COLOR_RGB2GRAY), (TEXTURE_SIZE, TEXTURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2(gray - gray.mean()))) ** 2
+
+    # Distance of every frequency from the center of the spectrum, 1.0 at the edge
+    rows, cols = np.indices(spectrum.shape)
+    radius = np.hypot(rows - TEXTURE_SIZE / 2, cols - TEXTURE_SIZE / 2) / (TEXTURE_SIZE / 2)
+    total = float(spectrum.sum())
+    return float(spectrum[radius > TEXTURE_CUTOFF].sum()) / total if total > 0 else 0.0
+
+#=========================================================================================================================================
+# class for the liveness check of one matched face
+class LivenessCheck:
+    """
+        Follows one matched face over the next frames until it blinks, or moves its head and still keeps its texture,
+        or the time budget runs out. The texture is checked on the first frame and again on the frame the head moved
+        on, the landmarks on every frame. A printed photo that is moved around only passes if it keeps the texture.
+
+        Args:
+            budget_ms (float): Milliseconds before a face that was not confirmed live is rejected
+
+        Raise:
+            ValueError: If one of the thresholds is out of its range
+    """
+
+    def __init__(self, budget_ms: float = BUDGET_MS) -> None:
+        # The thresholds are module settings that may have been overridden since the import
+        check_thresholds()
+        self.budget_ms: float = budget_ms
+        self.started: float | None = None               # perf_counter of the first frame
+        self.eyes_open: bool = False                    # True once the eyes were seen open
+        self.eyes_closed: bool = False                  # True once open eyes were seen closed
+        self.first_nose: np.ndarray | None = None       # nose tip on the first frame
+        self.blinked: bool = False
+        self.moved: bool = False                        # True once the head moved and the face still had its texture
+        self.texture: float | None = None               # texture score of the first frame
+        self.live: bool | None = None                   # None until decided
+
+    @property
+    def elapsed_ms(self) -> float:
+        """
+            Returns:
+                elapsed (float): Milliseconds since the first frame, the latency the check added
+        """
+        return (time.perf_counter() - self.started) * 1000 if self.started is not None else 0.0
+
+    def update(self, rgb_frame: np.ndarray, box: tuple[int, int, int, int]) -> bool | None:
+        """
+            Looks at the face on one more frame
+
+            Args:
+                rgb_frame (np.ndarray): Frame in RGB order
+                box (tuple[int, int, int, int]): Face location as (top, right, bottom, left), the last known box is good enough
+
+            Returns:
+                live (bool | None): True once the face is confirmed live, False once rejected, None while undecided
+        """
+        if self.live is not None:
+            return self.live
+        if self.started is None:
+            self.started = time.perf_counter()
+
+        with metrics.span("liveness.frame"):
+            if self.texture is None:
+                self.texture = texture_score(rgb_frame, box)
+                if self.texture < MIN_TEXTURE:
+                    return self.decide(False)
+
+            landmarks = face_recognition.face_landmarks(rgb_frame, [box])
+            if landmarks:
+                points = landmarks[0]
+                ratio = (eye_aspect_ratio(points["left_eye"]) + eye_aspect_ratio(points["right_eye"])) / 2
+
+                # A blink is open eyes, then closed eyes, then open eyes again
+                if ratio > EAR_OPEN:
+                    self.blinked = self.blinked or self.eyes_closed
+                    self.eyes_open = True
+                elif ratio < EAR_CLOSED and self.eyes_open:
+                    self.eyes_closed = True
+
+                # A head movement is the nose tip moving compared to the face size. It only counts together with the
+                # texture on the same frame, moving a printed photo moves its nose too
+                nose = np.asarray(points["nose_tip"], dtype=np.float32).mean(axis=0)
+                if self.first_nose is None:
+                    self.first_nose = nose
+                elif np.linalg.norm(nose - self.first_nose) >= MIN_MOTION * max(1, box[1] - box[3]):
+                    self.moved = texture_score(rgb_frame, box) >= MIN_TEXTURE
+
+        if self.blinked or self.moved:
+            return self.decide(True)
+        if self.elapsed_ms >= self.budget_ms:
+            return self.decide(False)
+        return None
+
+    def decide(self, live: bool) -> bool:
+        self.live = live
+        metrics.increment("liveness_passes" if live else "liveness_failures")
+        return live
+
+#=========================================================================================================================================
+# function that checks a matched face on the frames that follow it
+def verify(video: cv2.VideoCapture, rgb_frame: np.ndarray, box: tuple[int, int, int, int], budget_ms: float = BUDGET_MS) -> tuple[bool, float]:
+    """
+        Checks the face of a single-shot check-in on the frame it matched on and the frames the still open camera
+        delivers next, until it is decided or the budget runs out. The face is not detected again, the box of the
+        first frame is used for all of them.
+
+        Args:
+            video (cv2.VideoCapture): The camera the frame was taken with, still open
+            rgb_frame (np.ndarray): The frame the face matched on, in RGB order
+            box (tuple[int, int, int, int]): Face location as (top, right, bottom, left)
+            budget_ms (float): Milliseconds before the face is rejected
+
+        Returns:
+            result (tuple[bool, float]): Whether the face is live and the milliseconds the check added
+    """
+    check = LivenessCheck(budget_ms)
+    live = check.update(rgb_frame, box)
+    while live is None:
+        ret, frame = video.read()
+        if not ret:
+            live = check.decide(False)
+            break
+        live = check.update(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), box)
+    return live, check.elapsed_ms
+
+# Catch a bad threshold when the module is loaded rather than on the first matched face
+check_thresholds()
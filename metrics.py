@@ -0,0 +1,189 @@
+# description: Lightweight timing spans and counters for the hot paths. Each span costs two perf_counter() calls and a few additions
+#              under a lock, so it can stay enabled in production. The numbers can be served as Prometheus text on a local port
+#              or written to a JSON file every few seconds.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import json                               # for the periodic JSON dump
+import threading                          # for the lock and the background threads
+import time                               # for timing spans
+from bisect import bisect_left            # for finding the histogram bucket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer     # for the metrics endpoint
+from pathlib import Path                  # for handling file paths in an OS-independent way
+
+
+# Set to False to turn every span and counter into a no-op
+ENABLED: bool = True
+
+# Upper bounds of the latency histogram buckets in milliseconds
+BUCKETS_MS: list[float] = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Prefix of every exported metric name
+PREFIX: str = "fras"
+
+# Latency histogram per span name: [count, total_ms, max_ms, per-bucket counts]
+_spans: dict[str, list] = {}
+# Value per counter name
+_counters: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+#=========================================================================================================================================
+# function that records one latency sample
+def observe(name: str, elapsed_ms: float) -> None:
+    """
+        Adds a latency sample to the histogram of a span
+
+        Args:
+            name (str): Name of the stage
+            elapsed_ms (float): How long the stage took in milliseconds
+    """
+    if not ENABLED:
+        return
+    bucket = bisect_left(BUCKETS_MS, elapsed_ms)
+    with _lock:
+        histogram = _spans.get(name)
+        if histogram is None:
+            histogram = _spans[name] = [0, 0.0, 0.0, [0] * (len(BUCKETS_MS) + 1)]
+        histogram[0] += 1
+        histogram[1] += elapsed_ms
+        if elapsed_ms > histogram[2]:
+            histogram[2] = elapsed_ms
+        histogram[3][bucket] += 1
+
+#=========================================================================================================================================
+# class for timing a block of code
+class span:
+    """
+        Times the code inside a with block and records it under a name
+
+        Example:
+            with metrics.span("detect"):
+                face_locations = detector(rgb_frame)
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.start: float = 0.0
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        observe(self.name, (time.perf_counter() - self.start) * 1000)
+
+#=========================================================================================================================================
+# function that increases a counter
+def increment(name: str, amount: int = 1) -> None:
+    """
+        Increases a counter such as matches, rejects or decrypt failures
+
+        Args:
+            name (str): Name of the counter
+            amount (int): How much to add
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+#=========================================================================================================================================
+# function that copies every metric
+def snapshot() -> dict[str, dict]:
+    """
+        Copies the current counters and span statistics
+
+        Returns:
+            metrics (dict[str, dict]): {"counters": {name: value}, "spans": {name: {count, mean_ms, max_ms}}}
+    """
+    with _lock:
+        spans = {name: {"count": count, "mean_ms": round(total / count, 3) if count else 0.0, "max_ms": round(maximum, 3)}
+                 for name, (count, total, maximum, _) in _spans.items()}
+        return {"counters": dict(_counters), "spans": spans}
+
+#=========================================================================================================================================
+# function that formats every metric in the Prometheus text format
+def render_prometheus() -> str:
+    """
+        Formats the counters and latency histograms in the Prometheus text exposition format
+
+        Returns:
+            text (str): The metrics page
+    """
+    lines: list[str] = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        lines.append(f"# TYPE {PREFIX}_stage_duration_ms histogram")
+        for name, (count, total, _, buckets) in sorted(_spans.items()):
+            cumulative: int = 0
+            for bound, bucket_count in zip(BUCKETS_MS + ["+Inf"], buckets):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}_stage_duration_ms_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_duration_ms_sum{{stage="{name}"}} {total:.3f}')
+            lines.append(f'{PREFIX}_stage_duration_ms_count{{stage="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+#=========================================================================================================================================
+# class for answering requests to the metrics endpoint
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Keep request logging out of the status output
+    def log_message(self, *args) -> None:
+        pass
+
+#=========================================================================================================================================
+# function that serves the metrics on a local port
+def start_http_server(port: int = 9100, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+        Serves the Prometheus text page on http://host:port/metrics from a background thread
+
+        Args:
+            port (int): Port to listen on
+            host (str): Address to listen on, only the local machine by default
+
+        Returns:
+            server (ThreadingHTTPServer): The running server
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
+
+#=========================================================================================================================================
+# function that writes the metrics to a JSON file every few seconds
+def start_json_dump(path: Path, interval: float = 10.0) -> threading.Thread:
+    """
+        Writes snapshot() to a JSON file every few seconds from a background thread
+
+        Args:
+            path (Path): File to write
+            interval (float): Seconds between two writes
+
+        Returns:
+            thread (threading.Thread): The running thread
+    """
+    def dump_periodically() -> None:
+        while True:
+            time.sleep(interval)
+            tmp_path = Path(f"{path}.tmp")
+            tmp_path.write_text(json.dumps(snapshot(), indent=4))
+            tmp_path.replace(path)
+
+    thread = threading.Thread(target=dump_periodically, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,407 @@
+# description: Staged recognition pipeline for the kiosk. A capture thread feeds frames into a bounded drop-oldest queue, a pool of
+#              workers detects and encodes faces across cores, a matcher identifies the encodings against the gallery and an
+#              attendance writer checks people in. Faces are followed across frames, and a face whose track was recognized with
+#              confidence a moment ago is neither encoded nor matched again. Every stage reports its queue depth and latency so
+#              the worker pool can be sized to the machine.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import cv2                                # for capturing video and image processing using OpenCV
+import numpy as np                        # for numerical operations
+import os                                 # for the number of cores
+import threading                          # for running the stages side by side
+import time                               # for stage latencies
+from collections import deque             # for the bounded queues
+from concurrent.futures import ProcessPoolExecutor   # for encoding on several processes
+from typing import Callable               # for the check-in callback type
+from gallery import Gallery               # for identifying faces against every enrolled user
+from kiosk import detect_faces, IoUTracker, CONFIDENT_DISTANCE     # for detection on a downscaled frame and following faces
+from detectors import Detector            # for the configurable face detector
+from ttl_cache import TTLCache            # for the per-track recognition cache
+import batch_encoder                      # for encoding every face of a frame in one batch
+import metrics                            # for counting recognition cache hits
+
+
+# Frames waiting for a detection worker, older frames are dropped when it is full
+FRAME_QUEUE_SIZE: int = 4
+
+# Results waiting for the matcher and the attendance writer, producers wait when these are full
+RESULT_QUEUE_SIZE: int = 64
+
+# Seconds between two stats lines
+STATS_EVERY: float = 5.0
+
+# Seconds the confident identity of a track is reused before its face is encoded and matched again
+RECOGNITION_TTL: float = 10.0
+
+# Most tracks remembered by the recognition cache
+RECOGNITION_ENTRIES: int = 1000
+
+# Detector of each worker process, set once by the pool initializer
+_worker_detector: Detector | None = None
+
+
+#=========================================================================================================================================
+# class for a bounded queue between two stages
+class StageQueue:
+    """
+        Bounded, thread-safe queue that either drops its oldest item or blocks the producer when full
+
+        Args:
+            maxsize (int): Largest number of items waiting in the queue
+            drop_oldest (bool): Drop the oldest item instead of waiting when the queue is full
+    """
+
+    def __init__(self, maxsize: int, drop_oldest: bool) -> None:
+        self.items: deque = deque()
+        self.maxsize: int = maxsize
+        self.drop_oldest: bool = drop_oldest
+        self.dropped: int = 0
+        self.closed: bool = False
+        self.condition = threading.Condition()
+
+    def put(self, item: object) -> None:
+        with self.condition:
+            if self.drop_oldest:
+                # Never make the producer wait, throw away the stalest item instead
+                if len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+            else:
+                # Backpressure, the producer waits for room
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.condition.wait()
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self) -> object | None:
+        """
+            Waits for the next item
+
+            Returns:
+                item (object | None): The next item, or None once the queue is closed and empty
+        """
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+#=========================================================================================================================================
+# class for the latency counters of one stage
+class StageStats:
+    """
+        Counts the items a stage processed and how long they took
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total_ms: float = 0.0
+        self.max_ms: float = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, elapsed_ms: float) -> None:
+        with self.lock:
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict[str, float]:
+        with self.lock:
+            mean_ms = self.total_ms / self.count if self.count else 0.0
+            return {"processed": self.count, "mean_ms": round(mean_ms, 2), "max_ms": round(self.max_ms, 2)}
+
+#=========================================================================================================================================
+# functions that detect and encode the faces in a frame, they run inside the worker pool
+def detect(frame: np.ndarray, scale: float, detector: Detector | None = None) -> list[tuple[int, int, int, int]]:
+    """
+        Finds every face in a BGR frame
+
+        Args:
+            frame (np.ndarray): Frame in OpenCV BGR order
+            scale (float): Factor the frame is shrunk by before detection
+            detector (Detector | None): Face detector to use, None uses the HOG detector
+
+        Returns:
+            boxes (list[tuple[int, int, int, int]]): Face locations as (top, right, bottom, left) in full resolution pixels
+    """
+    return detect_faces(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), scale, detector)
+
+def encode(frame: np.ndarray, boxes: list[tuple[int, int, int, int]]) -> list[np.ndarray]:
+    """
+        Encodes the given faces of a BGR frame in one batch
+
+        Returns:
+            encodings (list[np.ndarray]): One 128-d encoding per box
+    """
+    if not boxes:
+        return []
+    return batch_encoder.encode_faces([cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)], [boxes])[0]
+
+def detect_and_encode(frame: np.ndarray, scale: float, detector: Detector | None = None) -> list[np.ndarray]:
+    return encode(frame, detect(frame, scale, detector))
+
+#=========================================================================================================================================
+# functions that give every worker process its own copy of the detector, so it is not sent along with every frame
+def _init_worker(detector: Detector | None) -> None:
+    global _worker_detector
+    _worker_detector = detector
+
+def _detect_in_worker(frame: np.ndarray, scale: float) -> list[tuple[int, int, int, int]]:
+    return detect(frame, scale, _worker_detector)
+
+#=========================================================================================================================================
+# class for the staged pipeline
+class Pipeline:
+    """
+        Capture -> detection/encoding workers -> matcher -> attendance writer, each stage on its own thread(s)
+
+        Args:
+            user_gallery (Gallery): Gallery of every enrolled user
+            on_recognized (Callable[[str], None]): Called with every recognized user ID, once per track
+            workers (int): Number of detection/encoding workers, defaults to the number of cores
+            use_processes (bool): Run detection/encoding in a process pool instead of on the worker threads
+            camera (int): Index of the camera to open
+            scale (float): Factor frames are shrunk by before detection
+            tolerance (float): Largest distance that still counts as a match
+            detector (Detector | None): Face detector to use, None uses the HOG detector
+    """
+
+    def __init__(self, user_gallery: Gallery, on_recognized: Callable[[str], None], workers: int | None = None,
+                 use_processes: bool = False, camera: int = 0, scale: float = 0.25, tolerance: float = 0.6,
+                 detector: Detector | None = None) -> None:
+        self.user_gallery: Gallery = user_gallery
+        self.on_recognized: Callable[[str], None] = on_recognized
+        self.workers: int = workers or os.cpu_count() or 1
+        self.use_processes: bool = use_processes
+        self.camera: int = camera
+        self.scale: float = scale
+        self.tolerance: float = tolerance
+        self.detector: Detector | None = detector
+
+        # Queues between the stages, only the camera side drops frames
+        self.frames = StageQueue(FRAME_QUEUE_SIZE, drop_oldest=True)
+        self.encodings = StageQueue(RESULT_QUEUE_SIZE, drop_oldest=False)
+        self.matches = StageQueue(RESULT_QUEUE_SIZE, drop_oldest=False)
+        self.stats: dict[str, StageStats] = {name: StageStats() for name in ("capture", "encode", "match", "attendance", "end_to_end")}
+
+        self.latest_frame: np.ndarray | None = None     # last captured frame, for the preview window
+        self.stop_event = threading.Event()
+        # Faces are followed across frames, confident identities are remembered per track for a few seconds.
+        # Workers finish frames out of order, so every frame gets a sequence number when it is taken off the queue
+        # and the tracker is updated strictly in that order
+        self.tracker = IoUTracker()
+        self.sequence_lock = threading.Lock()
+        self.next_sequence: int = 0                     # given to the next frame taken off the queue
+        self.tracker_turn = threading.Condition()
+        self.tracked_sequence: int = 0                  # frame whose boxes go into the tracker next
+        self.recognized = TTLCache(RECOGNITION_TTL, RECOGNITION_ENTRIES)
+        # (track, user) pairs already handed to on_recognized, repeats after they expire are dropped by the attendance cooldown
+        self.announced = TTLCache(RECOGNITION_TTL, RECOGNITION_ENTRIES)
+        self.cache_hits: int = 0
+        self.threads: list[threading.Thread] = []
+        self.pool: ProcessPoolExecutor | None = None
+
+    def capture_stage(self) -> None:
+        video = cv2.VideoCapture(self.camera)
+        if not video.isOpened():
+            print("Error: Could not open the camera")
+            self.stop_event.set()
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = video.read()
+            if not ret:
+                print("Failed to capture frame from camera.")
+                self.stop_event.set()
+                break
+            self.latest_frame = frame
+            self.frames.put((start, frame))
+            self.stats["capture"].record((time.perf_counter() - start) * 1000)
+        video.release()
+        self.frames.close()
+
+    def encode_stage(self) -> None:
+        while True:
+            # Taking the frame and its sequence number in one step keeps the numbers in capture order
+            with self.sequence_lock:
+                item = self.frames.get()
+                if item is None:
+                    break
+                sequence = self.next_sequence
+                self.next_sequence += 1
+            captured_at, frame = item
+            start = time.perf_counter()
+            boxes: list[tuple[int, int, int, int]] = []
+            try:
+                if self.pool is not None:
+                    boxes = self.pool.submit(_detect_in_worker, frame, self.scale).result()
+                else:
+                    boxes = detect(frame, self.scale, self.detector)
+            finally:
+                # Always take this frames turn, even if detection failed, or every later frame would wait forever
+                seen = self.track(sequence, boxes)
+
+            # Faces whose track was recognized with confidence a moment ago are neither encoded nor matched again
+            pending = [(track_id, box) for track_id, box in seen if self.recognized.get(track_id) is None]
+            if len(seen) > len(pending):
+                self.cache_hits += len(seen) - len(pending)
+                metrics.increment("recognition_cache_hits", len(seen) - len(pending))
+
+            encodings: list[np.ndarray] = []
+            if pending:
+                pending_boxes = [box for _, box in pending]
+                if self.pool is not None:
+                    encodings = self.pool.submit(encode, frame, pending_boxes).result()
+                else:
+                    encodings = encode(frame, pending_boxes)
+            self.stats["encode"].record((time.perf_counter() - start) * 1000)
+            for (track_id, _), encoding in zip(pending, encodings):
+                self.encodings.put((captured_at, track_id, encoding))
+
+    def track(self, sequence: int, boxes: list[tuple[int, int, int, int]]) -> list[tuple[int, tuple[int, int, int, int]]]:
+        """
+            Updates the tracker with the faces of a frame once every earlier frame has updated it
+
+            Args:
+                sequence (int): Sequence number of the frame
+                boxes (list[tuple[int, int, int, int]]): Faces found in the frame
+
+            Returns:
+                seen (list[tuple[int, tuple[int, int, int, int]]]): (track id, box) of every track seen in this frame
+        """
+        with self.tracker_turn:
+            self.tracker_turn.wait_for(lambda: self.tracked_sequence == sequence)
+            try:
+                return [(track.track_id, track.box) for track in self.tracker.update(boxes) if track.missed == 0]
+            finally:
+                self.tracked_sequence += 1
+                self.tracker_turn.notify_all()
+
+    def match_stage(self) -> None:
+        while True:
+            item = self.encodings.get()
+            if item is None:
+                break
+            captured_at, track_id, encoding = item
+            start = time.perf_counter()
+            # Pick up users enrolled or removed since the pipeline started
+            self.user_gallery.refresh()
+            matched_id, distance = self.user_gallery.identify(encoding, self.tolerance)
+            self.stats["match"].record((time.perf_counter() - start) * 1000)
+            self.stats["end_to_end"].record((time.perf_counter() - captured_at) * 1000)     # from camera read to identity
+            if matched_id is not None:
+                # Uncertain matches are checked again on the next frame, confident ones are reused for the track
+                if distance <= CONFIDENT_DISTANCE:
+                    self.recognized.put(track_id, matched_id)
+                self.matches.put((captured_at, track_id, matched_id))
+
+    def attendance_stage(self) -> None:
+        while True:
+            item = self.matches.get()
+            if item is None:
+                break
+            _, track_id, matched_id = item
+            # An uncertain track is matched again on every frame, only hand each identity of a track over once
+            if not self.announced.add_if_absent((track_id, matched_id), True):
+                continue
+            start = time.perf_counter()
+            self.on_recognized(matched_id)
+            self.stats["attendance"].record((time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """
+            Collects the counters of every stage
+
+            Returns:
+                stats (dict[str, dict[str, float]]): Processed items, mean and max latency and input queue depth per stage
+        """
+        stage_queues = {"capture": None, "encode": self.frames, "match": self.encodings, "attendance": self.matches, "end_to_end": None}
+        stats: dict[str, dict[str, float]] = {}
+        for name, stage_stats in self.stats.items():
+            stats[name] = stage_stats.snapshot()
+            queue = stage_queues[name]
+            if queue is not None:
+                stats[name]["queue_depth"] = len(queue)
+                stats[name]["dropped"] = queue.dropped
+        stats["encode"]["cached"] = self.cache_hits
+        return stats
+
+    def start(self) -> None:
+        if self.use_processes:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.detector,))
+        targets: list[Callable[[], None]] = [self.capture_stage] + [self.encode_stage] * self.workers + [self.match_stage, self.attendance_stage]
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        # Stop the camera first, then let every stage drain its queue in order
+        self.stop_event.set()
+        self.threads[0].join()
+        for thread in self.threads[1:1 + self.workers]:
+            thread.join()
+        self.encodings.close()
+        self.threads[-2].join()
+        self.matches.close()
+        self.threads[-1].join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+#=========================================================================================================================================
+# function that runs the pipeline until Q is pressed or the camera stops
+def run_pipeline(user_gallery: Gallery, on_recognized: Callable[[str], None], workers: int | None = None,
+                 use_processes: bool = False, show: bool = True, detector: Detector | None = None) -> dict[str, dict[str, float]]:
+    """
+        Runs the staged kiosk pipeline and prints the per-stage stats every few seconds
+
+        Args:
+            user_gallery (Gallery): Gallery of every enrolled user
+            on_recognized (Callable[[str], None]): Called with every recognized user ID, once per track
+            workers (int | None): Number of detection/encoding workers, defaults to the number of cores
+            use_processes (bool): Run detection/encoding in a process pool instead of on the worker threads
+            show (bool): Show the camera feed, otherwise run until interrupted with Ctrl+C
+            detector (Detector | None): Face detector to use, None uses the HOG detector
+
+        Returns:
+            stats (dict[str, dict[str, float]]): The final per-stage stats
+    """
+    pipeline = Pipeline(user_gallery, on_recognized, workers, use_processes, detector=detector)
+    pipeline.start()
+    print(f"Kiosk pipeline running with {pipeline.workers} workers. Press Q to quit.")
+
+    last_stats = time.perf_counter()
+    try:
+        # The preview window has to be driven from the main thread
+        while not pipeline.stop_event.is_set():
+            if show:
+                if pipeline.latest_frame is not None:
+                    cv2.imshow("Kiosk", pipeline.latest_frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.05)
+            if time.perf_counter() - last_stats >= STATS_EVERY:
+                print(pipeline.snapshot())
+                last_stats = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+
+    pipeline.stop()
+    if show:
+        cv2.destroyAllWindows()
+    stats = pipeline.snapshot()
+    print(stats)
+    return stats
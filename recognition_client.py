@@ -0,0 +1,172 @@
+# description: Client for the recognition service. Sends one photo and prints the answer, or acts as a load generator that keeps
+#              several door terminals posting photos at once and reports throughput and latency percentiles.
+#
+#              usage: python recognition_client.py photo.jpg [--url http://127.0.0.1:8080]
+#                     python recognition_client.py faces/ --concurrency 16 --requests 2000
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line
+import asyncio                            # for many simulated terminals at once
+import json                               # for the responses
+import time                               # for measuring latency
+from pathlib import Path                  # for handling file paths in an OS-independent way
+from urllib.parse import urlsplit         # for the server address
+import numpy as np                        # for the latency percentiles
+
+
+# File types sent as photos
+IMAGE_SUFFIXES: set[str] = {".jpg", ".jpeg"}
+
+
+#=========================================================================================================================================
+# class for one keep-alive connection to the server
+class Connection:
+    """
+        A keep-alive HTTP/1.1 connection, like one door terminal
+
+        Args:
+            host (str): Server address
+            port (int): Server port
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> tuple[int, bytes]:
+        """
+            Sends one request, reconnecting if the server closed the connection
+
+            Returns:
+                response (tuple[int, bytes]): Status code and body
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: image/jpeg\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {name.strip().lower(): value.strip() for name, value in (line.split(":", 1) for line in lines[1:] if ":" in line)}
+        response = await self.reader.readexactly(int(headers.get("content-length", "0")))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, response
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+#=========================================================================================================================================
+# function that loads the photos to send
+def load_photos(path: Path) -> list[bytes]:
+    paths = sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES) if path.is_dir() else [path]
+    return [p.read_bytes() for p in paths]
+
+#=========================================================================================================================================
+# function that simulates many terminals posting photos at once
+async def load_test(host: str, port: int, photos: list[bytes], concurrency: int, total: int) -> dict[str, float]:
+    """
+        Keeps a number of connections busy posting photos until the total number of requests is sent
+
+        Args:
+            host (str): Server address
+            port (int): Server port
+            photos (list[bytes]): JPEG files sent in turn
+            concurrency (int): Number of simulated terminals
+            total (int): Number of requests over all terminals
+
+        Returns:
+            results (dict[str, float]): Throughput, latency percentiles and throughput per server core
+    """
+    latencies: list[float] = []
+    errors: int = 0
+    next_request: int = 0
+
+    async def terminal() -> None:
+        nonlocal errors, next_request
+        connection = Connection(host, port)
+        try:
+            while next_request < total:
+                photo = photos[next_request % len(photos)]
+                next_request += 1
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request("POST", "/recognize", photo)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await connection.close()
+                    status = 0
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += status != 200
+        finally:
+            await connection.close()
+
+    health_connection = Connection(host, port)
+    _, health = await health_connection.request("GET", "/health")
+    await health_connection.close()
+    workers = json.loads(health).get("workers") or 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(terminal() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    values = np.asarray(latencies)
+    requests_per_second = len(values) / elapsed
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "concurrency": concurrency,
+        "server_workers": workers,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(requests_per_second, 1),
+        "requests_per_second_per_core": round(requests_per_second / workers, 1),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+#=========================================================================================================================================
+# function that sends a single photo
+async def recognize_once(host: str, port: int, photo: bytes) -> dict[str, object]:
+    connection = Connection(host, port)
+    try:
+        _, response = await connection.request("POST", "/recognize", photo)
+    finally:
+        await connection.close()
+    return json.loads(response)
+
+#=========================================================================================================================================
+
+def main() -> None:
+    """
+        Parses the command line and either sends one photo or runs the load test
+    """
+    parser = argparse.ArgumentParser(description="Send photos to the recognition service.")
+    parser.add_argument("photos", type=Path, help="a JPEG photo, or a folder of them for the load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="address of the recognition service")
+    parser.add_argument("--concurrency", type=int, default=0, help="simulated terminals, 0 sends a single photo")
+    parser.add_argument("--requests", type=int, default=1000, help="total requests of the load test")
+    args = parser.parse_args()
+
+    address = urlsplit(args.url)
+    host, port = address.hostname or "127.0.0.1", address.port or 80
+    photos = load_photos(args.photos)
+    if not photos:
+        print(f"No JPEG photos found in {args.photos}")
+        return
+
+    if args.concurrency > 0:
+        results = asyncio.run(load_test(host, port, photos, args.concurrency, args.requests))
+    else:
+        results = asyncio.run(recognize_once(host, port, photos[0]))
+    print(json.dumps(results, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# description: Asyncio HTTP recognition service for door terminals. Thin clients POST a JPEG frame to /recognize, concurrent requests
+#              are collected into small batches, their faces are decoded and encoded on a pool of worker processes and matched
+#              against the shared in-memory gallery with one matrix product per batch, and recognized users are checked in.
+#              Everything that blocks (encoding, gallery refreshes, registry lookups, attendance writes) runs off the event loop,
+#              and up to one batch per worker is in flight at a time.
+#
+#              usage: python recognition_server.py [--host 127.0.0.1] [--port 8080] [--workers 4]
+#              endpoints: POST /recognize (body: JPEG), GET /health, GET /metrics
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line
+import asyncio                            # for serving many terminals on one thread
+import json                               # for the responses
+import os                                 # for the number of cores
+import time                               # for request latency
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor   # for decoding and encoding on every core, and the blocking calls
+import cv2                                # for decoding the frames
+import numpy as np                        # for numerical operations
+import face_recognition                   # for the default face detector
+import attendance_store                   # for checking recognized users in
+import gallery                            # for identifying faces against every enrolled user
+import key_manager                        # for decrypting the embedding store
+import metrics                            # for timing the stages and the /metrics page
+import user_registry                      # for turning user IDs into names and emails
+import batch_encoder                      # for encoding the faces
+import templates                          # for refining templates from confident matches
+from detectors import Detector            # for the configurable face detector
+
+
+# Most requests matched together in one batch
+MAX_BATCH: int = 32
+
+# Milliseconds the first request of a batch waits for more requests to join it
+BATCH_WINDOW_MS: float = 5.0
+
+# Threads refining templates from confident matches in the background
+REFINE_THREADS: int = 2
+
+# Largest accepted request body in bytes
+MAX_BODY: int = 5 * 1024 * 1024
+
+# HTTP reason phrases of the status codes used
+REASONS: dict[int, str] = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+# Detector of each worker process, set once by the pool initializer
+_worker_detector: Detector | None = None
+
+
+#=========================================================================================================================================
+# functions that run inside the worker processes
+def _init_worker(detector: Detector | None) -> None:
+    global _worker_detector
+    _worker_detector = detector
+
+def encode_jpegs(frames: list[bytes]) -> list[np.ndarray | None]:
+    """
+        Decodes JPEG frames and encodes the largest face of each, all faces in one encoder batch
+
+        Args:
+            frames (list[bytes]): The JPEG files
+
+        Returns:
+            encodings (list[np.ndarray | None]): The 128-d encoding of each frame, None if it has no face or could not be decoded
+    """
+    rgb_frames: list[np.ndarray] = []
+    boxes_per_frame: list[list] = []
+    for data in frames:
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            rgb_frames.append(None)
+            boxes_per_frame.append([])
+            continue
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        boxes = _worker_detector(rgb_frame) if _worker_detector is not None else face_recognition.face_locations(rgb_frame)
+        # The person closest to the terminal has the largest face
+        largest = [max(boxes, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))] if boxes else []
+        rgb_frames.append(rgb_frame)
+        boxes_per_frame.append(largest)
+    encodings = batch_encoder.encode_faces(rgb_frames, boxes_per_frame)
+    return [faces[0] if faces else None for faces in encodings]
+
+#=========================================================================================================================================
+# class for the recognition service
+class RecognitionServer:
+    """
+        Serves /recognize, batching concurrent requests into one vectorized match
+
+        Args:
+            user_gallery (gallery.Gallery): Gallery of every enrolled user
+            workers (int | None): Number of decode/encode worker processes, defaults to the number of cores
+            detector (Detector | None): Face detector, None uses the HOG detector
+            check_in (bool): Take attendance for recognized users
+            tolerance (float): Largest distance that still counts as a match
+    """
+
+    def __init__(self, user_gallery: gallery.Gallery, workers: int | None = None, detector: Detector | None = None,
+                 check_in: bool = True, tolerance: float = gallery.DEFAULT_TOLERANCE) -> None:
+        self.user_gallery: gallery.Gallery = user_gallery
+        self.workers: int = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(detector,))
+        # The gallery is not thread safe, so refreshes, matches, lookups and check-ins share one thread off the event loop
+        self.matcher = ThreadPoolExecutor(max_workers=1)
+        self.refiner = ThreadPoolExecutor(max_workers=REFINE_THREADS)
+        self.refining: set[Future] = set()
+        self.check_in: bool = check_in
+        self.tolerance: float = tolerance
+        self.users: dict[str, dict[str, str]] = user_registry.all_users()
+        self.queue: asyncio.Queue | None = None
+
+    async def recognize(self, data: bytes) -> dict[str, object]:
+        """
+            Queues a frame for the next batch and waits for its result
+
+            Args:
+                data (bytes): The JPEG file
+
+            Returns:
+                result (dict[str, object]): The recognized user, or user_id None if nobody was recognized
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((data, future))
+        return await future
+
+    async def batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Up to one batch per worker is in flight, so a slow frame does not leave the other workers idle
+        slots = asyncio.Semaphore(self.workers)
+        running: set[asyncio.Task] = set()
+
+        def finished(task: asyncio.Task) -> None:
+            running.discard(task)
+            slots.release()
+
+        while True:
+            # Wait for a free slot and a first request, then give others a moment to join the batch
+            await slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW_MS / 1000
+            while len(batch) < MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self.process_batch(batch))
+            running.add(task)
+            task.add_done_callback(finished)
+
+    async def process_batch(self, batch: list[tuple[bytes, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            # Split the batch over the workers, each one decodes its frames and encodes their faces in one encoder batch
+            frames = [data for data, _ in batch]
+            size = -(-len(frames) // self.workers)
+            with metrics.span("server.encode"):
+                parts = await asyncio.gather(*(loop.run_in_executor(self.pool, encode_jpegs, frames[start:start + size])
+                                               for start in range(0, len(frames), size)))
+            encodings = [encoding for part in parts for encoding in part]
+
+            results = await loop.run_in_executor(self.matcher, self.resolve, encodings)
+            metrics.increment("server_batches")
+            metrics.increment("server_frames", len(batch))
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def resolve(self, encodings: list[np.ndarray | None]) -> list[dict[str, object]]:
+        """
+            Matches the encodings of a batch with one matrix product, looks the users up and checks them in.
+            Blocks on the gallery, the registry and the attendance store, so it runs on the matcher thread.
+
+            Args:
+                encodings (list[np.ndarray | None]): The encoding of each frame, None where no face was found
+
+            Returns:
+                results (list[dict[str, object]]): The response of each frame
+        """
+        found = [i for i, encoding in enumerate(encodings) if encoding is not None]
+        identities: dict[int, tuple[str | None, float]] = {}
+        if found:
+            # Pick up users enrolled or removed since the server started
+            self.user_gallery.refresh()
+            with metrics.span("server.match"):
+                matched = self.user_gallery.identify_batch(np.asarray([encodings[i] for i in found]), self.tolerance)
+            identities = dict(zip(found, matched))
+
+        results: list[dict[str, object]] = []
+        for i, encoding in enumerate(encodings):
+            if i not in identities:
+                metrics.increment("no_face")
+                results.append({"user_id": None, "reason": "no face found"})
+                continue
+            matched_id, distance = identities[i]
+            record = self.lookup(matched_id) if matched_id is not None else None
+            if record is None:
+                metrics.increment("rejects")
+                results.append({"user_id": None, "reason": "not recognized", "distance": round(distance, 4)})
+                continue
+            metrics.increment("matches")
+            checked_in = False
+            if self.check_in:
+                # False while the user is within the cooldown of an earlier check-in
+                checked_in = attendance_store.record(record["email"])
+                self.refine(matched_id, encoding, distance)
+            results.append({"user_id": matched_id, "name": f"{record['first_name']} {record['last_name']}",
+                            "email": record["email"], "distance": round(distance, 4), "checked_in": checked_in})
+        return results
+
+    def refine(self, user_num: str, encoding: np.ndarray, distance: float) -> None:
+        # Refining reads and writes the users embedding file, it runs in the background and its failures are reported
+        future = self.refiner.submit(templates.refine, user_num, encoding, distance, key_manager.get_cipher())
+        self.refining.add(future)
+
+        def finished(done: Future) -> None:
+            self.refining.discard(done)
+            error = done.exception()
+            if error is not None:
+                metrics.increment("refine_failures")
+                print(f"Failed to refine the template of user {user_num}: {error}")
+
+        future.add_done_callback(finished)
+
+    def lookup(self, user_num: str) -> dict[str, str] | None:
+        # Users enrolled after the server started are looked up once and remembered
+        record = self.users.get(user_num)
+        if record is None:
+            record = user_registry.find_by_id(user_num)
+            if record is not None:
+                self.users[user_num] = record
+        return record
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Keep the connection open for further requests unless the client asks to close it
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                start = time.perf_counter()
+                status, payload = await self.route(method, path, body)
+                if isinstance(payload, dict):
+                    payload["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(build_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes | None) -> tuple[int, dict | str]:
+        if method == "POST" and path == "/recognize":
+            if body is None:
+                return 413, {"error": "frame too large"}
+            if not body:
+                return 400, {"error": "the request body must be a JPEG frame"}
+            try:
+                with metrics.span("server.request"):
+                    return 200, await self.recognize(body)
+            except Exception as e:
+                return 500, {"error": str(e)}
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "users": self.user_gallery.user_count, "encodings": len(self.user_gallery),
+                         "workers": self.workers, "cpu_count": os.cpu_count()}
+        if method == "GET" and path == "/metrics":
+            return 200, metrics.render_prometheus()
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def serve(self, host: str, port: int) -> None:
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Recognition server listening on http://{host}:{port} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.pool.shutdown()
+            self.matcher.shutdown()
+            # Let refinements already started finish writing their embedding files
+            self.refiner.shutdown(wait=True)
+
+#=========================================================================================================================================
+# function that reads one HTTP request
+async def read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes | None] | None:
+    """
+        Reads one HTTP/1.1 request from a connection
+
+        Returns:
+            request (tuple[str, str, dict[str, str], bytes] | None): Method, path, lower-cased headers and body (None if too large), None once the client is gone
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) < 2:
+        return None
+    headers: dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY:
+        # The body is never read, so the connection is closed after the rejection
+        headers["connection"] = "close"
+        return parts[0].upper(), parts[1].split("?")[0], headers, None
+    body = await reader.readexactly(length) if length else b""
+    return parts[0].upper(), parts[1].split("?")[0], headers, body
+
+#=========================================================================================================================================
+# function that builds an HTTP response
+def build_response(status: int, payload: dict | str, keep_alive: bool = True) -> bytes:
+    if isinstance(payload, str):
+        body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+    else:
+        body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+#=========================================================================================================================================
+
+def main() -> None:
+    """
+        Parses the command line, loads the gallery and runs the server until interrupted
+    """
+    import facial_recognition             # for the configured detector and the image folder
+
+    parser = argparse.ArgumentParser(description="Serve face recognition to door terminals over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="decode/encode worker processes (default: number of cores)")
+    parser.add_argument("--storage", choices=list(gallery.STORAGE_TYPES), default=facial_recognition.gallery_storage, help="storage type of the gallery matrix")
+    parser.add_argument("--snapshot", action="store_true", default=facial_recognition.gallery_snapshot,
+                        help="share the gallery through an unencrypted snapshot in /dev/shm")
+    parser.add_argument("--no-check-in", action="store_true", help="only identify, do not take attendance (for load tests)")
+    args = parser.parse_args()
+
+    user_gallery = gallery.load_gallery(key_manager.get_cipher(), facial_recognition.certified_folder, storage=args.storage, snapshot=args.snapshot)
+    print(f"Loaded {len(user_gallery)} encodings of {user_gallery.user_count} users")
+    gallery.start_background_compaction(user_gallery)
+    server = RecognitionServer(user_gallery, args.workers, facial_recognition.get_detector(), not args.no_check_in)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+if __name__ == "__main__":
+    main()
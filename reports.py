@@ -0,0 +1,202 @@
+# description: Attendance reports for HR. Summaries are read from the daily and weekly aggregates kept by the attendance store,
+#              so a month-end report reads one row per user and day instead of every check-in. Exports stream rows to CSV or
+#              Parquet in chunks, so ranges of millions of check-ins never have to fit in memory.
+#
+#              usage: python reports.py summary --start 2025-04-01 --end 2025-04-30
+#                     python reports.py export april.parquet --table daily --start 2025-04-01 --end 2025-04-30
+
+################################################################################################################################################################
+
+# Import needed libraries
+import argparse                           # for the command line
+import csv                                # for the CSV export
+from datetime import date                 # for the report ranges
+from pathlib import Path                  # for handling file paths in an OS-independent way
+import attendance_store                   # for the check-ins and their aggregates
+
+
+# Rows read from the database and written out at a time
+EXPORT_CHUNK: int = 50000
+
+# Columns of every table that can be exported, and whether each one holds text or a number
+EXPORT_COLUMNS: dict[str, dict[str, type]] = {
+    "attendance": {"email": str, "date": str, "time": str},
+    "daily": {"email": str, "date": str, "week": str, "first_in": str, "last_out": str, "check_ins": int},
+    "weekly": {"email": str, "week": str, "days_present": int, "seconds_present": int, "late_arrivals": int},
+}
+
+# Column every table is filtered on by the date range
+RANGE_COLUMNS: dict[str, str] = {"attendance": "date", "daily": "date", "weekly": "week"}
+
+
+#=========================================================================================================================================
+# function that sums up every user over a date range
+def period_summary(start: date, end: date, email: str | None = None) -> list[dict[str, object]]:
+    """
+        Sums up the days present, hours present and late arrivals of every user over a date range, from the daily aggregates
+
+        Args:
+            start (date): First day to include
+            end (date): Last day to include
+            email (str | None): Only this user, None for everyone
+
+        Returns:
+            summary (list[dict[str, object]]): One row per user present at least once, ordered by email
+    """
+    query = (
+        "SELECT email, COUNT(*), SUM(strftime('%s', last_out) - strftime('%s', first_in)), SUM(first_in > ?), "
+        "MIN(first_in), MAX(last_out) FROM daily WHERE date BETWEEN ? AND ?"
+    )
+    parameters: list[object] = [attendance_store.LATE_AFTER, start.isoformat(), end.isoformat()]
+    if email is not None:
+        query += " AND email = ?"
+        parameters.append(email)
+    rows = attendance_store.query(query + " GROUP BY email ORDER BY email", parameters)
+    return [{"email": row[0], "days_present": row[1], "hours_present": round(row[2] / 3600, 2), "late_arrivals": row[3],
+             "earliest_in": row[4], "latest_out": row[5]} for row in rows]
+
+#=========================================================================================================================================
+# function that lists the days of one user
+def daily_summary(email: str, start: date, end: date) -> list[tuple[str, str, str, int]]:
+    """
+        Lists the first check-in, last check-in and number of check-ins of a user on every day of a range
+
+        Args:
+            email (str): Email of the user
+            start (date): First day to include
+            end (date): Last day to include
+
+        Returns:
+            days (list[tuple[str, str, str, int]]): (date, first in, last out, check-ins), dates as YYYY-MM-DD
+    """
+    return attendance_store.query(
+        "SELECT date, first_in, last_out, check_ins FROM daily WHERE email = ? AND date BETWEEN ? AND ? ORDER BY date",
+        (email, start.isoformat(), end.isoformat()),
+    )
+
+#=========================================================================================================================================
+# function that lists the weeks of one user
+def weekly_summary(email: str, start: date, end: date) -> list[tuple[str, int, float, int]]:
+    """
+        Lists the days present, hours present and late arrivals of a user for every week that starts in a range
+
+        Args:
+            email (str): Email of the user
+            start (date): First day to include
+            end (date): Last day to include
+
+        Returns:
+            weeks (list[tuple[str, int, float, int]]): (Monday of the week, days present, hours present, late arrivals)
+    """
+    rows = attendance_store.query(
+        "SELECT week, days_present, seconds_present, late_arrivals FROM weekly WHERE email = ? AND week BETWEEN ? AND ? ORDER BY week",
+        (email, attendance_store.week_of(start.isoformat()), end.isoformat()),
+    )
+    return [(week, days, round(seconds / 3600, 2), late) for week, days, seconds, late in rows]
+
+#=========================================================================================================================================
+# function that streams the rows of a table over a date range
+def _export_rows(table: str, start: date | None, end: date | None):
+    """
+        Yields the rows of a table over a date range in chunks, from a read-only connection of its own so check-ins keep being written
+
+        Yields:
+            rows (list[tuple]): Up to EXPORT_CHUNK rows at a time, in date order
+    """
+    column = RANGE_COLUMNS[table]
+    low = start.isoformat() if start else "0000-00-00"
+    # A week is kept under its Monday, so the week the range starts in is included
+    if start and table == "weekly":
+        low = attendance_store.week_of(low)
+    high = end.isoformat() if end else "9999-99-99"
+    connection = attendance_store.open_reader()
+    try:
+        # The date index lets SQLite read the range in order without sorting it
+        cursor = connection.execute(f"SELECT {', '.join(EXPORT_COLUMNS[table])} FROM {table} WHERE {column} BETWEEN ? AND ? ORDER BY {column}",
+                                    (low, high))
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            yield rows
+    finally:
+        connection.close()
+
+#=========================================================================================================================================
+# function that exports a table over a date range
+def export(path: Path, table: str = "attendance", start: date | None = None, end: date | None = None) -> int:
+    """
+        Writes the rows of a table over a date range to CSV or Parquet, chosen by the file suffix, one chunk at a time.
+        Parquet needs pyarrow, which is only imported when a Parquet file is asked for.
+
+        Args:
+            path (Path): File to write, .parquet for Parquet and anything else for CSV
+            table (str): "attendance" for the raw check-ins, "daily" or "weekly" for the aggregates
+            start (date | None): First day to include, None for no lower limit
+            end (date | None): Last day to include, None for no upper limit
+
+        Returns:
+            written (int): Number of rows written
+
+        Raise:
+            ValueError: If the table is not one of EXPORT_COLUMNS
+            ImportError: If a Parquet file is asked for and pyarrow is not installed
+    """
+    if table not in EXPORT_COLUMNS:
+        raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(EXPORT_COLUMNS)}")
+    columns = EXPORT_COLUMNS[table]
+    written: int = 0
+
+    if path.suffix.lower() == ".parquet":
+        try:
+            import pyarrow as pa                  # for the Parquet columns
+            import pyarrow.parquet as pq          # for writing Parquet row groups
+        except ImportError as e:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from e
+        schema = pa.schema([(name, pa.string() if kind is str else pa.int64()) for name, kind in columns.items()])
+        # Every chunk becomes one row group, so only one chunk is in memory at a time
+        with pq.ParquetWriter(path, schema) as writer:
+            for rows in _export_rows(table, start, end):
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                written += len(rows)
+        return written
+
+    with open(path, "w", newline="") as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(columns)
+        for rows in _export_rows(table, start, end):
+            csv_writer.writerows(rows)
+            written += len(rows)
+    return written
+
+#=========================================================================================================================================
+
+def main() -> None:
+    """
+        Parses the command line and prints a summary or writes an export
+    """
+    parser = argparse.ArgumentParser(description="Attendance reports and exports.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="days present, hours present and late arrivals of every user")
+    summary_parser.add_argument("--email", help="only this user")
+    export_parser = commands.add_parser("export", help="write check-ins or aggregates to CSV or Parquet")
+    export_parser.add_argument("path", type=Path, help="output file, .parquet for Parquet and anything else for CSV")
+    export_parser.add_argument("--table", choices=list(EXPORT_COLUMNS), default="attendance", help="raw check-ins or daily/weekly aggregates")
+    for command_parser in (summary_parser, export_parser):
+        command_parser.add_argument("--start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+        command_parser.add_argument("--end", type=date.fromisoformat, help="last day, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        start = args.start or date.today().replace(day=1)
+        end = args.end or date.today()
+        print(f"Attendance from {attendance_store.to_display(start.isoformat())} to {attendance_store.to_display(end.isoformat())}")
+        for row in period_summary(start, end, args.email):
+            print(f"\t{row['email']}: {row['days_present']} days, {row['hours_present']} hours, {row['late_arrivals']} late arrivals")
+    else:
+        written = export(args.path, args.table, args.start, args.end)
+        print(f"Wrote {written} rows to {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# description: Reading and writing of the encrypted enrollment images. Frames are JPEG encoded in memory and encrypted straight into
+#              their final file, so the unencrypted face never touches the disk, and images are decrypted and decoded without
+#              extra copies.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import cv2                                # for JPEG encoding and decoding
+import numpy as np                        # for numerical operations
+import os                                 # file directory and handling, for interacting with the OS
+import tempfile                           # for a temporary file of its own for every writer
+from contextlib import contextmanager     # for holding a file lock in a with block
+try:
+    import fcntl                          # for locking files between processes on Linux and macOS
+except ImportError:
+    fcntl = None
+    import msvcrt                         # for locking files between processes on Windows
+from cryptography.fernet import MultiFernet     # for symmetric encryption and decryption
+import metrics                            # for counting decrypt failures
+
+
+#=========================================================================================================================================
+# function that writes a file so readers only ever see the old or the complete new contents
+def atomic_write(path: str | os.PathLike, data: bytes) -> None:
+    """
+        Writes data to a temporary file next to the target and renames it over the target. Every writer gets a
+        temporary file of its own, so two writers of the same path never share one, and the data and the rename
+        are flushed to disk so a crash cannot leave an empty file behind.
+
+        Args:
+            path (str | os.PathLike): Path of the file to write
+            data (bytes): Contents of the file
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    descriptor, tmp_path = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Never leave a half-written temporary file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # The rename itself is only durable once the folder is flushed, Windows cannot open folders and does not need it
+    if os.name != "nt":
+        folder_descriptor = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(folder_descriptor)
+        finally:
+            os.close(folder_descriptor)
+
+#=========================================================================================================================================
+# function that holds an exclusive lock between processes and threads
+@contextmanager
+def file_lock(path: str | os.PathLike):
+    """
+        Holds an exclusive lock on a lock file for the length of a with block. Every caller opens the file itself,
+        so the lock keeps out other threads of the same process as well as other processes.
+
+        Args:
+            path (str | os.PathLike): Path of the lock file, created if missing
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+#=========================================================================================================================================
+# function that encrypts a frame straight into its final file
+def write_encrypted_image(path: str | os.PathLike, frame: np.ndarray, cipher: MultiFernet) -> None:
+    """
+        JPEG encodes a frame in memory, encrypts it and writes it with a single atomic write
+
+        Args:
+            path (str | os.PathLike): Path of the encrypted image
+            frame (np.ndarray): Image in OpenCV BGR order
+            cipher (MultiFernet): Cipher used to encrypt the image
+
+        Raise:
+            ValueError: If the frame could not be JPEG encoded
+    """
+    ok, jpeg = cv2.imencode(".jpg", frame)
+    if not ok:
+        raise ValueError(f"Could not encode image {path}")
+    atomic_write(path, cipher.encrypt(jpeg.tobytes()))
+
+#=========================================================================================================================================
+# function that decrypts and decodes an encrypted image
+def read_encrypted_image(path: str | os.PathLike, cipher: MultiFernet) -> np.ndarray | None:
+    """
+        Decrypts an image in memory and decodes it
+
+        Args:
+            path (str | os.PathLike): Path of the encrypted image
+            cipher (MultiFernet): Cipher used to decrypt the image
+
+        Returns:
+            img (np.ndarray | None): The image in OpenCV BGR order, or None if it could not be decrypted or decoded
+    """
+    # Decrypt image into memory
+    with open(path, "rb") as encrypted_file:
+        try:
+            decrypted_data = cipher.decrypt(encrypted_file.read())
+        except Exception as e:
+            metrics.increment("decrypt_failures")
+            print(f"Failed to decrypt {path}: {e}")
+            return None
+
+    # np.frombuffer wraps the decrypted bytes without copying them
+    img = cv2.imdecode(np.frombuffer(decrypted_data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        print(f"Error decoding image: {path}")
+    return img
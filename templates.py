@@ -0,0 +1,147 @@
+# description: Compact per-user templates. Instead of matching against every raw enrollment shot, each user is represented by the
+#              centroid of their encodings plus a few medoids that keep the spread of poses and glasses. The encodings behind a
+#              template are refined from check-ins that matched with high confidence, so the template follows a user as they
+#              change, while the enrollment photos always stay as an anchor.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import numpy as np                        # for numerical operations
+from datetime import datetime             # for the time since the last update
+from hashlib import blake2b               # for recognizing encodings a template was already built from
+from cryptography.fernet import MultiFernet     # for symmetric encryption and decryption
+import embedding_store                    # for the encrypted per-user face encodings
+import metrics                            # for counting template updates
+import secure_images                      # for serializing updates of the same user
+from ttl_cache import TTLCache            # for the templates built for 1:1 logins
+
+
+# Medoids kept next to the centroid, a template has at most this many rows plus one
+TEMPLATE_MEDOIDS: int = 3
+
+# Check-ins matched closer than this are trusted to refine the template, well inside the 0.6 match tolerance
+UPDATE_DISTANCE: float = 0.4
+
+# Check-in encodings closer than this to a kept encoding add nothing new and are skipped
+MIN_NOVELTY: float = 0.05
+
+# Most encodings kept per user, enrollment photos included
+MAX_SAMPLES: int = 20
+
+# Seconds between two updates of the same user, so a single bad camera day cannot take over the template
+MIN_UPDATE_SECONDS: float = 6 * 60 * 60
+
+# Templates built for 1:1 logins are kept this many seconds, for at most this many users
+TEMPLATE_CACHE_SECONDS: float = 60 * 60
+TEMPLATE_CACHE_ENTRIES: int = 1000
+
+# User ID -> (digest of the encodings, template), so a login only builds a template when the encodings changed
+_templates = TTLCache(TEMPLATE_CACHE_SECONDS, TEMPLATE_CACHE_ENTRIES)
+
+
+#=========================================================================================================================================
+# function that condenses the encodings of a user into a template
+def build_template(samples: np.ndarray, medoids: int = TEMPLATE_MEDOIDS) -> np.ndarray:
+    """
+        Builds the template of a user: the centroid of their encodings followed by the medoids picked greedily, each one
+        the encoding that lowers the total distance from every encoding to its closest medoid the most
+
+        Args:
+            samples (np.ndarray): The (count, 128) encodings of the user
+            medoids (int): Number of medoids next to the centroid
+
+        Returns:
+            template (np.ndarray): The (rows, 128) template, the samples themselves if there are too few to condense
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, embedding_store.ENCODING_DIM)
+    if len(samples) <= medoids + 1:
+        return samples.copy()
+
+    distances = np.linalg.norm(samples[:, None, :] - samples[None, :, :], axis=2)
+    closest = np.full(len(samples), np.inf, dtype=np.float32)      # distance of every sample to its closest medoid so far
+    chosen: list[int] = []
+    for _ in range(medoids):
+        # Total distance if each sample became the next medoid
+        cost = np.minimum(closest[None, :], distances).sum(axis=1)
+        cost[chosen] = np.inf
+        best = int(np.argmin(cost))
+        chosen.append(best)
+        closest = np.minimum(closest, distances[best])
+    return np.vstack([samples.mean(axis=0, keepdims=True), samples[chosen]])
+
+#=========================================================================================================================================
+# function that returns the template of a user, built only when their encodings changed
+def cached_template(user_num: str, samples: np.ndarray) -> np.ndarray:
+    """
+        Returns the template of a user from the cache, building it only if the encodings differ from the ones it was
+        built from. A refined or re-enrolled user gets a new template on their next login.
+
+        Args:
+            user_num (str): The users ID number
+            samples (np.ndarray): The (count, 128) encodings of the user
+
+        Returns:
+            template (np.ndarray): The (rows, 128) template
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    digest = blake2b(samples.tobytes(), digest_size=16).digest()
+    entry = _templates.get(user_num)
+    if entry is not None and entry[0] == digest:
+        return entry[1]
+    template = build_template(samples)
+    _templates.put(user_num, (digest, template))
+    return template
+
+#=========================================================================================================================================
+# function that refines a users encodings from a confident check-in
+def refine(user_num: str, encoding: np.ndarray, distance: float, cipher: MultiFernet) -> bool:
+    """
+        Adds the encoding of a confident check-in to the users stored encodings. Once MAX_SAMPLES are kept the oldest
+        check-in encoding is evicted, the enrollment encodings are never evicted. Saving appends to the embedding log,
+        so every running gallery rebuilds the users template within a second. Updates of the same user hold a lock
+        file from loading to saving, so concurrent check-ins never drop each others encodings.
+
+        Args:
+            user_num (str): The users ID number
+            encoding (np.ndarray): The 128-d encoding of the check-in
+            distance (float): Distance the check-in matched with
+            cipher (MultiFernet): Cipher used to decrypt and encrypt the embedding file
+
+        Returns:
+            updated (bool): True if the encoding was added
+    """
+    if distance > UPDATE_DISTANCE:
+        return False
+    path = embedding_store.embedding_path(user_num)
+    if not path.is_file():
+        return False
+    with secure_images.file_lock(path.with_name(path.name + ".lock")):
+        return _refine_locked(user_num, encoding, cipher)
+
+def _refine_locked(user_num: str, encoding: np.ndarray, cipher: MultiFernet) -> bool:
+    # The caller holds the lock file of the user
+    stored = embedding_store.load_embeddings_with_header(user_num, cipher)
+    # Users marked as having no usable face have nothing to refine
+    if stored is None or not len(stored[0]):
+        return False
+    samples, header = stored
+    enrolled: int = header.get("enrolled", len(samples))
+    if enrolled >= MAX_SAMPLES:
+        return False
+    # Rate limited from the last check-in update, not from enrollment, so the first check-ins of a new user refine it at once
+    updated = header.get("updated")
+    if updated is not None and (datetime.now() - datetime.fromisoformat(updated)).total_seconds() < MIN_UPDATE_SECONDS:
+        return False
+
+    encoding = np.asarray(encoding, dtype=np.float32)
+    if np.linalg.norm(samples - encoding, axis=1).min() < MIN_NOVELTY:
+        return False
+
+    # Check-in encodings are kept after the enrollment ones, oldest first
+    samples = np.vstack([samples, encoding])
+    if len(samples) > MAX_SAMPLES:
+        samples = np.delete(samples, enrolled, axis=0)
+    embedding_store.save_embeddings(user_num, samples, cipher, source="check-in", enrolled=enrolled,
+                                    updated=datetime.now().isoformat(timespec="seconds"))
+    metrics.increment("template_updates")
+    return True
@@ -0,0 +1,90 @@
+# description: Small bounded cache whose entries expire. Used as the check-in cooldown in front of the attendance writer and as
+#              the per-track recognition cache of the kiosk pipeline. Entries live for a fixed number of seconds and the least
+#              recently used entry is dropped once the cache is full, so memory stays bounded however many people walk past.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import threading                          # for sharing one cache between threads
+import time                               # for the default clock
+from collections import OrderedDict       # for the least recently used order
+
+
+#=========================================================================================================================================
+# class for the bounded cache with expiring entries
+class TTLCache:
+    """
+        Maps keys to values for ttl seconds each, keeping at most max_entries. Reading an entry does not
+        extend its lifetime, it only marks it as recently used.
+
+        Args:
+            ttl (float): Seconds an entry stays valid after it was put
+            max_entries (int): Most entries kept, the least recently used one is dropped beyond this
+    """
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self._entries: OrderedDict[object, tuple[float, object]] = OrderedDict()     # key -> (expiry, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key: object, now: float | None = None) -> object | None:
+        """
+            Looks a key up
+
+            Args:
+                key (object): The key
+                now (float | None): Current time in seconds, defaults to time.monotonic()
+
+            Returns:
+                value (object | None): The value, None if the key is missing or expired
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: object, value: object, now: float | None = None) -> None:
+        """
+            Stores a value for ttl seconds from now, dropping the least recently used entry if the cache is full
+
+            Args:
+                key (object): The key
+                value (object): The value
+                now (float | None): Current time in seconds, defaults to time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._store(key, value, now)
+
+    def add_if_absent(self, key: object, value: object, now: float | None = None) -> bool:
+        """
+            Stores a value only if the key has no valid entry, in one step so two threads cannot both add it
+
+            Returns:
+                added (bool): True if the value was stored, False if the key already had a valid entry
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return False
+            self._store(key, value, now)
+            return True
+
+    def _store(self, key: object, value: object, now: float) -> None:
+        # The caller holds the lock
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,182 @@
+# description: SQLite registry of every user account. Replaces the linear scan of records.csv with indexed lookups by email and by
+#              ID, hands out user IDs atomically and keeps emails unique. The old records.csv is imported once, keeping its IDs.
+
+################################################################################################################################################################
+
+# Import needed libraries
+import csv                                # for importing the old records.csv
+import sqlite3                            # for the indexed user database
+from pathlib import Path                  # for handling file paths in an OS-independent way
+
+
+# Define the path to the user database
+registry_path: Path = Path("users.db")
+
+# Define the path to the CSV file the user records used to be kept in
+csv_file_path: Path = Path("records.csv")
+
+# Columns of a user record besides the ID, in the same order as records.csv
+USER_FIELDS: list[str] = ["first_name", "last_name", "email", "phone_number", "home_address"]
+
+# Set once the schema exists and records.csv was imported in this process
+_initialized: bool = False
+
+
+#=========================================================================================================================================
+# function that opens the user database, creating and migrating it the first time
+def connect() -> sqlite3.Connection:
+    """
+        Opens a connection to the user database, creating the table and importing records.csv if needed
+
+        Returns:
+            connection (sqlite3.Connection): Connection whose rows can be read like dictionaries
+    """
+    global _initialized
+    # timeout makes a second enrollment wait for the first one instead of failing
+    connection = sqlite3.connect(registry_path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    if not _initialized:
+        with connection:
+            # The email column is UNIQUE, which also gives it the index used for lookups
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "first_name TEXT NOT NULL, "
+                "last_name TEXT NOT NULL, "
+                "email TEXT NOT NULL UNIQUE, "
+                "phone_number TEXT NOT NULL, "
+                "home_address TEXT NOT NULL)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        migrate_from_csv(connection)
+        _initialized = True
+    return connection
+
+#=========================================================================================================================================
+# function that imports records.csv into the database once
+def migrate_from_csv(connection: sqlite3.Connection) -> int:
+    """
+        Imports the users of records.csv with their existing IDs, only the first time the database is opened.
+        A row whose ID or email was already imported is skipped, and every skipped row is printed and counted.
+
+        Args:
+            connection (sqlite3.Connection): Open connection to the user database
+
+        Returns:
+            imported (int): Number of users imported
+    """
+    # Already migrated, or nothing to migrate
+    if connection.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone() is not None:
+        return 0
+    imported: int = 0
+    skipped: int = 0
+    with connection:
+        if csv_file_path.is_file():
+            with open(csv_file_path, "r") as file:
+                reader: csv.DictReader = csv.DictReader(file)  # Read rows as dictionaries
+                for row in reader:
+                    # Keep the first account of a duplicated email or ID, like the old lookup did
+                    cursor = connection.execute(
+                        "INSERT OR IGNORE INTO users (id, first_name, last_name, email, phone_number, home_address) VALUES (?, ?, ?, ?, ?, ?)",
+                        [int(row["id"])] + [row.get(field) or "" for field in USER_FIELDS],
+                    )
+                    if cursor.rowcount:
+                        imported += 1
+                        continue
+                    # Say which row was dropped and why, its photos and check-ins now belong to nobody or to the kept account
+                    skipped += 1
+                    taken = connection.execute("SELECT id, email FROM users WHERE id = ? OR email = ?", (int(row["id"]), row.get("email") or "")).fetchone()
+                    print(f"Skipped line {reader.line_num} of {csv_file_path} (ID {row['id']}, {row.get('email')}): "
+                          f"ID or email already taken by user {taken['id']} ({taken['email']})")
+            print(f"Imported {imported} users from {csv_file_path}" + (f", skipped {skipped} duplicate rows" if skipped else ""))
+        connection.execute("INSERT INTO meta (key, value) VALUES ('csv_migrated', ?)", (str(imported),))
+        connection.execute("INSERT INTO meta (key, value) VALUES ('csv_skipped', ?)", (str(skipped),))
+    return imported
+
+#=========================================================================================================================================
+# function that turns a database row into a user record
+def _to_record(row: sqlite3.Row | None) -> dict[str, str] | None:
+    if row is None:
+        return None
+    record: dict[str, str] = {field: row[field] for field in USER_FIELDS}
+    record["id"] = str(row["id"])
+    return record
+
+#=========================================================================================================================================
+# function that adds a new user and hands out their ID
+def register_user(records: dict[str, str]) -> int:
+    """
+        Stores a new user record and allocates its ID in the same transaction
+
+        Args:
+            records (dict[str, str]): Basic user information
+
+        Returns:
+            user_num (int): The new users ID number
+
+        Raise:
+            ValueError: If the email is already registered
+    """
+    connection = connect()
+    try:
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO users (first_name, last_name, email, phone_number, home_address) VALUES (?, ?, ?, ?, ?)",
+                [records.get(field, "") for field in USER_FIELDS],
+            )
+    except sqlite3.IntegrityError:
+        raise ValueError(f"The email {records.get('email')} is already registered")
+    finally:
+        connection.close()
+    return int(cursor.lastrowid)
+
+#=========================================================================================================================================
+# function that looks a user up by email
+def find_by_email(email: str) -> dict[str, str] | None:
+    """
+        Looks a user up by email
+
+        Args:
+            email (str): Email of the user
+
+        Returns:
+            record (dict[str, str] | None): The user record, or None if the email is not registered
+    """
+    connection = connect()
+    try:
+        return _to_record(connection.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone())
+    finally:
+        connection.close()
+
+#=========================================================================================================================================
+# function that looks a user up by ID
+def find_by_id(user_num: str | int) -> dict[str, str] | None:
+    """
+        Looks a user up by ID
+
+        Args:
+            user_num (str | int): The users ID number
+
+        Returns:
+            record (dict[str, str] | None): The user record, or None if there is no such user
+    """
+    connection = connect()
+    try:
+        return _to_record(connection.execute("SELECT * FROM users WHERE id = ?", (int(user_num),)).fetchone())
+    finally:
+        connection.close()
+
+#=========================================================================================================================================
+# function that loads every user keyed by ID
+def all_users() -> dict[str, dict[str, str]]:
+    """
+        Reads every user record, for screens that show names of many users at once
+
+        Returns:
+            user_records (dict[str, dict[str, str]]): Every user record keyed by the users ID
+    """
+    connection = connect()
+    try:
+        return {str(row["id"]): _to_record(row) for row in connection.execute("SELECT * FROM users")}
+    finally:
+        connection.close()